@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""Measures the average memory used per item by TodoList and CheatSheet.
+
+Lists are measured both with built items and loaded lazily, with the records
+of the items in the column store of the list (see sjb.common.columns).
+
+Usage (from the project directory):
+  python3 scripts/measure_memory.py [num_items]
+"""
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import sjb.cs.classes
+import sjb.td.classes
+
+_NUM_TAGS = 50
+
+
+def _todo_dicts(n):
+  for i in range(1, n + 1):
+    yield {
+      'oid': i,
+      'text': 'todo item number %d' % i,
+      'tags': ['tag%d' % (i % _NUM_TAGS), 'tag%d' % (i % 7)],
+      'priority': 1 + i % 3,
+      'finished': i % 2 == 0,
+      'created_date': 1527001163.5 + i,
+      'finished_date': 1527101163.5 + i if i % 2 == 0 else None,
+    }
+
+
+def _entry_dicts(n):
+  for i in range(1, n + 1):
+    yield {
+      'oid': i,
+      'clue': 'clue number %d' % i,
+      'answer': 'answer number %d' % i,
+      'primary': 'primary%d' % (i % _NUM_TAGS),
+      'tags': ['tag%d' % (i % 7)],
+    }
+
+
+def measure(name, build, n):
+  """Prints the number of bytes allocated per item by build(n)."""
+  tracemalloc.start()
+  lst = build(n)
+  used = tracemalloc.get_traced_memory()[0]
+  tracemalloc.stop()
+  print('%-20s %8d items %10.1f bytes/item' % (name, lst.size(), used / n))
+
+
+def main():
+  n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+  for lazy in [False, True]:
+    suffix = ' (lazy)' if lazy else ''
+    measure('TodoList' + suffix, lambda n: sjb.td.classes.TodoList.from_dict(
+      {'todo_list': {'todos': list(_todo_dicts(n))}}, lazy=lazy), n)
+    measure('CheatSheet' + suffix, lambda n: (
+      sjb.cs.classes.CheatSheet.from_dict(
+        {'cheatsheet': {'entries': list(_entry_dicts(n))}}, lazy=lazy)), n)
+
+
+if __name__ == '__main__':
+  main()
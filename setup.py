@@ -23,6 +23,9 @@ setup(
     install_requires=[
         'configobj >= 5.0.6'
     ],
+    extras_require={
+        'fast': ['orjson'],
+    },
     python_requires='>=3',
     long_description=long_description,
     url='https://github.com/sicklybeans/sjb-tools',
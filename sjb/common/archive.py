@@ -0,0 +1,246 @@
+"""Module implementing the archive kept next to a list file.
+
+Old items are moved out of a list into segments of its archive, one per
+month of the date they are archived by. A segment is a journal (see
+sjb.common.journal) that is only appended to: archiving appends put records,
+and restoring items appends remove records.
+
+The index file of the archive holds a header for every segment:
+
+  {"segments": {"2018-05": {"oids": [...], "low": 1525132800.0,
+                            "high": 1527807599.0, "tags": [...],
+                            "size": 4096}}}
+
+The oids are those in the segment; low, high and tags bound the dates and
+tags of its items (they are not narrowed when items are restored). size is
+the committed size of the segment, so that a torn tail left by a crash is
+dropped by the next append. Queries read the headers to only open the
+segments that can hold a match (see sjb.common.query.Matcher.could_match).
+"""
+import bisect
+import collections
+import json
+import os
+import time
+import sjb.common.journal
+import sjb.common.query
+import sjb.common.storage
+
+_INDEX_EXTENSION = '.archive.index'
+_SEGMENT_EXTENSION = '.archive.'
+
+# Format of the time.strftime keys of the segments, i.e. one per month.
+SEGMENT_FORMAT = '%Y-%m'
+
+
+def segment_key(date):
+  """Returns the key of the segment holding items archived by date, in UTC."""
+  return time.strftime(SEGMENT_FORMAT, time.gmtime(date))
+
+
+class Archive(object):
+  """The segments and index archiving the old items of a list file."""
+
+  def __init__(self, list_file, field, durability=None):
+    """Initializes an Archive.
+
+    Args:
+      list_file (str): The list file whose items are archived.
+      field (str): The date field items are archived by.
+      durability (str): One of sjb.common.storage.DURABILITY_CHOICES.
+    """
+    self._list_file = list_file
+    self._field = field
+    self._durability = durability
+    # Maps the key of each segment to its header, once read.
+    self._headers = None
+    self._oids = None
+
+  def _get_index_file(self):
+    return self._list_file + _INDEX_EXTENSION
+
+  def _get_segment_file(self, key):
+    return self._list_file + _SEGMENT_EXTENSION + key
+
+  def headers(self):
+    """Returns the dict mapping the key of each segment to its header. It
+    must not be modified."""
+    if self._headers is None:
+      try:
+        with open(self._get_index_file(), 'r') as f:
+          self._headers = json.load(f)['segments']
+      except FileNotFoundError:
+        self._headers = {}
+    return self._headers
+
+  def oids(self):
+    """Returns the set of archived oids. It must not be modified."""
+    if self._oids is None:
+      self._oids = set()
+      for header in self.headers().values():
+        self._oids.update(header['oids'])
+    return self._oids
+
+  def select(self, oid_ranges):
+    """Returns the sorted list of archived oids that are in any of
+    oid_ranges, range objects of oids.
+
+    The sorted oids of every segment header are bisected for each range, so
+    that this does not go through every archived oid.
+    """
+    selected = set()
+    for header in self.headers().values():
+      oids = header['oids']
+      for r in oid_ranges:
+        if not r:
+          continue
+        i = bisect.bisect_left(oids, r[0])
+        while i < len(oids) and oids[i] <= r[-1]:
+          if oids[i] in r:
+            selected.add(oids[i])
+          i += 1
+    return sorted(selected)
+
+  def add(self, records, modified_date):
+    """Appends item records to the segments of their dates.
+
+    Items that are archived already, e.g. because they were restored and
+    archived again, are dropped from any other segment holding them.
+
+    Args:
+      records: list of item dicts as written by Item._to_dict. Their field
+        must not be None.
+      modified_date (float): The modified_date of the commit records.
+    """
+    by_segment = collections.defaultdict(list)
+    for record in records:
+      by_segment[segment_key(record[self._field])].append(record)
+
+    old_headers = self.headers()
+    headers = dict(old_headers)
+    archived = self.oids()
+    moved = {
+      record['oid']: key for key, segment in by_segment.items()
+      for record in segment if record['oid'] in archived}
+    if moved:
+      for key, header in sorted(old_headers.items()):
+        self._drop(headers, key, {
+          oid for oid in moved.keys() & set(header['oids'])
+          if moved[oid] != key}, modified_date)
+
+    for key, segment in sorted(by_segment.items()):
+      header = headers.get(key, {
+        'oids': [], 'low': None, 'high': None, 'tags': [], 'size': 0})
+      dates = [record[self._field] for record in segment]
+      if header['low'] is not None:
+        dates.extend([header['low'], header['high']])
+      tags = set(header['tags'])
+      for record in segment:
+        tags.update(record['tags'])
+      entries = [
+        {'op': sjb.common.journal.OP_PUT, 'item': record}
+        for record in segment]
+      entries.append(
+        {'op': sjb.common.journal.OP_COMMIT, 'modified_date': modified_date})
+      headers[key] = {
+        'oids': sorted(set(header['oids']).union(r['oid'] for r in segment)),
+        'low': min(dates),
+        'high': max(dates),
+        'tags': sorted(tags),
+        'size': self._append(key, entries, header['size']),
+      }
+    self._write_index(headers, old_headers)
+
+  def remove(self, oids, modified_date):
+    """Drops the items with the given oids from their segments.
+
+    Segments left empty are deleted.
+
+    Args:
+      oids: The oids to drop. Oids that are not archived are ignored.
+      modified_date (float): The modified_date of the commit records.
+    """
+    oids = set(oids)
+    old_headers = self.headers()
+    headers = dict(old_headers)
+    for key, header in sorted(old_headers.items()):
+      self._drop(
+        headers, key, oids.intersection(header['oids']), modified_date)
+    self._write_index(headers, old_headers)
+
+  def records(self, oids=None, query=None):
+    """Yields the records of the archived items, segment by segment.
+
+    Args:
+      oids: If not None, only the segments holding one of these oids are
+        read. Records of other oids in them are yielded as well.
+      query (sjb.common.query.Matcher): If not None, only the segments whose
+        header shows they can hold a match are read.
+    """
+    if oids is not None:
+      oids = set(oids)
+    for key, header in sorted(self.headers().items()):
+      if oids is not None and oids.isdisjoint(header['oids']):
+        continue
+      if query is not None and not query.could_match(
+          sjb.common.query.Summary(
+            self._field, header['low'], header['high'], set(header['tags']))):
+        continue
+      yield from self._read_segment(key)
+
+  def clear(self):
+    """Deletes every segment and the index, including the segments that a
+    crash left out of the index."""
+    dirname = os.path.dirname(self._list_file) or '.'
+    prefix = os.path.basename(self._list_file) + _SEGMENT_EXTENSION
+    try:
+      names = os.listdir(dirname)
+    except FileNotFoundError:
+      names = []
+    for name in names:
+      if name.startswith(prefix):
+        sjb.common.journal.remove(os.path.join(dirname, name))
+    self._headers, self._oids = {}, set()
+
+  def _read_segment(self, key):
+    records, _ = sjb.common.journal.read(self._get_segment_file(key))
+    items = collections.OrderedDict()
+    for record in records:
+      if record['op'] == sjb.common.journal.OP_PUT:
+        items[record['item']['oid']] = record['item']
+      elif record['op'] == sjb.common.journal.OP_REMOVE:
+        items.pop(record['oid'], None)
+    return items.values()
+
+  def _drop(self, headers, key, dropped, modified_date):
+    """Appends remove records for the oids dropped to segment key, updating
+    its header in headers, or removes the header if no item is left."""
+    if not dropped:
+      return
+    header = headers[key]
+    kept = [oid for oid in header['oids'] if oid not in dropped]
+    if not kept:
+      del headers[key]
+      return
+    entries = [
+      {'op': sjb.common.journal.OP_REMOVE, 'oid': oid}
+      for oid in sorted(dropped)]
+    entries.append(
+      {'op': sjb.common.journal.OP_COMMIT, 'modified_date': modified_date})
+    headers[key] = dict(
+      header, oids=kept, size=self._append(key, entries, header['size']))
+
+  def _append(self, key, entries, size):
+    return sjb.common.journal.append(
+      self._get_segment_file(key), entries, durability=self._durability,
+      committed_size=size)
+
+  def _write_index(self, headers, old_headers):
+    sjb.common.storage.atomic_write(
+      self._get_index_file(),
+      json.dumps({'segments': headers}, separators=(',', ':'), sort_keys=True),
+      durability=self._durability)
+    self._headers, self._oids = headers, None
+    # Only delete the segments once the index no longer refers to them.
+    for key in old_headers.keys() - headers.keys():
+      sjb.common.journal.remove(self._get_segment_file(key))
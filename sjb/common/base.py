@@ -1,6 +1,15 @@
 """Base classes file used in cheatsheet and todo."""
 import abc
+import bisect
+import collections
+import collections.abc
+import sys
 import time
+import sjb.common.columns
+
+# Sentinel for fields which have not been assigned yet.
+_UNSET = object()
+_EMPTY_SET = frozenset()
 
 
 class Error(Exception):
@@ -37,11 +46,88 @@ class InvalidIDError(Error):
       'InvalidIDError', method, msg)
 
 
+def intern_tags(tags):
+  """Returns a new set holding tags, with all string tags interned.
+
+  Tags are repeated across many items, so interning them lets every item
+  share a single copy of each tag string.
+  """
+  return {sys.intern(tag) if type(tag) is str else tag for tag in tags}
+
+
+def _slot_names(cls):
+  """Returns the names of the slots of cls and of its bases."""
+  names = _SLOT_NAMES.get(cls)
+  if names is None:
+    names = _SLOT_NAMES[cls] = tuple(
+      name for klass in reversed(cls.__mro__)
+      for name in klass.__dict__.get('__slots__', ()))
+  return names
+
+_SLOT_NAMES = {}
+
+
 class Item(abc.ABC):
-  """Abstract class representing an item stored in a list."""
+  """Abstract class representing an item stored in a list.
+
+  Assignments to the fields named in _FIELDS are tracked: the first time a
+  field is reassigned its old value is remembered until the owning list pops
+  the changes with _pop_changes, and the owning list notes the item as
+  dirty. Mutating a field in place (e.g. adding to a tag set) is not tracked,
+  so lists always assign new values.
+  """
+
+  # Names of the fields whose assignments are tracked. Set by subclasses.
+  _FIELDS = ()
+
+  # Items are kept in very large numbers, so avoid a per-object __dict__.
+  # Subclasses should declare __slots__ for their own fields as well.
+  __slots__ = ('_oid', '_changes', '_owner')
 
   def __init__(self, oid=None):
     self._oid = oid
+    self._changes = None
+    # The ItemList holding this item, if any.
+    self._owner = None
+
+  def __setattr__(self, name, value):
+    if name in self._FIELDS:
+      old = getattr(self, name, _UNSET)
+      if old is not _UNSET and old is not value:
+        if self._changes is None:
+          self._changes = {}
+          if self._owner is not None:
+            self._owner._dirty_oids.add(self._oid)
+        self._changes.setdefault(name, old)
+    object.__setattr__(self, name, value)
+
+  def __getstate__(self):
+    # Pickled (e.g. in snapshots) as the tuple of the values of the slots, so
+    # that unpickling need not go through __setattr__.
+    return tuple(getattr(self, name) for name in _slot_names(type(self)))
+
+  def __setstate__(self, state):
+    for name, value in zip(_slot_names(type(self)), state):
+      object.__setattr__(self, name, value)
+
+  @property
+  def changed_fields(self):
+    """dict: Maps each field changed since the last pop to its old value.
+
+    Fields that were reassigned but ended up equal to their old value are not
+    included.
+    """
+    if not self._changes:
+      return {}
+    return {
+      name: old for name, old in self._changes.items()
+      if getattr(self, name) != old}
+
+  def _pop_changes(self):
+    """Returns changed_fields and then forgets about those changes."""
+    changes = self.changed_fields
+    self._changes = None
+    return changes
 
   @property
   def oid(self):
@@ -82,9 +168,176 @@ class Item(abc.ABC):
     """
     return
 
+def _is_record(item):
+  """Returns True if item, an entry of ItemList._items, is a raw record of an
+  item rather than an Item: a dict, or another read only mapping of its
+  fields, such as a row of a mapped binary list file. Mappings other than
+  dicts also give their fields as attributes."""
+  return type(item) is dict or isinstance(item, collections.abc.Mapping)
+
+
+def _record_view(record):
+  """Returns attribute access to the fields of a raw record."""
+  return _RecordView(record) if type(record) is dict else record
+
+
+class _RecordView(object):
+  """Read only attribute access to the fields of a raw item record.
+
+  This lets an ItemList index records of a lazily loaded list with the same
+  code it uses for Item objects, without building the items.
+  """
+  __slots__ = ('_record',)
+
+  def __init__(self, record):
+    self._record = record
+
+  def __getattr__(self, name):
+    try:
+      return self._record[name]
+    except KeyError:
+      raise AttributeError(name)
+
+
+# Kinds of ItemEvent.
+ITEM_ADDED = 'added'
+ITEM_REMOVED = 'removed'
+ITEM_CHANGED = 'changed'
+
+
+class ItemEvent(object):
+  """Describes a change of an ItemList, as sent to its listeners.
+
+  Attributes:
+    kind (str): One of ITEM_ADDED, ITEM_REMOVED or ITEM_CHANGED.
+    item (Item): The added, removed or changed item.
+    changes (dict): For ITEM_CHANGED, maps each changed field to the pair
+      (old value, new value). Empty otherwise.
+  """
+  __slots__ = ('kind', 'item', 'changes')
+
+  def __init__(self, kind, item, changes=None):
+    self.kind = kind
+    self.item = item
+    self.changes = changes or {}
+
+  def __repr__(self):
+    return 'ItemEvent(%r, oid=%r, changes=%r)' % (
+      self.kind, self.item.oid, self.changes)
+
+
+class SortedIndex(object):
+  """Keeps the oids of items sorted by the value of one of their fields.
+
+  Items with equal values are sorted by oid. Items whose value is None are not
+  kept. The values and oids are stored in two parallel lists so the index only
+  costs two list slots per item.
+  """
+  __slots__ = ('_values', '_oids')
+
+  def __init__(self):
+    self._values = []
+    self._oids = []
+
+  def __len__(self):
+    return len(self._oids)
+
+  def _find(self, value, oid):
+    """Returns the position at which (value, oid) is or would be stored."""
+    lo = bisect.bisect_left(self._values, value)
+    hi = bisect.bisect_right(self._values, value, lo)
+    return bisect.bisect_left(self._oids, oid, lo, hi)
+
+  def add(self, value, oid):
+    """Adds oid under value, unless value is None or it is there already."""
+    if value is None:
+      return
+    ind = self._find(value, oid)
+    if ind < len(self._oids) and self._oids[ind] == oid and (
+        self._values[ind] == value):
+      return
+    self._values.insert(ind, value)
+    self._oids.insert(ind, oid)
+
+  def remove(self, value, oid):
+    """Removes oid from under value if it is there."""
+    if value is None:
+      return
+    ind = self._find(value, oid)
+    if ind < len(self._oids) and self._oids[ind] == oid and (
+        self._values[ind] == value):
+      del self._values[ind]
+      del self._oids[ind]
+
+  def _bounds(self, start, end):
+    """Returns the slice of positions holding values in [start, end)."""
+    lo = 0 if start is None else bisect.bisect_left(self._values, start)
+    hi = len(self._values) if end is None else bisect.bisect_left(
+      self._values, end)
+    return lo, max(lo, hi)
+
+  def oids(self, start=None, end=None, reverse=False):
+    """Yields the oids whose values lie in [start, end) in sorted order.
+
+    Args:
+      start: Lower bound of the values, or None for no bound.
+      end: Upper bound (exclusive) of the values, or None for no bound.
+      reverse (bool): If True, yields the oids in reverse order.
+    """
+    lo, hi = self._bounds(start, end)
+    if reverse:
+      for ind in range(hi - 1, lo - 1, -1):
+        yield self._oids[ind]
+    else:
+      yield from self._oids[lo:hi]
+
+  def count(self, start=None, end=None):
+    """Returns the number of oids whose values lie in [start, end)."""
+    lo, hi = self._bounds(start, end)
+    return hi - lo
+
+
 class ItemMatcher(abc.ABC):
   """Abstract class representing a boolean condition for matching an Item."""
 
+  def candidates(self, item_list):
+    """Returns the oids of the items in item_list that could possibly match.
+
+    Matchers that can use the indexes kept by an ItemList override this so
+    that a query only has to call matches on a small subset of the list.
+
+    Args:
+      item_list (ItemList): The list being queried.
+
+    Returns:
+      set(int): oids of the only items that may match, or None if every item
+        in item_list has to be checked.
+    """
+    return None
+
+  def plan(self, item_list):
+    """Plans how to run this matcher against the indexes of item_list.
+
+    See sjb.common.query for matchers that plan themselves from combinators.
+
+    Returns:
+      (set(int), ItemMatcher): The candidates as returned by candidates; and
+        the matcher that still has to be checked on each candidate, or None if
+        every candidate matches.
+    """
+    return self.candidates(item_list), self
+
+  def signature(self):
+    """Returns a hashable value identifying the condition of this matcher.
+
+    Matchers with equal signatures must match the same items. ItemList caches
+    query results by signature.
+
+    Returns:
+      A hashable value, or None if the results should not be cached.
+    """
+    return None
+
   @abc.abstractmethod
   def matches(self, item):
     """Returns true if item matches some criteria, false otherwise.
@@ -98,14 +351,54 @@ class ItemMatcher(abc.ABC):
 class ItemList(abc.ABC):
   """Abstract class representing a collection of Item objects."""
 
+  # Names of the item fields whose values are kept in the tag index.
+  TAG_FIELDS = ('tags',)
+
+  # (name, kind) of the fields of the item records, in the order of
+  # Item._to_dict, for the column store holding the records of a lazily
+  # loaded list (see sjb.common.columns). Lists without columns keep the
+  # records themselves.
+  RECORD_COLUMNS = ()
+
+  # Maximum number of query results kept by query_items.
+  QUERY_CACHE_SIZE = 64
+
   def __init__(self, version=None, modified_date=None):
     self._version = version
     self._modified = False
     self._modified_date = modified_date
 
+    # Items are stored in insertion order. Removed items leave a None hole
+    # behind so that the positions of the other items stay valid. The holes
+    # are compacted away once they make up half of the list. Lists loaded
+    # lazily hold raw records (see _is_record), which are turned into items on
+    # first use. Records given as dicts are kept in self._columns, and the
+    # list holds a Row view of them instead.
     self._items = []
+    self._num_holes = 0
+    self._num_records = 0
+    self._columns = None
+    if self.RECORD_COLUMNS:
+      self._columns = sjb.common.columns.ColumnStore(self.RECORD_COLUMNS)
+    # Maps the oid of every item to its position in self._items.
+    self._oid_index = {}
     self._last_item_id = 0
-    self._oid_set = set()
+    # Maps each tag to the set of oids of the items carrying it.
+    self._tag_index = {}
+    # Tag dictionary mapping each tag carried by an item to a bit number, and
+    # the tags of every item as a bitmask, parallel to self._items.
+    self._tag_ids = {}
+    self._tag_masks = []
+    # oids of the items added or changed since the list was last validated.
+    # Items add themselves on their first tracked change (see Item).
+    self._dirty_oids = set()
+    # Incremented on every change of the list or its items, so that anything
+    # derived from the list can tell whether it is still current.
+    self._generation = 0
+    # LRU cache of query_items results keyed by (signature, generation).
+    self._query_cache = collections.OrderedDict()
+    # Callables registered with subscribe.
+    self._listeners = []
 
   @property
   def version(self):
@@ -125,16 +418,31 @@ class ItemList(abc.ABC):
   @property
   def items(self):
     """# TODO: list of Item objects in this ItemList."""
+    if self._num_holes:
+      self._compact()
+    if self._num_records:
+      for i in range(len(self._items)):
+        self._item_at(i)
     return self._items
 
   def size(self):
-    return len(self._items)
+    return len(self._oid_index)
+
+  @property
+  def generation(self):
+    """int: Number that increases whenever this list or its items change.
+
+    Changes made directly to items, without the methods of the list, are not
+    counted.
+    """
+    return self._generation
 
   def _mark_modified(self, timestamp=None):
     """Marks this list as modified at the given timestamp.
 
     If no timestamp is provided this uses the current time.
     """
+    self._generation += 1
     self._modified = True
     self._modified_date = timestamp if timestamp is not None else time.time()
 
@@ -147,11 +455,157 @@ class ItemList(abc.ABC):
     Raises:
       InvalidIDError: If no Item object has the given oid.
     """
-    for i in range(len(self._items)):
-      if oid == self._items[i].oid:
-        return i
-    raise InvalidIDError(
-      'ItemList.get_item_index', 'Item with given oid not found!')
+    try:
+      return self._oid_index[oid]
+    except KeyError:
+      raise InvalidIDError(
+        'ItemList.get_item_index', 'Item with given oid not found!')
+
+  def _compact(self):
+    """Drops the holes left by removed items and rebuilds the oid index."""
+    # The oid index is filled in list order, so it iterates in list order.
+    items, masks, index = [], [], {}
+    for oid, ind in self._oid_index.items():
+      index[oid] = len(items)
+      items.append(self._items[ind])
+      masks.append(self._tag_masks[ind])
+    self._items, self._tag_masks, self._oid_index = items, masks, index
+    self._num_holes = 0
+
+  def _item_at(self, ind):
+    """Returns the item at index ind of self._items, building it if needed."""
+    record = self._items[ind]
+    if not _is_record(record):
+      return record
+    item = self._item_from_record(record)
+    item._validate()
+    item._owner = self
+    self._items[ind] = item
+    self._num_records -= 1
+    self._release_record(record)
+    return item
+
+  @abc.abstractmethod
+  def _item_from_record(self, record):
+    """Builds the Item represented by a raw record of a lazily loaded list.
+
+    Args:
+      record (dict): dict of the item as written by Item._to_dict.
+
+    Returns:
+      Item: The corresponding Item object.
+    """
+    return
+
+  def _store_record(self, record):
+    """Returns what self._items holds for a raw record: a Row of the record
+    in self._columns if it fits them, else the record itself."""
+    if self._columns is None or type(record) is not dict:
+      return record
+    row = self._columns.append(record)
+    return record if row is None else row
+
+  def _release_record(self, record):
+    """Notes that self._items no longer holds record, so that the column
+    store can drop the rows that are no longer used."""
+    columns = self._columns
+    if (type(record) is not sjb.common.columns.Row
+        or record.store is not columns):
+      return
+    columns.num_dead += 1
+    if columns.num_dead == len(columns):
+      columns.clear()
+    elif 2 * columns.num_dead > len(columns):
+      self._compact_columns()
+
+  def _compact_columns(self):
+    """Moves the rows still held by self._items to a new column store."""
+    old = self._columns
+    self._columns = sjb.common.columns.ColumnStore(self.RECORD_COLUMNS)
+    for ind, item in enumerate(self._items):
+      if type(item) is sjb.common.columns.Row and item.store is old:
+        self._items[ind] = self._columns.append(old.record(item.index))
+
+  def _update_object_maps(self, item):
+    """Updates meta objects to reflect the contents of item.
+
+    Subclasses override this to maintain their own indexes. Note that item may
+    be a read only view of a raw record when a list is loaded lazily.
+    """
+    pass
+
+  def _remove_from_object_maps(self, item):
+    """Updates meta objects to no longer reflect the contents of item."""
+    pass
+
+  def _update_changed_maps(self, item, changes):
+    """Updates meta objects for the fields of item that changed.
+
+    Args:
+      item: The changed item.
+      changes (dict): Maps each changed field to its old value.
+    """
+    pass
+
+  def subscribe(self, listener):
+    """Registers listener to be called with an ItemEvent for every change.
+
+    Events are sent once the list is consistent again: after an item was
+    added or removed, or after changes made through the update methods of the
+    list were applied. Items of a lazily loaded list that are added as raw
+    records while loading are not reported.
+
+    Args:
+      listener: callable taking an ItemEvent.
+    """
+    self._listeners.append(listener)
+
+  def unsubscribe(self, listener):
+    """Stops sending events to a listener registered with subscribe.
+
+    Raises:
+      ValueError: If listener was not registered.
+    """
+    self._listeners.remove(listener)
+
+  def _notify(self, kind, item, changes=None):
+    """Sends an ItemEvent to every listener."""
+    if not self._listeners:
+      return
+    event = ItemEvent(kind, item, changes)
+    for listener in list(self._listeners):
+      listener(event)
+
+  def _item_added(self, item):
+    """Updates the meta objects and listeners for an item just added."""
+    self._update_object_maps(item)
+    self._notify(ITEM_ADDED, item)
+
+  def _item_removed(self, item):
+    """Updates the meta objects and listeners for an item just removed."""
+    self._remove_from_object_maps(item)
+    self._notify(ITEM_REMOVED, item)
+
+  def _apply_changes(self, item):
+    """Updates meta objects and listeners for the fields changed in item
+    since its changes were last applied.
+
+    Returns:
+      bool: True if any field of item has changed.
+    """
+    changes = item._pop_changes()
+    if not changes:
+      return False
+    self._dirty_oids.add(item.oid)
+    self._generation += 1
+    self._update_changed_maps(item, changes)
+    self._notify(ITEM_CHANGED, item, {
+      name: (old, getattr(item, name)) for name, old in changes.items()})
+    return True
+
+  def has_item(self, oid):
+    """Returns True if this list has an item with the given oid."""
+    return oid in self._oid_index
 
   def get_item(self, oid):
     """Returns item with the given oid.
@@ -162,7 +616,7 @@ class ItemList(abc.ABC):
     Raises:
       InvalidIDError: If no item has a matching oid.
     """
-    return self._items[self._get_item_index(oid)]
+    return self._item_at(self._get_item_index(oid))
 
   @abc.abstractmethod
   def add_item(self, item, initial_load=False):
@@ -178,39 +632,416 @@ class ItemList(abc.ABC):
       IllegalStateError: If initial_load is False but the item has an oid.
       IllegalStateError: If initial_load is True but the item lacks an oid.
     """
-    # Make sure any 'init load' item already has an oid
-    if initial_load and not item.oid:
-      raise IllegalStateError('ItemList.add_item', 'Old item missing oid!')
-    # Make sure any new item does not have an oid
-    if not initial_load and item.oid:
-      raise IllegalStateError('ItemList.add_item', 'New item has oid!')
+    self._check_new_items([item], initial_load)
+    self._insert_item(item, initial_load)
+    if not initial_load:
+      # Mark the list as modified.
+      self._mark_modified()
+
+  @abc.abstractmethod
+  def add_items(self, items, initial_load=False, timestamp=None):
+    """Adds several items to this list at once.
+
+    All of the items are checked before any of them is added, and the list is
+    marked as modified only once.
+
+    Args:
+      items (list(Item)): The items to add to this list, in order.
+      initial_load (bool): Same as for add_item.
+      timestamp (float): The time to mark the list modified at. If None, the
+        current time is used.
+
+    Raises:
+      IllegalStateError: For the same reasons as add_item, or if two of the
+        items have the same oid.
+    """
+    self._check_new_items(items, initial_load)
+    for item in items:
+      self._insert_item(item, initial_load)
+    if items and not initial_load:
+      self._mark_modified(timestamp)
+
+  def _check_new_items(self, items, initial_load):
+    """Checks that items can be added to this list.
+
+    Raises:
+      IllegalStateError: If the items are not suitable for add_items.
+    """
+    seen = set()
+    for item in items:
+      # Make sure any 'init load' item already has an oid
+      if initial_load and not item.oid:
+        raise IllegalStateError('ItemList.add_item', 'Old item missing oid!')
+      # Make sure any new item does not have an oid
+      if not initial_load and item.oid:
+        raise IllegalStateError('ItemList.add_item', 'New item has oid!')
+      # Check that id is not already used.
+      if initial_load:
+        if item.oid in self._oid_index or item.oid in seen:
+          raise IllegalStateError('ItemList.add_item', 'Duplicate item ID')
+        seen.add(item.oid)
 
+  def _insert_item(self, item, initial_load):
+    """Appends an item that passed _check_new_items, setting its oid if new."""
     if not initial_load:
       # Set the oid correctly
       self._last_item_id += 1
       item.oid = self._last_item_id
-
-      # Mark the list as modified.
-      self._mark_modified()
     else:
-      # Check that id is not already used.
-      if item.oid in self._oid_set:
-        raise IllegalStateError('ItemList.add_item', 'Duplicate item ID')
       self._last_item_id = max(item.oid, self._last_item_id)
 
-    self._oid_set.add(item.oid)
+    self._oid_index[item.oid] = len(self._items)
     self._items.append(item)
+    self._tag_masks.append(0)
+    item._owner = self
+    self._dirty_oids.add(item.oid)
+    self._generation += 1
+
+  def _add_record(self, record):
+    """Adds an item to this list as a raw record, without building it.
+
+    The item is only built (and validated) when it is first accessed. Until
+    then only the meta objects of this list are updated from the record.
+
+    Args:
+      record (dict): dict of the item as written by Item._to_dict.
+
+    Raises:
+      IllegalStateError: If the record lacks an oid or its oid is in use.
+    """
+    oid = record.get('oid')
+    if not oid:
+      raise IllegalStateError('ItemList._add_record', 'Record missing oid!')
+    if oid in self._oid_index:
+      raise IllegalStateError('ItemList._add_record', 'Duplicate item ID')
+    self._last_item_id = max(oid, self._last_item_id)
+
+    self._oid_index[oid] = len(self._items)
+    self._items.append(self._store_record(record))
+    self._tag_masks.append(0)
+    self._num_records += 1
+    self._generation += 1
+    self._update_object_maps(_record_view(record))
+
+  def _put_record(self, record):
+    """Adds or replaces an item from its raw record, e.g. from a journal.
+
+    A replaced item keeps its position in the list. Like _add_record, this
+    neither marks the list modified nor notifies listeners.
+
+    Args:
+      record (dict): dict of the item as written by Item._to_dict.
+    """
+    ind = self._oid_index.get(record.get('oid'))
+    if ind is None:
+      self._add_record(record)
+      return
+    old = self._items[ind]
+    if _is_record(old):
+      self._remove_from_object_maps(_record_view(old))
+      self._release_record(old)
+    else:
+      old._owner = None
+      self._num_records += 1
+      self._remove_from_object_maps(old)
+    self._tag_masks[ind] = 0
+    self._items[ind] = self._store_record(record)
+    self._dirty_oids.add(record['oid'])
+    self._generation += 1
+    self._update_object_maps(_record_view(record))
+
+  def _drop_item(self, oid):
+    """Removes the item with the given oid if there is one, e.g. when
+    replaying a journal. This neither marks the list modified nor notifies
+    listeners."""
+    if oid not in self._oid_index:
+      return
+    ind = self._oid_index[oid]
+    item = self._items[ind]
+    if _is_record(item):
+      self._num_records -= 1
+    else:
+      item._owner = None
+    # Leave a hole as _take_item does, without building the item.
+    self._items[ind] = None
+    self._tag_masks[ind] = 0
+    del self._oid_index[oid]
+    self._dirty_oids.discard(oid)
+    self._num_holes += 1
+    self._generation += 1
+    if _is_record(item):
+      self._remove_from_object_maps(_record_view(item))
+      self._release_record(item)
+    else:
+      self._remove_from_object_maps(item)
+    if 2 * self._num_holes > len(self._items):
+      self._compact()
+
+  def _reserve_oids(self, oid):
+    """Makes new items get oids above oid, e.g. because the items up to oid
+    are kept elsewhere."""
+    self._last_item_id = max(oid, self._last_item_id)
+
+  def _set_modified_date(self, modified_date):
+    """Sets modified_date without marking this list modified, e.g. when it is
+    restored from a file."""
+    self._modified_date = modified_date
+
+  def _item_dicts(self):
+    """Yields the dict of every item in list order, as for writing to a file.
+
+    Records that were never built into items are yielded as copies of the
+    records themselves.
+    """
+    for item in self._items:
+      if item is None:
+        continue
+      yield dict(item) if _is_record(item) else item._to_dict()
 
   def query_items(self, item_matcher):
     """Abstract method that queries item list for some subset.
 
+    The results of matchers with a signature are cached, so repeating a query
+    costs nothing until this list changes.
+
     Args:
       ItemMatcher: object used to filter the items.
 
     Returns:
       # TODO: list of Item objects.
     """
-    return [item for item in self.items if item_matcher.matches(item)]
+    signature = item_matcher.signature()
+    if signature is None:
+      return list(self.iter_items(item_matcher))
+
+    cache = self._query_cache
+    key = (signature, self._generation)
+    result = cache.get(key)
+    if result is not None:
+      cache.move_to_end(key)
+      return list(result)
+
+    if cache and next(iter(cache))[1] != self._generation:
+      # Results of older generations can never be used again.
+      cache.clear()
+    result = tuple(self.iter_items(item_matcher))
+    cache[key] = result
+    if len(cache) > self.QUERY_CACHE_SIZE:
+      cache.popitem(last=False)
+    return list(result)
+
+  def iter_items(self, item_matcher=None, limit=None, offset=0):
+    """Yields the items matching item_matcher in list order.
+
+    Items are only built and checked as the generator is consumed, so the
+    scan stops as soon as limit items were yielded. Skipped items are not
+    kept. The list must not be modified while the generator is in use.
+
+    Args:
+      item_matcher (ItemMatcher): object used to filter the items, or None to
+        yield every item.
+      limit (int): If not None, at most this many items are yielded.
+      offset (int): Number of matching items to skip first.
+    """
+    if limit is not None and limit <= 0:
+      return
+    oids, residual = None, None
+    if item_matcher is not None:
+      oids, residual = item_matcher.plan(self)
+    if oids is None:
+      positions = range(len(self._items))
+    else:
+      positions = sorted(self._oid_index[oid] for oid in oids)
+
+    for ind in positions:
+      if self._items[ind] is None:
+        continue
+      item = self._item_at(ind)
+      if residual is not None and not residual.matches(item):
+        continue
+      if offset > 0:
+        offset -= 1
+        continue
+      yield item
+      if limit is not None:
+        limit -= 1
+        if limit == 0:
+          return
+
+  def all_oids(self):
+    """Returns a new set holding the oids of every item in this list."""
+    return set(self._oid_index)
+
+  def lookup(self, field, value):
+    """Looks up the items whose field holds value in an index of this list.
+
+    For the 'tags' field this finds the items carrying the tag value. Other
+    fields are only answered if a subclass keeps an index on them.
+
+    Returns:
+      set(int): The oids of the matching items, or None if there is no index
+        on the field. The set must not be modified.
+    """
+    if field == 'tags':
+      return self._tag_index.get(value, _EMPTY_SET)
+    return None
+
+  def count(self, field, value):
+    """Returns the number of oids lookup would return, or None."""
+    oids = self.lookup(field, value)
+    return None if oids is None else len(oids)
+
+  def lookup_range(self, field, start, end):
+    """Looks up the items whose field lies in [start, end) in an index.
+
+    Returns:
+      set(int): The oids of the matching items, or None if there is no sorted
+        index on the field.
+    """
+    return None
+
+  def count_range(self, field, start, end):
+    """Returns the number of oids lookup_range would return, or None."""
+    oids = self.lookup_range(field, start, end)
+    return None if oids is None else len(oids)
+
+  def _get_items_by_oids(self, oids):
+    """Returns the items with the given oids in list order."""
+    positions = sorted(self._oid_index[oid] for oid in oids)
+    return [self._item_at(i) for i in positions]
+
+  def _index_tags(self, oid, tags):
+    """Adds oid to the tag index posting and tag mask of every tag in tags."""
+    for tag in tags:
+      postings = self._tag_index.get(tag)
+      if postings is None:
+        self._tag_index[tag] = postings = set()
+      postings.add(oid)
+    self._tag_masks[self._oid_index[oid]] |= self._get_tag_mask(tags, True)
+
+  def _unindex_tags(self, oid, tags):
+    """Removes oid from the tag index posting and tag mask of every tag, and
+    frees the bits of the tags no item carries any more."""
+    ind = self._oid_index.get(oid)
+    if ind is not None:
+      self._tag_masks[ind] &= ~self._get_tag_mask(tags)
+    unused = []
+    for tag in tags:
+      postings = self._tag_index.get(tag)
+      if postings is None:
+        continue
+      postings.discard(oid)
+      if not postings:
+        del self._tag_index[tag]
+        unused.append(tag)
+    for tag in unused:
+      self._free_tag_bit(tag)
+
+  def _free_tag_bit(self, tag):
+    """Removes tag, which no item carries, from the tag dictionary.
+
+    The tag with the highest bit takes over the bit of tag, so that the bits
+    in use stay below the number of tags and the masks do not grow.
+    """
+    bit = self._tag_ids.pop(tag, None)
+    last = len(self._tag_ids)
+    if bit is None or bit == last:
+      return
+    moved = next(t for t, b in self._tag_ids.items() if b == last)
+    self._tag_ids[moved] = bit
+    masks = self._tag_masks
+    for oid in self._tag_index.get(moved, ()):
+      ind = self._oid_index.get(oid)
+      if ind is not None:
+        masks[ind] = masks[ind] & ~(1 << last) | 1 << bit
+
+  def _get_tag_mask(self, tags, add_new=False):
+    """Returns the bitmask of tags in the tag dictionary of this list.
+
+    Args:
+      tags: iterable of tags to build a mask of.
+      add_new (bool): If True, tags missing from the dictionary are given the
+        next free bit. If False they are left out of the mask.
+    """
+    mask = 0
+    for tag in tags:
+      bit = self._tag_ids.get(tag)
+      if bit is None:
+        if not add_new:
+          continue
+        bit = self._tag_ids[tag] = len(self._tag_ids)
+      mask |= 1 << bit
+    return mask
+
+  def oids_with_all_tags(self, tags):
+    """Returns the set of oids of items that carry every tag in tags.
+
+    The postings are intersected smallest first, so the cost is bounded by the
+    size of the rarest tag rather than the size of the list.
+    """
+    postings = []
+    for tag in tags:
+      if tag not in self._tag_index:
+        return set()
+      postings.append(self._tag_index[tag])
+    if not postings:
+      return set(self._oid_index)
+    postings.sort(key=len)
+    result = set(postings[0])
+    for p in postings[1:]:
+      result.intersection_update(p)
+      if not result:
+        break
+    return result
+
+  def oids_with_any_tag(self, tags):
+    """Returns the set of oids of items that carry at least one tag in tags."""
+    result = set()
+    for tag in tags:
+      result.update(self._tag_index.get(tag, ()))
+    return result
+
+  def oids_with_tags(self, all_of=(), any_of=(), none_of=()):
+    """Returns the set of oids of items matching a combination of tags.
+
+    The positive conditions are answered with the tag index postings. The
+    remaining checks are done with a single bitwise operation on the tag mask
+    of each item, which is also how NOT-only queries scan the whole list.
+
+    Args:
+      all_of: The items must carry every one of these tags.
+      any_of: If not empty, the items must carry at least one of these tags.
+      none_of: The items must not carry any of these tags.
+
+    Returns:
+      set(int): The oids of the matching items.
+    """
+    if any(tag not in self._tag_ids for tag in all_of):
+      return set()
+    all_mask = self._get_tag_mask(all_of)
+    any_mask = self._get_tag_mask(any_of)
+    none_mask = self._get_tag_mask(none_of)
+    if any_of and not any_mask:
+      return set()
+
+    if all_of:
+      oids = self.oids_with_all_tags(all_of)
+    elif any_of:
+      oids = self.oids_with_any_tag(any_of)
+    else:
+      oids = None
+
+    def _matches(mask):
+      return (
+        mask & all_mask == all_mask and
+        (not any_mask or mask & any_mask) and
+        not mask & none_mask)
+
+    masks = self._tag_masks
+    index = self._oid_index
+    if oids is None:
+      oids = index
+    return {oid for oid in oids if _matches(masks[index[oid]])}
 
   @abc.abstractmethod
   def remove_item(self, oid):
@@ -222,11 +1053,91 @@ class ItemList(abc.ABC):
     Raises:
       InvalidIDError: If no item has a matching oid.
     """
-    ind = self._get_item_index(oid)
-    removed = self._items.pop(ind)
-    # Mark as modified and remove id from id set
+    removed = self._take_item(oid)
+    if 2 * self._num_holes > len(self._items):
+      self._compact()
+
     self._mark_modified()
-    self._oid_set.remove(removed.oid)
+    return removed
+
+  @abc.abstractmethod
+  def remove_items(self, oids, timestamp=None):
+    """Removes the items with the specified oids and updates meta data.
+
+    All of the oids are checked before any item is removed. The removal costs
+    O(n) in total no matter how many items are removed, and the list is marked
+    as modified only once.
+
+    Args:
+      oids: The oids of the items to remove.
+      timestamp (float): The time to mark the list modified at. If None, the
+        current time is used.
+
+    Returns:
+      list(Item): The removed item objects, in the order of oids.
+
+    Raises:
+      InvalidIDError: If some oid has no matching item.
+    """
+    oids = self._check_oids(oids)
+    removed = [self._take_item(oid) for oid in oids]
+    if 2 * self._num_holes > len(self._items):
+      self._compact()
+    if removed:
+      self._mark_modified(timestamp)
+    return removed
+
+  def select_oids(self, oid_ranges, item_matcher=None):
+    """Returns the oids selected by ranges of oids and an optional matcher.
+
+    Ranges holding a single oid must refer to an existing item. Longer ranges
+    just select the existing items that fall inside them.
+
+    Args:
+      oid_ranges: iterable of range objects of oids.
+      item_matcher (ItemMatcher): If not None, the items it matches are also
+        selected.
+
+    Returns:
+      list(int): The selected oids without duplicates, in the order given.
+
+    Raises:
+      InvalidIDError: If a single oid has no matching item.
+    """
+    oids = []
+    for r in oid_ranges:
+      if len(r) == 1:
+        self._get_item_index(r[0])
+        oids.append(r[0])
+      else:
+        oids.extend(oid for oid in r if oid in self._oid_index)
+    if item_matcher is not None:
+      oids.extend(item.oid for item in self.query_items(item_matcher))
+    return list(dict.fromkeys(oids))
+
+  def _check_oids(self, oids):
+    """Returns oids as a list without duplicates, checking that all exist.
+
+    Raises:
+      InvalidIDError: If some oid has no matching item.
+    """
+    oids = list(dict.fromkeys(oids))
+    for oid in oids:
+      self._get_item_index(oid)
+    return oids
+
+  def _take_item(self, oid):
+    """Removes and returns the item with the given oid, leaving a hole."""
+    ind = self._get_item_index(oid)
+    removed = self._item_at(ind)
+    removed._owner = None
+    # Leave a hole instead of shifting every later item down by one.
+    self._items[ind] = None
+    self._tag_masks[ind] = 0
+    del self._oid_index[oid]
+    self._dirty_oids.discard(oid)
+    self._generation += 1
+    self._num_holes += 1
     return removed
 
   @abc.abstractmethod
@@ -246,5 +1157,65 @@ class ItemList(abc.ABC):
     Raises:
       ValidationError: If validation fails.
     """
-    for item in self.items:
+    for item in self._items:
+      if item is None:
+        continue
+      if _is_record(item):
+        # Built only to be checked, so the record stays in the column store.
+        item = self._item_from_record(item)
       item._validate()
+    self._clear_dirty()
+
+  def apply_direct_changes(self):
+    """Applies the changes of the items whose fields were assigned directly,
+    without the update methods of this list, so that its meta objects and
+    listeners (e.g. the journal of a storage) see them.
+
+    Returns:
+      bool: True if any item has changed.
+    """
+    changed = False
+    for oid in list(self._dirty_oids):
+      ind = self._oid_index.get(oid)
+      if ind is None:
+        continue
+      item = self._items[ind]
+      if not _is_record(item) and item._changes:
+        changed = self._apply_changes(item) or changed
+    return changed
+
+  def validate_dirty(self):
+    """Validates only the items added or changed since the last validation.
+
+    Items loaded from a file are assumed valid once the list was validated
+    (or marked valid) after loading, and records of a lazily loaded list are
+    validated when they are built. Items mutated directly, without the update
+    methods of the list, note themselves as dirty on their first tracked
+    change.
+
+    Raises:
+      ValidationError: If validation fails.
+    """
+    for oid in self._dirty_oids:
+      ind = self._oid_index.get(oid)
+      if ind is not None:
+        self._item_at(ind)._validate()
+    self._clear_dirty()
+
+  def mark_valid(self):
+    """Records that every item of this list is known to be valid, e.g.
+    because it was loaded from a file whose checksum matches."""
+    self._clear_dirty()
+
+  def _clear_dirty(self):
+    """Empties self._dirty_oids but for the items with direct changes that
+    the list has not applied yet, as those only note themselves once."""
+    pending = set()
+    for oid in self._dirty_oids:
+      ind = self._oid_index.get(oid)
+      if ind is not None:
+        item = self._items[ind]
+        if not _is_record(item) and item._changes:
+          pending.add(oid)
+    self._dirty_oids = pending
+
@@ -0,0 +1,477 @@
+"""Module implementing the compact binary list format.
+
+A binary list file is made of a header followed by sections, each starting on
+an 8 byte boundary:
+
+  header     magic, format version, number of items and number of sections,
+             followed by the offset and length of every section
+  meta       the columns of the file, and the version and modified_date of
+             the list, as JSON
+  oids       one int64 per item
+  columns    for each column declared by the storage, either one fixed width
+             value per item, or for strings the end offset of each item's
+             string followed by the UTF-8 heap of all those strings
+  tags       the end of each item's slice of the tag ids, the uint32 tag ids
+             themselves, and the tag dictionary as ends and a string heap
+
+All numbers are little endian. Loading maps the file into memory and only
+decodes the columns and strings that are actually read: a lazily loaded list
+holds views of the rows of the file, and queries over a large list need not
+build its items (see BinaryStorage.query_items).
+"""
+import abc
+import array
+import collections
+import collections.abc
+import heapq
+import itertools
+import json
+import mmap
+import os
+import struct
+import sys
+import sjb.common.base
+import sjb.common.journal
+import sjb.common.storage
+
+_BINARY_EXTENSION = '.sjbl'
+
+_MAGIC = b'SJBL'
+_FORMAT_VERSION = 1
+_HEADER = struct.Struct('<4sHHQQ')
+
+# Kinds of the columns of a binary list file, with the array type code of
+# their fixed width values. Dates and other floats use NaN for None, booleans
+# use -1.
+INT = 'q'
+FLOAT = 'd'
+BOOL = 'b'
+STRING = 's'
+
+_LITTLE_ENDIAN = sys.byteorder == 'little'
+
+
+class FormatError(sjb.common.storage.IOError):
+  """Raised when a binary list file is truncated or not a list file."""
+  pass
+
+
+def encode(json_dict, root_key, items_key, columns):
+  """Returns the binary list file of a list.
+
+  Args:
+    json_dict: dict of the list as written to a JSON list file.
+    root_key (str): Key of the list in json_dict.
+    items_key (str): Key of the items in the list dict.
+    columns: (name, kind) of the item fields besides oid and tags.
+
+  Returns:
+    bytes: The contents of the file.
+  """
+  lst = json_dict[root_key]
+  items = lst[items_key]
+  meta = {
+    'columns': [list(column) for column in columns],
+    'list': {key: value for key, value in lst.items() if key != items_key},
+  }
+  sections = [json.dumps(meta, sort_keys=True).encode('utf-8')]
+  sections.append(_pack(INT, [item['oid'] for item in items]))
+
+  for name, kind in columns:
+    values = [item[name] for item in items]
+    if kind == STRING:
+      sections.extend(_pack_strings(values))
+    elif kind == FLOAT:
+      sections.append(_pack(kind, [
+        float('nan') if v is None else v for v in values]))
+    elif kind == BOOL:
+      sections.append(_pack(kind, [-1 if v is None else v for v in values]))
+    else:
+      sections.append(_pack(kind, values))
+
+  tag_ids, ids, ends = {}, [], []
+  for item in items:
+    for tag in item['tags']:
+      ids.append(tag_ids.setdefault(tag, len(tag_ids)))
+    ends.append(len(ids))
+  sections.append(_pack('Q', ends))
+  sections.append(_pack('I', ids))
+  sections.extend(_pack_strings(list(tag_ids)))
+
+  offset = _HEADER.size + 16 * len(sections)
+  table, body = [], []
+  for section in sections:
+    table.extend([offset, len(section)])
+    body.append(section)
+    padding = _align(len(section)) - len(section)
+    body.append(b'\0' * padding)
+    offset += len(section) + padding
+
+  header = _HEADER.pack(
+    _MAGIC, _FORMAT_VERSION, 0, len(items), len(sections))
+  return header + _pack('Q', table) + b''.join(body)
+
+
+class Reader(object):
+  """Decodes the parts of a binary list file on demand."""
+
+  def __init__(self, data, columns):
+    """Initializes a Reader.
+
+    Args:
+      data: The contents of the file, e.g. an mmap.
+      columns: (name, kind) of the columns, as given to encode.
+
+    Raises:
+      FormatError: If data is not a binary list file with these columns.
+    """
+    if len(data) < _HEADER.size:
+      raise FormatError('binary list file is truncated')
+    magic, version, _, size, num_sections = _HEADER.unpack_from(data)
+    if magic != _MAGIC:
+      raise FormatError('not a binary list file')
+    if version != _FORMAT_VERSION:
+      raise FormatError(
+        'unsupported binary list file version %d (expected %d)' % (
+          version, _FORMAT_VERSION))
+    table_end = _HEADER.size + 16 * num_sections
+    if len(data) < table_end:
+      raise FormatError('binary list file is truncated')
+    table = _unpack('Q', data[_HEADER.size:table_end])
+    if num_sections and _align(table[-2] + table[-1]) != len(data):
+      raise FormatError('binary list file is truncated')
+
+    self._data = memoryview(data)
+    self._size = size
+    self._kinds = dict(columns)
+    self._sections = {}
+    self._decoded = {}
+    # Decoded values of the fields read so far, see value.
+    self._values = {}
+    bounds = iter([
+      (table[i], table[i] + table[i + 1]) for i in range(0, len(table), 2)])
+    self._sections['meta'] = next(bounds, None)
+    if self._read_meta().get('columns') != [list(c) for c in columns]:
+      raise FormatError('binary list file has unexpected columns')
+    # meta, oids, the columns, and the four sections of the tags.
+    if num_sections != 2 + sum(
+        2 if kind == STRING else 1 for _, kind in columns) + 4:
+      raise FormatError('binary list file is truncated')
+    self._sections['oid'] = next(bounds)
+    for name, kind in columns:
+      if kind == STRING:
+        self._sections[name] = (next(bounds), next(bounds))
+      else:
+        self._sections[name] = next(bounds)
+    self._sections['tags'] = (next(bounds), next(bounds))
+    self._sections['tag_names'] = (next(bounds), next(bounds))
+
+  def __len__(self):
+    return self._size
+
+  @property
+  def fields(self):
+    """list(str): The names of the fields of the records of the items."""
+    return ['oid', 'tags'] + list(self._kinds)
+
+  @property
+  def meta(self):
+    """dict: The keys of the list other than its items."""
+    return self._read_meta()['list']
+
+  def _read_meta(self):
+    if self._sections['meta'] is None:
+      return {}
+    start, end = self._sections['meta']
+    try:
+      return json.loads(str(self._data[start:end], 'utf-8'))
+    except ValueError:
+      raise FormatError('binary list file has a bad header')
+
+  @property
+  def oids(self):
+    """Sequence of the oids of the items, in list order."""
+    return self.column('oid')
+
+  def column(self, name):
+    """Returns the sequence of raw values of a fixed width column."""
+    if name not in self._decoded:
+      kind = INT if name == 'oid' else self._kinds[name]
+      start, end = self._sections[name]
+      self._decoded[name] = _unpack(kind, self._data[start:end])
+    return self._decoded[name]
+
+  def value(self, name, index):
+    """Returns the value of field name of the item at index.
+
+    Strings are decoded one at a time. The other fields are decoded for all
+    the items at once the first time one of them is read, as decoding a
+    whole column costs little more than decoding a few values.
+    """
+    values = self._values.get(name)
+    if values is None:
+      if self._kinds.get(name) == STRING:
+        (start, end), (heap, _) = self._sections[name]
+        ends = self._string_ends(name, start, end)
+        lo = ends[index - 1] if index else 0
+        return str(self._data[heap + lo:heap + ends[index]], 'utf-8')
+      values = self._values[name] = self._decode_values(name)
+    if name == 'tags':
+      return set(values[index])
+    return values[index]
+
+  def tags(self, index):
+    """Returns the sorted list of tags of the item at index."""
+    values = self._values.get('tags')
+    if values is None:
+      values = self._values['tags'] = self._decode_values('tags')
+    return list(values[index])
+
+  def record(self, index):
+    """Returns the dict of the item at index, as written by Item._to_dict."""
+    record = {'oid': self.oids[index], 'tags': self.tags(index)}
+    for name in self._kinds:
+      record[name] = self.value(name, index)
+    return record
+
+  def records(self):
+    """Returns the dicts of all the items, decoding each column at once."""
+    names = ['oid', 'tags'] + list(self._kinds)
+    columns = [
+      self._all_strings(name) if self._kinds.get(name) == STRING
+      else self._values.get(name) or self._decode_values(name)
+      for name in names]
+    return [dict(zip(names, row)) for row in zip(*columns)]
+
+  def _decode_values(self, name):
+    """Returns the list of the values of the fixed width field name, or of
+    the sorted tag lists, of every item."""
+    if name == 'tags':
+      return self._all_tags()
+    kind = INT if name == 'oid' else self._kinds.get(name)
+    if kind is None:
+      raise AttributeError(name)
+    values = self.column(name).tolist()
+    if kind == FLOAT:
+      values = [None if v != v else v for v in values]
+    elif kind == BOOL:
+      values = [None if v < 0 else bool(v) for v in values]
+    return values
+
+  def _all_strings(self, name):
+    (start, end), (heap, heap_end) = self._sections[name]
+    ends = self._string_ends(name, start, end).tolist()
+    data = bytes(self._data[heap:heap_end])
+    return [
+      data[lo:hi].decode('utf-8')
+      for lo, hi in zip(itertools.chain([0], ends), ends)]
+
+  def _all_tags(self):
+    names = self._tag_names()
+    (ends_start, ends_end), (ids_start, ids_end) = self._sections['tags']
+    ends = self._string_ends('tags', ends_start, ends_end).tolist()
+    tags = [names[i] for i in _unpack('I', self._data[ids_start:ids_end])]
+    return [
+      sorted(tags[lo:hi]) for lo, hi in zip(itertools.chain([0], ends), ends)]
+
+  def _string_ends(self, name, start, end):
+    key = name + '.ends'
+    if key not in self._decoded:
+      self._decoded[key] = _unpack('Q', self._data[start:end])
+    return self._decoded[key]
+
+  def _tag_names(self):
+    if 'tag_names' not in self._decoded:
+      (start, end), (heap, heap_end) = self._sections['tag_names']
+      ends = _unpack('Q', self._data[start:end])
+      text = self._data[heap:heap_end]
+      self._decoded['tag_names'] = [
+        sys.intern(str(text[lo:hi], 'utf-8'))
+        for lo, hi in zip(itertools.chain([0], ends), ends)]
+    return self._decoded['tag_names']
+
+
+class _RowView(collections.abc.Mapping):
+  """Read-only view of an item of a binary list file, decoding each field
+  when it is accessed. It reads like the record of the item, as written by
+  Item._to_dict, and matchers can check it like the item itself."""
+
+  __slots__ = ('_reader', '_index')
+
+  def __init__(self, reader, index):
+    self._reader = reader
+    self._index = index
+
+  def __getitem__(self, name):
+    if name == 'tags':
+      return self._reader.tags(self._index)
+    try:
+      return self._reader.value(name, self._index)
+    except AttributeError:
+      raise KeyError(name)
+
+  def __iter__(self):
+    return iter(self._reader.fields)
+
+  def __len__(self):
+    return len(self._reader.fields)
+
+  def __getattr__(self, name):
+    return self._reader.value(name, self._index)
+
+  def __reduce__(self):
+    # The mapped file cannot be pickled (e.g. in snapshots), so pickle the
+    # record itself.
+    return (dict, (self._reader.record(self._index),))
+
+
+class BinaryStorage(sjb.common.storage.ListStorage):
+  """Base class of the objects storing the lists of an app in binary files.
+
+  Subclasses set _ROOT_KEY, _ITEMS_KEY and _COLUMNS, and implement
+  _list_from_dict and _item_from_dict.
+  """
+
+  BACKEND = sjb.common.storage.BACKEND_BINARY
+  _EXTENSION = _BINARY_EXTENSION
+  # The rows of a mapped file are only decoded when read, which a snapshot
+  # would have to do for all of them.
+  _SNAPSHOT = False
+
+  # (name, kind) of the item fields besides oid and tags. The kinds are INT,
+  # FLOAT, BOOL and STRING.
+  _COLUMNS = ()
+
+  @abc.abstractmethod
+  def _item_from_dict(self, record):
+    """Builds the item represented by a record of this app."""
+    return
+
+  def _dumps(self, item_list, exclude=()):
+    return encode(
+      self._list_dict(item_list, exclude), self._ROOT_KEY, self._ITEMS_KEY,
+      self._COLUMNS)
+
+  def _read(self, fname):
+    with open(fname, 'rb') as f:
+      try:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+      except ValueError:
+        # Empty files cannot be mapped.
+        raise FormatError('binary list file is empty')
+
+  def _loads(self, data):
+    # The items are views of the mapped file, so a lazily loaded list only
+    # decodes the fields that are read.
+    reader = Reader(data, self._COLUMNS)
+    lst = reader.meta
+    lst[self._ITEMS_KEY] = [_RowView(reader, i) for i in range(len(reader))]
+    return {self._ROOT_KEY: lst}
+
+  def query_items(
+      self, item_matcher=None, sort_field=None, limit=None, offset=0,
+      history=False):
+    """Returns the items of the list matching item_matcher.
+
+    item_matcher is checked on views of the mapped file that only decode the
+    fields it reads, and only the returned items are built. The journal is
+    replayed on top of the mapped rows. If history is asked for and the list
+    has archived items, this falls back to loading the list. See
+    ListStorage.query_items for the arguments.
+    """
+    if not self.exists() or (history and self.archived_oids()):
+      return super().query_items(
+        item_matcher, sort_field=sort_field, limit=limit, offset=offset,
+        history=history)
+
+    reader = Reader(self._read(self._get_list_file()), self._COLUMNS)
+    records, _ = sjb.common.journal.read(self._get_journal_file())
+    views = self._replay(reader, records)
+    if item_matcher is not None:
+      views = (view for view in views if item_matcher.matches(view))
+    stop = None if limit is None else offset + limit
+
+    if sort_field is not None:
+      if sort_field not in dict(self._COLUMNS):
+        raise sjb.common.base.IllegalStateError(
+          'BinaryStorage.query_items', 'cannot sort by field: '+str(sort_field))
+      def key(view):
+        # Items without a value come last, and ties are ordered by oid.
+        value = getattr(view, sort_field)
+        return (value is None, 0 if value is None else value, view.oid)
+      if stop is None:
+        views = sorted(views, key=key)
+      else:
+        views = heapq.nsmallest(stop, views, key=key)
+
+    return [
+      self._build_item(view) if type(view) is _RowView else view
+      for view in itertools.islice(views, offset, stop)]
+
+  def _replay(self, reader, records):
+    """Yields the items of the list file of reader with the journal records
+    replayed on top, in the order load_list would hold them: views of the
+    rows of the file, and the built items put by the journal."""
+    # Maps the oid of every journaled item to its record, or to None if it
+    # was removed. Like ItemList._put_record, a put replaces an item in its
+    # place, but an item put again after a removal goes to the end.
+    journaled = collections.OrderedDict()
+    appended = set()
+    for record in records:
+      if record['op'] == sjb.common.journal.OP_PUT:
+        oid = record['item']['oid']
+        if oid in journaled and journaled[oid] is None:
+          del journaled[oid]
+          appended.add(oid)
+        journaled[oid] = record['item']
+      elif record['op'] == sjb.common.journal.OP_REMOVE:
+        journaled[record['oid']] = None
+
+    oids = reader.oids
+    for i in range(len(reader)):
+      oid = oids[i]
+      if oid not in journaled:
+        yield _RowView(reader, i)
+      elif oid not in appended:
+        record = journaled.pop(oid)
+        if record is not None:
+          yield self._build_item(record)
+    for record in journaled.values():
+      if record is not None:
+        yield self._build_item(record)
+
+  def _build_item(self, record):
+    item = self._item_from_dict(record)
+    item._validate()
+    return item
+
+
+def _align(n):
+  return (n + 7) & ~7
+
+
+def _pack(kind, values):
+  """Returns values as little endian numbers of the given array type code."""
+  a = array.array(kind, values)
+  if not _LITTLE_ENDIAN:
+    a.byteswap()
+  return a.tobytes()
+
+
+def _unpack(kind, data):
+  """Returns the sequence of numbers of data, as written by _pack.
+
+  On little endian machines this is a view of data, so nothing is decoded
+  until it is read.
+  """
+  if _LITTLE_ENDIAN:
+    return memoryview(data).cast(kind)
+  a = array.array(kind, bytes(data))
+  a.byteswap()
+  return a
+
+
+def _pack_strings(values):
+  """Returns the ends section and the heap section of a string column."""
+  encoded = [v.encode('utf-8') for v in values]
+  return _pack('Q', itertools.accumulate(len(e) for e in encoded)), b''.join(encoded)
@@ -0,0 +1,193 @@
+"""Module implementing the JSON codecs used to read and write list files.
+
+A codec encodes a list dict into chunks of bytes that are written to the file
+one at a time, and decodes the bytes of a file. The stdlib json module is
+always available; orjson is used instead when it is installed, as it is many
+times faster, in particular for indented output.
+
+Decoding the output of a codec and encoding it again with the same codec and
+style gives the same bytes. The codecs write the same JSON for ASCII text and
+plain numbers, but orjson writes other characters as UTF-8 instead of
+escaping them, and spells exponents as 1e16 rather than 1e+16. Each codec
+reads the output of the other.
+"""
+import json
+import os
+
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+# Styles of the written JSON. Indented files are easier to read and diff,
+# compact ones are smaller and faster.
+STYLE_INDENTED = 'indented'
+STYLE_COMPACT = 'compact'
+STYLE_CHOICES = [STYLE_INDENTED, STYLE_COMPACT]
+STYLE_DEFAULT = STYLE_INDENTED
+
+CODEC_STDLIB = 'stdlib'
+CODEC_ORJSON = 'orjson'
+
+# Environment variables overriding the default style and codec.
+ENV_STYLE = 'SJB_JSON_STYLE'
+ENV_CODEC = 'SJB_JSON_CODEC'
+
+# Size of the chunks written to the file.
+CHUNK_SIZE = 64 * 1024
+
+# Number of spaces per level of indented files.
+_INDENT = 2
+
+
+class StdlibCodec(object):
+  """Codec using the json module of the standard library."""
+
+  name = CODEC_STDLIB
+
+  def encode(self, value, style=STYLE_DEFAULT):
+    """Yields value encoded as JSON, in chunks of about CHUNK_SIZE bytes.
+
+    The elements of lists are encoded a batch at a time (see _stream), so
+    the whole output is never held in memory.
+    """
+    if style == STYLE_COMPACT:
+      # Only the one shot encoder of the json module is written in C, and
+      # only without indentation, so use it for every batch of elements.
+      def dump(v):
+        return json.dumps(v, separators=(',', ':')).encode('utf-8')
+      return _chunks(_stream(value, dump, None))
+    def dump(v):
+      return json.dumps(v, indent=_INDENT).encode('utf-8')
+    return _chunks(_stream(value, dump, _INDENT))
+
+  def decode(self, data):
+    """Returns the value encoded in data (bytes or str)."""
+    return json.loads(data)
+
+
+class OrjsonCodec(object):
+  """Codec using the orjson package."""
+
+  name = CODEC_ORJSON
+
+  def encode(self, value, style=STYLE_DEFAULT):
+    """Yields value encoded as JSON, in chunks of about CHUNK_SIZE bytes,
+    encoding the elements of lists a batch at a time like StdlibCodec."""
+    if style == STYLE_COMPACT:
+      return _chunks(_stream(value, orjson.dumps, None))
+    def dump(v):
+      return orjson.dumps(v, option=orjson.OPT_INDENT_2)
+    return _chunks(_stream(value, dump, _INDENT))
+
+  def decode(self, data):
+    """Returns the value encoded in data (bytes or str)."""
+    return orjson.loads(data)
+
+
+def _stream(value, dump, indent, depth=0):
+  """Yields the JSON of value in parts, as bytes.
+
+  Non-empty lists and dicts with string keys are written here, and every
+  other value, as well as each batch of elements of a list, is encoded
+  whole by dump. The parts join to the same bytes as dump(value).
+
+  Args:
+    value: The value to encode.
+    dump: callable returning the JSON of a value as bytes, indented by
+      indent spaces per level if indent is not None.
+    indent (int): Number of spaces per level, or None for compact output.
+    depth (int): Nesting level of value.
+  """
+  if isinstance(value, dict) and value and all(
+      isinstance(key, str) for key in value):
+    start, end = b'{', b'}'
+  elif isinstance(value, list) and value:
+    start, end = b'[', b']'
+  else:
+    yield _indent(dump(value), indent, depth)
+    return
+
+  if indent is None:
+    separator, closing, key_separator = b',', end, b':'
+  else:
+    separator = b',\n' + b' ' * (indent * (depth + 1))
+    closing = b'\n' + b' ' * (indent * depth) + end
+    key_separator = b': '
+  yield start + separator[1:]
+  if start == b'[':
+    # Elements are encoded in batches of about CHUNK_SIZE bytes, judging by
+    # the size of the ones before, which is much faster than one at a time.
+    # The brackets around each batch are dropped.
+    head, tail = len(start + separator[1:]), len(closing)
+    i, size = 0, 0
+    while i < len(value):
+      count = max(1, CHUNK_SIZE * i // size) if size else 1
+      data = _indent(dump(value[i:i + count]), indent, depth)
+      data = data[head:len(data) - tail]
+      yield separator + data if i else data
+      i += count
+      size += len(data)
+  else:
+    for i, (key, v) in enumerate(value.items()):
+      yield (separator if i else b'') + dump(key) + key_separator
+      yield from _stream(v, dump, indent, depth + 1)
+  yield closing
+
+
+def _indent(data, indent, depth):
+  """Returns the JSON data of a value nested depth levels deep, indenting its
+  lines after the first by indent spaces per level."""
+  if indent is None or not depth:
+    return data
+  # Strings escape newlines, so the only ones in data are between tokens.
+  return data.replace(b'\n', b'\n' + b' ' * (indent * depth))
+
+
+def _chunks(parts):
+  """Yields the bytes of parts joined into chunks of about CHUNK_SIZE
+  bytes."""
+  pending, size = [], 0
+  for part in parts:
+    pending.append(part)
+    size += len(part)
+    if size >= CHUNK_SIZE:
+      yield b''.join(pending)
+      pending, size = [], 0
+  if pending:
+    yield b''.join(pending)
+
+
+def available_codecs():
+  """Returns the names of the codecs that can be used, fastest first."""
+  names = [CODEC_STDLIB]
+  if orjson is not None:
+    names.insert(0, CODEC_ORJSON)
+  return names
+
+
+def get_codec(name=None):
+  """Returns a codec by name, or the configured or fastest one if name is
+  None.
+
+  Raises:
+    ValueError: If the codec is unknown or not installed.
+  """
+  if name is None:
+    name = os.environ.get(ENV_CODEC) or available_codecs()[0]
+  if name not in available_codecs():
+    raise ValueError('unknown or unavailable JSON codec: "%s"' % name)
+  return OrjsonCodec() if name == CODEC_ORJSON else StdlibCodec()
+
+
+def get_style(style=None):
+  """Returns style, or the configured default if it is None.
+
+  Raises:
+    ValueError: If the style is not one of STYLE_CHOICES.
+  """
+  if style is None:
+    style = os.environ.get(ENV_STYLE, STYLE_DEFAULT)
+  if style not in STYLE_CHOICES:
+    raise ValueError('unknown JSON style: "%s"' % style)
+  return style
@@ -0,0 +1,189 @@
+"""Module implementing the column store holding the records of an ItemList.
+
+A loaded list does not build its items until they are used (see
+ItemList._add_record). Until then, the record of every item is kept in a
+ColumnStore of the list, one column per field, instead of as a dict:
+
+  INT, FLOAT, BOOL  arrays of fixed width values. Floats use NaN for None and
+                    booleans use -1, as in the binary list format.
+  STRING            a list of the values themselves.
+  TAGS              a tuple of ids into the tag dictionary of the store for
+                    every item. Items with the same tags share one tuple.
+
+Values that do not fit the type of their column, such as an int in a FLOAT
+column, are kept as they are in a per column dict, so a record always comes
+back out of the store equal to what went in. Records whose keys are not the
+fields of the store are not stored at all.
+
+The ItemList holds a Row view of each stored record, which reads like the
+record itself.
+"""
+import array
+import collections.abc
+import sys
+
+# Kinds of the columns, with the array type code of their values.
+INT = 'q'
+FLOAT = 'd'
+BOOL = 'b'
+STRING = 's'
+TAGS = 't'
+
+_NAN = float('nan')
+_INT_MIN = -2 ** 63
+_INT_MAX = 2 ** 63 - 1
+
+
+def _pack(kind, value):
+  """Returns the array value representing value in a column of kind, or
+  None if value does not fit it."""
+  if kind == FLOAT:
+    if value is None:
+      return _NAN
+    if type(value) is float and value == value:
+      return value
+  elif kind == INT:
+    if type(value) is int and _INT_MIN <= value <= _INT_MAX:
+      return value
+  elif kind == BOOL:
+    if value is None:
+      return -1
+    if type(value) is bool:
+      return int(value)
+  return None
+
+
+class ColumnStore(object):
+  """The records of the items of a list, stored by column."""
+
+  def __init__(self, columns):
+    """Initializes an empty ColumnStore.
+
+    Args:
+      columns: (name, kind) of every field of the records, in the order of
+        the keys of the records as written by Item._to_dict.
+    """
+    self.fields = tuple(name for name, _ in columns)
+    self._kinds = dict(columns)
+    self.clear()
+
+  def clear(self):
+    """Drops every record, once no Row of this store is used any more."""
+    columns = self._kinds.items()
+    self._values = {}
+    for name, kind in columns:
+      self._values[name] = [] if kind in (STRING, TAGS) else array.array(kind)
+    # Maps the name of a column to a dict mapping the index of each record
+    # whose value does not fit the column to that value.
+    self._other = {name: {} for name in self.fields}
+    self._tag_names = []
+    self._tag_ids = {}
+    self._tag_tuples = {}
+    self._size = 0
+    # Number of rows that are no longer used by their list.
+    self.num_dead = 0
+
+  def __len__(self):
+    return self._size
+
+  def append(self, record):
+    """Stores record and returns a Row view of it.
+
+    Returns:
+      Row: The view of the stored record, or None if the keys of record are
+        not the fields of this store.
+    """
+    if len(record) != len(self.fields) or any(
+        name not in record for name in self.fields):
+      return None
+    index = self._size
+    for name in self.fields:
+      kind = self._kinds[name]
+      value = record[name]
+      if kind == STRING:
+        self._values[name].append(value)
+        continue
+      if kind == TAGS:
+        packed = self._pack_tags(value)
+      else:
+        packed = _pack(kind, value)
+      if packed is None:
+        self._other[name][index] = value
+        packed = () if kind == TAGS else 0
+      self._values[name].append(packed)
+    self._size += 1
+    return Row(self, index)
+
+  def _pack_tags(self, tags):
+    """Returns the shared tuple of the ids of tags, a list of strings, or None
+    if tags is not one."""
+    if type(tags) is not list:
+      return None
+    ids = []
+    for tag in tags:
+      if type(tag) is not str:
+        return None
+      tag_id = self._tag_ids.get(tag)
+      if tag_id is None:
+        tag_id = self._tag_ids[tag] = len(self._tag_names)
+        self._tag_names.append(sys.intern(tag))
+      ids.append(tag_id)
+    ids = tuple(ids)
+    return self._tag_tuples.setdefault(ids, ids)
+
+  def value(self, name, index):
+    """Returns the value of field name of the record at index.
+
+    Raises:
+      KeyError: If name is not a field of this store.
+    """
+    other = self._other[name]
+    if other and index in other:
+      return other[index]
+    value = self._values[name][index]
+    kind = self._kinds[name]
+    if kind == FLOAT:
+      return None if value != value else value
+    if kind == BOOL:
+      return None if value < 0 else value == 1
+    if kind == TAGS:
+      names = self._tag_names
+      return [names[tag_id] for tag_id in value]
+    return value
+
+  def record(self, index):
+    """Returns a new dict of the record at index."""
+    return {name: self.value(name, index) for name in self.fields}
+
+
+class Row(collections.abc.Mapping):
+  """Read-only view of a record of a ColumnStore. It reads like the record,
+  and gives its fields as attributes as well, like the rows of a mapped binary
+  list file (see sjb.common.binary)."""
+
+  __slots__ = ('store', 'index')
+
+  def __init__(self, store, index):
+    self.store = store
+    self.index = index
+
+  def __getitem__(self, name):
+    return self.store.value(name, self.index)
+
+  def __iter__(self):
+    return iter(self.store.fields)
+
+  def __len__(self):
+    return len(self.store.fields)
+
+  def __getattr__(self, name):
+    if name in Row.__slots__:
+      # Not set yet, e.g. while copying.
+      raise AttributeError(name)
+    try:
+      return self.store.value(name, self.index)
+    except KeyError:
+      raise AttributeError(name)
+
+  def __reduce__(self):
+    return (Row, (self.store, self.index))
@@ -4,6 +4,7 @@ This includes:
   1) determining if we are running in a test environment.
   2) determining the proper directory to read/write data files to.
   3) determining the proper directory to read/write config files to.
+  4) determining the proper directory to read/write cache files to.
 
 This follows the freedesktop XDG base directory specifications:
 https://standards.freedesktop.org/basedir-spec/basedir-spec-latest.html
@@ -98,6 +99,27 @@ def get_user_config_dir():
     raise Exception('could not find necessary environment variables')
 
 
+def get_user_cache_dir():
+  """Gets the user-specific dir where apps may store their cache files.
+
+  This is specific to the user running this program.
+
+  Returns:
+    str the dir path where applications store their user-specific cache files.
+
+  Raises:
+    Exception: If neither XDG_CACHE_HOME or HOME are set in environment vars.
+  """
+  if is_test_env() and 'TEST_XDG_CACHE_HOME' in os.environ:
+    return os.environ['TEST_XDG_CACHE_HOME']
+  if 'XDG_CACHE_HOME' in os.environ:
+    return os.environ['XDG_CACHE_HOME']
+  elif 'HOME' in os.environ:
+    return os.path.join(os.environ['HOME'], '.cache')
+  else:
+    raise Exception('could not find necessary environment variables')
+
+
 def get_user_app_data_dir(app_name, suite_name=None):
   """Gets the user-specific dir where a given app may store its data files.
 
@@ -130,3 +152,20 @@ def get_user_app_config_dir(app_name, suite_name=None):
     Exception: If the default user-specific config dir could not be resolved.
   """
   return os.path.join(get_user_config_dir(), suite_name or '', app_name)
+
+
+def get_user_app_cache_dir(app_name, suite_name=None):
+  """Gets the user-specific dir where a given app may store its cache files.
+
+  Args:
+    app_name: str the name of the application. This should be unique.
+    suite_name: str the optional application "suite" name. If included, the
+      directory will be .../suite_name/app_name instead of .../app_name.
+
+  Returns:
+    str the dir path where the given app may store user-specific cache files.
+
+  Raises:
+    Exception: If the default user-specific cache dir could not be resolved.
+  """
+  return os.path.join(get_user_cache_dir(), suite_name or '', app_name)
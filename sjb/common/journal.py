@@ -0,0 +1,167 @@
+"""Module implementing the append-only journal kept next to a list file.
+
+Saving a whole list rewrites every item even if only one changed. Instead,
+the changes made since the list was loaded can be appended to a journal file
+as one JSON record per line:
+
+  {"op": "put", "item": {...}}     adds or replaces the item with that oid
+  {"op": "remove", "oid": 12}      removes the item with that oid
+  {"op": "commit", "modified_date": 1527001163.5}
+
+The records of a save end with a commit record. Loading replays the committed
+records on top of the list file, and ignores anything after the last commit,
+such as the partial records left by a crash. Replaying the same records twice
+gives the same list, so a journal that outlives the list file it was written
+for (e.g. after a crash during compaction) does no harm.
+"""
+import collections
+import json
+import os
+import sjb.common.base
+import sjb.common.storage
+
+OP_PUT = 'put'
+OP_REMOVE = 'remove'
+OP_COMMIT = 'commit'
+
+# The journal is folded back into the list file once it holds this many
+# records, or once it is larger than the list file itself (and MIN_SIZE).
+MAX_RECORDS = 1000
+MIN_SIZE = 64 * 1024
+
+
+class Recorder(object):
+  """Collects the changes made to an ItemList as journal records."""
+
+  def __init__(self, item_list):
+    self._item_list = item_list
+    # Maps the oid of each changed item to the item, or to None if it was
+    # removed, in the order of the last change.
+    self._changed = collections.OrderedDict()
+    item_list.subscribe(self._on_event)
+
+  @property
+  def item_list(self):
+    """ItemList: The list whose changes are recorded."""
+    return self._item_list
+
+  def _on_event(self, event):
+    oid = event.item.oid
+    self._changed.pop(oid, None)
+    if event.kind == sjb.common.base.ITEM_REMOVED:
+      self._changed[oid] = None
+    else:
+      self._changed[oid] = event.item
+
+  def has_changes(self):
+    """Returns True if any item changed since the last clear."""
+    return bool(self._changed)
+
+  def records(self):
+    """Returns the journal records for the changes, ending with a commit."""
+    records = []
+    for oid, item in self._changed.items():
+      if item is None:
+        records.append({'op': OP_REMOVE, 'oid': oid})
+      else:
+        records.append({'op': OP_PUT, 'item': item._to_dict()})
+    records.append({
+      'op': OP_COMMIT, 'modified_date': self._item_list.modified_date})
+    return records
+
+  def clear(self):
+    """Forgets the recorded changes, e.g. once they were saved."""
+    self._changed.clear()
+
+  def close(self):
+    """Stops recording changes."""
+    self._item_list.unsubscribe(self._on_event)
+
+
+def append(fname, records, durability=None, committed_size=None):
+  """Appends records to the journal file fname.
+
+  Args:
+    fname (str): The journal file. It is created if needed.
+    records: list of journal record dicts, the last one being a commit.
+    durability (str): One of sjb.common.storage.DURABILITY_CHOICES.
+    committed_size (int): If not None, the size of the committed part of the
+      journal as returned by read. Anything after it is dropped first, so that
+      partial records do not corrupt the new ones.
+
+  Returns:
+    int: The size of the journal after appending.
+  """
+  durability = sjb.common.storage.get_durability(durability)
+  created = not os.path.exists(fname)
+  data = ''.join(json.dumps(r, separators=(',', ':')) + '\n' for r in records)
+  with open(fname, 'ab') as f:
+    if committed_size is not None and f.tell() > committed_size:
+      f.truncate(committed_size)
+      f.seek(committed_size)
+    f.write(data.encode('utf-8'))
+    size = f.tell()
+    if durability != sjb.common.storage.DURABILITY_NONE:
+      f.flush()
+      os.fsync(f.fileno())
+  if created and durability == sjb.common.storage.DURABILITY_DIR:
+    sjb.common.storage.sync_directory(os.path.dirname(fname) or '.')
+  return size
+
+
+def read(fname):
+  """Returns the committed records of the journal file fname.
+
+  Returns:
+    (list(dict), int): The records up to and including the last commit
+      record, and the size in bytes of the journal up to there. This is an
+      empty list and 0 if there is no journal.
+  """
+  try:
+    f = open(fname, 'rb')
+  except FileNotFoundError:
+    return [], 0
+  records, committed, committed_size, size = [], 0, 0, 0
+  with f:
+    for line in f:
+      size += len(line)
+      try:
+        record = json.loads(line.decode('utf-8'))
+      except ValueError:
+        # A partial last line, left by a crash while appending.
+        break
+      records.append(record)
+      if record.get('op') == OP_COMMIT:
+        committed, committed_size = len(records), size
+  return records[:committed], committed_size
+
+
+def replay(item_list, records):
+  """Applies journal records to item_list, as read by read."""
+  for record in records:
+    op = record['op']
+    if op == OP_PUT:
+      item_list._put_record(record['item'])
+    elif op == OP_REMOVE:
+      item_list._drop_item(record['oid'])
+    elif op == OP_COMMIT:
+      item_list._set_modified_date(record['modified_date'])
+
+
+def needs_compaction(num_records, size, list_size):
+  """Returns True if a journal should be folded into its list file.
+
+  Args:
+    num_records (int): Number of records in the journal.
+    size (int): Size of the journal in bytes.
+    list_size (int): Size of the list file in bytes.
+  """
+  return num_records >= MAX_RECORDS or size >= max(MIN_SIZE, list_size)
+
+
+def remove(fname):
+  """Deletes the journal file fname if it exists."""
+  try:
+    os.remove(fname)
+  except FileNotFoundError:
+    pass
@@ -2,6 +2,8 @@
 # TODO: Eventually this should be made more robust. Code that deals with
 different things should be put into different modules.
 """
+import argparse
+import json
 import os
 import shutil
 import sys
@@ -41,6 +43,86 @@ def prompt_yes_no(question, default=None):
       sys.stdout.write("Invalid reponse\n")
 
 
+def oid_range_arg(string):
+  """Parses a command line item id argument.
+
+  The argument is either a single id like '12', or an inclusive range of ids
+  like '10-50'.
+
+  Returns:
+    range: The ids given by the argument.
+
+  Raises:
+    argparse.ArgumentTypeError: If the argument is not an id or a range.
+  """
+  try:
+    if '-' in string[1:]:
+      lo, hi = string.split('-', 1)
+      lo, hi = int(lo), int(hi)
+      if lo > hi:
+        raise ValueError()
+      return range(lo, hi + 1)
+    oid = int(string)
+    return range(oid, oid + 1)
+  except ValueError:
+    raise argparse.ArgumentTypeError(
+      'invalid id or id range: "%s"' % string)
+
+
+def positive_int_arg(string):
+  """Parses a command line argument that must be an integer above 0.
+
+  Raises:
+    argparse.ArgumentTypeError: If the argument is not such an integer.
+  """
+  return _int_arg(string, 1, 'positive integer')
+
+
+def non_negative_int_arg(string):
+  """Parses a command line argument that must be an integer of at least 0.
+
+  Raises:
+    argparse.ArgumentTypeError: If the argument is not such an integer.
+  """
+  return _int_arg(string, 0, 'non negative integer')
+
+
+def _int_arg(string, minimum, description):
+  """Parses a command line argument that must be an integer of at least
+  minimum, described as description in the error message.
+
+  Raises:
+    argparse.ArgumentTypeError: If the argument is not such an integer.
+  """
+  try:
+    value = int(string)
+  except ValueError:
+    value = None
+  if value is None or value < minimum:
+    raise argparse.ArgumentTypeError(
+      'not a %s: "%s"' % (description, string))
+  return value
+
+
+def read_json_file(fname):
+  """Returns the JSON value stored in fname, or in standard input if fname
+  is '-'."""
+  if fname == '-':
+    return json.load(sys.stdin)
+  with open(fname, 'r') as f:
+    return json.load(f)
+
+
+def write_json_file(fname, value):
+  """Writes value as JSON to fname, or to standard output if fname is '-'."""
+  if fname == '-':
+    json.dump(value, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+    return
+  with open(fname, 'w') as f:
+    json.dump(value, f, indent=2)
+
+
 def backup_file(fname, extension):
   if os.path.isfile(fname):
     shutil.copyfile(fname, '%s%s' % (fname, extension))
@@ -0,0 +1,176 @@
+"""Module implementing the offset index kept next to a JSON list file.
+
+The index maps the oid of every item to the offset and length of the JSON
+object of the item in the list file, so that a command working on a few items
+given by id reads just their records instead of parsing the whole file (see
+ListStorage.load_items). It is written after the list file, and records the
+size and mtime of the file it was written for; an index that does not match
+its list file is ignored.
+
+An index file is made of:
+
+  header    magic, format version, size and mtime_ns of the list file, number
+            of items and length of the meta section
+  meta      the version and modified_date of the list, as JSON, padded to 8
+            bytes
+  entries   oid, offset and length of every item as int64s, sorted by oid
+
+All numbers are little endian.
+"""
+import json
+import mmap
+import os
+import re
+import struct
+import sjb.common.storage
+
+_MAGIC = b'SJBO'
+_FORMAT_VERSION = 1
+_HEADER = struct.Struct('<4sHHQqQQ')
+_ENTRY = struct.Struct('<qqq')
+
+# Start of the JSON object of an item, whose first key is always its oid. This
+# cannot occur inside a JSON string, where the quotes would be escaped.
+_ITEM_START = re.compile(rb'\{\s*"oid"\s*:\s*(-?\d+)')
+_WHITESPACE = b' \t\r\n'
+
+
+def scan(data):
+  """Returns the (oid, offset, length) of every item of a list file.
+
+  Args:
+    data (bytes): Contents of a list file, whose items are the last key of
+      the only list in it, as written by ItemList.to_dict.
+
+  Returns:
+    list(tuple): The entries in list order, or None if the layout of data is
+      not the expected one.
+  """
+  matches = list(_ITEM_START.finditer(data))
+  if not matches:
+    return []
+  entries = []
+  for m, following in zip(matches, matches[1:]):
+    # Only a separator lies between the end of an item and the next one.
+    end = data.rfind(b'}', m.start(), following.start()) + 1
+    entries.append((int(m.group(1)), m.start(), end - m.start()))
+  end = _last_item_end(data)
+  if end is None or end <= matches[-1].start():
+    return None
+  entries.append(
+    (int(matches[-1].group(1)), matches[-1].start(), end - matches[-1].start()))
+  return entries
+
+
+def _last_item_end(data):
+  """Returns the offset just past the last item of data, which is followed by
+  the ends of the item array, of the list dict and of the root dict."""
+  pos = len(data)
+  for closing in b'}}]':
+    while pos and data[pos - 1] in _WHITESPACE:
+      pos -= 1
+    if not pos or data[pos - 1] != closing:
+      return None
+    pos -= 1
+  while pos and data[pos - 1] in _WHITESPACE:
+    pos -= 1
+  if not pos or data[pos - 1] != ord('}'):
+    return None
+  return pos
+
+
+def write(fname, list_fname, entries, meta):
+  """Writes the offset index fname of the list file list_fname.
+
+  Args:
+    fname (str): The index file.
+    list_fname (str): The list file, as just written.
+    entries: (oid, offset, length) of its items, as returned by scan.
+    meta (dict): The version and modified_date of the list.
+  """
+  st = os.stat(list_fname)
+  meta = json.dumps(meta).encode('utf-8')
+  meta += b' ' * (-len(meta) % 8)
+  parts = [
+    _HEADER.pack(
+      _MAGIC, _FORMAT_VERSION, 0, st.st_size, st.st_mtime_ns, len(entries),
+      len(meta)),
+    meta]
+  flat = [value for entry in sorted(entries) for value in entry]
+  parts.append(struct.pack('<%dq' % len(flat), *flat))
+  # The index is derived data that is checked on load, so it is not synced.
+  sjb.common.storage.atomic_write(
+    fname, b''.join(parts), durability=sjb.common.storage.DURABILITY_NONE)
+
+
+class OffsetIndex(object):
+  """The offset index of a list file, read on demand from its mapped file."""
+
+  def __init__(self, data, count, meta_end, meta):
+    self._data = data
+    self._count = count
+    self._meta_end = meta_end
+    self.meta = meta
+
+  @staticmethod
+  def open(fname, list_fname):
+    """Returns the OffsetIndex in fname, or None if there is none or it was
+    not written for the current version of the list file list_fname."""
+    try:
+      with open(fname, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+      st = os.stat(list_fname)
+    except (OSError, ValueError):
+      return None
+    if len(data) < _HEADER.size:
+      return None
+    magic, version, _, size, mtime_ns, count, meta_len = _HEADER.unpack_from(
+      data)
+    meta_end = _HEADER.size + meta_len
+    if (magic != _MAGIC or version != _FORMAT_VERSION
+        or (size, mtime_ns) != (st.st_size, st.st_mtime_ns)
+        or len(data) != meta_end + count * _ENTRY.size):
+      return None
+    try:
+      meta = json.loads(data[_HEADER.size:meta_end].decode('utf-8'))
+    except ValueError:
+      return None
+    return OffsetIndex(data, count, meta_end, meta)
+
+  def __len__(self):
+    return self._count
+
+  def _entry(self, i):
+    return _ENTRY.unpack_from(self._data, self._meta_end + i * _ENTRY.size)
+
+  def _bisect(self, oid):
+    """Returns the index of the first entry whose oid is not below oid."""
+    lo, hi = 0, self._count
+    while lo < hi:
+      mid = (lo + hi) // 2
+      if self._entry(mid)[0] < oid:
+        lo = mid + 1
+      else:
+        hi = mid
+    return lo
+
+  def max_oid(self):
+    """Returns the largest oid in the index, or 0 if it is empty."""
+    return self._entry(self._count - 1)[0] if self._count else 0
+
+  def select(self, oid_ranges):
+    """Returns the (oid, offset, length) of the items with oids in any of
+    oid_ranges, range objects of oids, in the order of the list file."""
+    entries = {}
+    for r in oid_ranges:
+      if not r:
+        continue
+      i = self._bisect(r[0])
+      while i < self._count:
+        entry = self._entry(i)
+        if entry[0] > r[-1]:
+          break
+        if entry[0] in r:
+          entries[entry[0]] = entry
+        i += 1
+    return sorted(entries.values(), key=lambda entry: entry[1])
@@ -0,0 +1,373 @@
+"""Composable item matchers and the planner that runs them against indexes.
+
+Matchers are combined with And, Or and Not. Every matcher can plan itself
+against an ItemList: it works out which oids can match from the indexes the
+list keeps, and which condition (the residual) still has to be checked on each
+of those items. query_items then only calls matches on the candidates.
+
+And orders its operands by their estimated number of matches, intersects the
+index lookups smallest first and leaves the remaining conditions, cheapest
+first, for the per-item check.
+
+Matchers can also tell from a Summary of a group of items, such as a segment
+of an archive, whether any item of the group can match.
+"""
+import collections
+import sjb.common.base
+
+# An And only intersects an index lookup if it is at most this many times
+# larger than the candidates found so far. Otherwise it is cheaper to check
+# the condition on each remaining candidate.
+_MAX_INTERSECT_RATIO = 16
+
+# Bounds of the items of a group: the values of their date field lie in
+# [low, high], and their tags are a subset of tags.
+Summary = collections.namedtuple('Summary', ['field', 'low', 'high', 'tags'])
+
+
+class Matcher(sjb.common.base.ItemMatcher):
+  """Base class for the composable matchers of this module."""
+
+  # Rough relative cost of calling matches on one item.
+  cost = 1
+
+  def plan(self, item_list):
+    """Plans this matcher against the indexes of item_list.
+
+    Returns:
+      (set(int), ItemMatcher): The oids of the items that can match, or None
+        if every item can; and the matcher to check on each of those items, or
+        None if every one of them matches.
+    """
+    oids = self.lookup(item_list)
+    if oids is None:
+      return None, self
+    return oids, None
+
+  def lookup(self, item_list):
+    """Returns the set of oids matching this condition from an index of
+    item_list, or None if no index can answer it. The set must not be
+    modified."""
+    return None
+
+  def estimate(self, item_list):
+    """Returns the number of items lookup would return, or None."""
+    oids = self.lookup(item_list)
+    return None if oids is None else len(oids)
+
+  def could_match(self, summary):
+    """Returns False if no item within the bounds of summary, a Summary, can
+    match."""
+    return True
+
+  def candidates(self, item_list):
+    """Returns the oids of the items in item_list that could possibly match."""
+    return self.plan(item_list)[0]
+
+  def signature(self):
+    """Returns a hashable value made of the class and attributes."""
+    return (type(self).__name__,) + tuple(
+      (name, _freeze(value)) for name, value in sorted(vars(self).items()))
+
+  def __and__(self, other):
+    return And(self, other)
+
+  def __or__(self, other):
+    return Or(self, other)
+
+  def __invert__(self):
+    return Not(self)
+
+
+class All(Matcher):
+  """Matches every item."""
+
+  def matches(self, item):
+    return True
+
+  def plan(self, item_list):
+    return None, None
+
+
+class Tag(Matcher):
+  """Matches items carrying a tag."""
+
+  cost = 2
+
+  def __init__(self, tag, fields=('tags',)):
+    """Initializes a Tag matcher.
+
+    Args:
+      tag (str): The tag to look for.
+      fields: Names of the item fields the tag is looked for in. Each field
+        holds either a collection of tags or a single tag.
+    """
+    self.tag = tag
+    self.fields = tuple(fields)
+
+  def matches(self, item):
+    for field in self.fields:
+      value = getattr(item, field)
+      if value == self.tag or (
+          not isinstance(value, str) and self.tag in value):
+        return True
+    return False
+
+  def lookup(self, item_list):
+    # The tag index only answers this exactly if it covers the same fields.
+    if not _is_indexed_tag(self, item_list):
+      return None
+    return item_list.lookup('tags', self.tag)
+
+  def could_match(self, summary):
+    return self.fields != ('tags',) or self.tag in summary.tags
+
+
+class Field(Matcher):
+  """Matches items whose field has the given value.
+
+  field may also be a tuple of field names, with value the tuple of their
+  values, for lists that index a combination of fields.
+  """
+
+  def __init__(self, field, value):
+    self.field = field
+    self.value = value
+
+  def matches(self, item):
+    if isinstance(self.field, tuple):
+      return tuple(getattr(item, f) for f in self.field) == tuple(self.value)
+    return getattr(item, self.field) == self.value
+
+  def lookup(self, item_list):
+    return item_list.lookup(self.field, self.value)
+
+  def estimate(self, item_list):
+    return item_list.count(self.field, self.value)
+
+
+class Priority(Field):
+  """Matches todos with the given priority."""
+
+  def __init__(self, priority):
+    super().__init__('priority', priority)
+
+
+class Finished(Field):
+  """Matches todos with the given completion state."""
+
+  def __init__(self, finished=True):
+    super().__init__('finished', finished)
+
+
+class DateRange(Matcher):
+  """Matches items whose date field lies in [start, end).
+
+  Items whose date is None never match.
+  """
+
+  def __init__(self, field, start=None, end=None):
+    self.field = field
+    self.start = start
+    self.end = end
+
+  def matches(self, item):
+    value = getattr(item, self.field)
+    if value is None:
+      return False
+    if self.start is not None and value < self.start:
+      return False
+    if self.end is not None and value >= self.end:
+      return False
+    return True
+
+  def lookup(self, item_list):
+    return item_list.lookup_range(self.field, self.start, self.end)
+
+  def estimate(self, item_list):
+    return item_list.count_range(self.field, self.start, self.end)
+
+  def could_match(self, summary):
+    if self.field != summary.field:
+      return True
+    if self.start is not None and summary.high < self.start:
+      return False
+    return self.end is None or summary.low < self.end
+
+
+class Text(Matcher):
+  """Matches items with a case insensitive substring in a text field."""
+
+  cost = 10
+
+  def __init__(self, text, fields=('text',)):
+    self.text = text.lower()
+    self.fields = tuple(fields)
+
+  def matches(self, item):
+    for field in self.fields:
+      if self.text in getattr(item, field).lower():
+        return True
+    return False
+
+
+class And(Matcher):
+  """Matches items that match every one of its operands."""
+
+  def __init__(self, *operands):
+    self.operands = operands
+    self.cost = sum(m.cost for m in operands)
+
+  def matches(self, item):
+    for m in self.operands:
+      if not m.matches(item):
+        return False
+    return True
+
+  def signature(self):
+    # The order of the operands does not change the result.
+    return _combined_signature('And', self.operands)
+
+  def could_match(self, summary):
+    return all(m.could_match(summary) for m in self.operands)
+
+  def plan(self, item_list):
+    # Tag conditions are answered together by the tag index of the list: the
+    # postings give the candidates and the NOT tags are checked with one
+    # bitwise operation per candidate.
+    all_of, none_of, tag_operands, operands = [], [], [], []
+    for m in self.operands:
+      if _is_indexed_tag(m, item_list):
+        all_of.append(m.tag)
+        tag_operands.append(m)
+      elif isinstance(m, Not) and _is_indexed_tag(m.operand, item_list):
+        none_of.append(m.operand.tag)
+        tag_operands.append(m)
+      else:
+        operands.append(m)
+
+    # Each step is (estimated number of oids, function planning it, matcher
+    # to check per item instead if the step is skipped).
+    steps, residuals = [], []
+    if tag_operands:
+      if all_of:
+        estimate = min(len(item_list.lookup('tags', tag)) for tag in all_of)
+      else:
+        estimate = item_list.size()
+      steps.append((
+        estimate,
+        lambda: (item_list.oids_with_tags(all_of=all_of, none_of=none_of), None),
+        And(*tag_operands)))
+    for m in operands:
+      estimate = m.estimate(item_list)
+      if estimate is not None:
+        steps.append((estimate, lambda m=m: m.plan(item_list), m))
+        continue
+      planned = m.plan(item_list)
+      if planned[0] is None:
+        residuals.append(planned[1])
+      else:
+        steps.append((len(planned[0]), lambda p=planned: p, m))
+    steps.sort(key=lambda step: step[0])
+
+    # Intersect the lookups smallest first, as long as they are not much
+    # larger than the candidates found so far.
+    oids = None
+    for estimate, plan, m in steps:
+      if oids is not None and (
+          not oids or estimate > _MAX_INTERSECT_RATIO * len(oids)):
+        residuals.append(m)
+        continue
+      m_oids, residual = plan()
+      if residual is not None:
+        residuals.append(residual)
+      if oids is None:
+        oids = set(m_oids)
+      else:
+        oids.intersection_update(m_oids)
+
+    residuals.sort(key=lambda m: m.cost)
+    if not residuals:
+      return oids, None
+    if len(residuals) == 1:
+      return oids, residuals[0]
+    return oids, And(*residuals)
+
+
+class Or(Matcher):
+  """Matches items that match at least one of its operands."""
+
+  def __init__(self, *operands):
+    self.operands = operands
+    self.cost = sum(m.cost for m in operands)
+
+  def matches(self, item):
+    for m in self.operands:
+      if m.matches(item):
+        return True
+    return False
+
+  def signature(self):
+    return _combined_signature('Or', self.operands)
+
+  def could_match(self, summary):
+    return any(m.could_match(summary) for m in self.operands)
+
+  def plan(self, item_list):
+    if not self.operands:
+      return set(), None
+    oids, exact = set(), True
+    for m in self.operands:
+      m_oids, residual = m.plan(item_list)
+      if m_oids is None:
+        # One operand needs a full scan, so the whole Or does.
+        return None, self
+      oids.update(m_oids)
+      exact = exact and residual is None
+    return oids, None if exact else self
+
+
+class Not(Matcher):
+  """Matches items that do not match its operand."""
+
+  def __init__(self, operand):
+    self.operand = operand
+    self.cost = operand.cost
+
+  def matches(self, item):
+    return not self.operand.matches(item)
+
+  def signature(self):
+    signature = self.operand.signature()
+    return None if signature is None else ('Not', signature)
+
+  def plan(self, item_list):
+    oids, residual = self.operand.plan(item_list)
+    if oids is None or residual is not None:
+      return None, self
+    # Take the complement of the oids without building any item.
+    return item_list.all_oids() - oids, None
+
+
+def _freeze(value):
+  """Returns a hashable equivalent of an attribute value of a matcher."""
+  if isinstance(value, Matcher):
+    return value.signature()
+  if isinstance(value, (set, frozenset)):
+    return frozenset(_freeze(v) for v in value)
+  if isinstance(value, (list, tuple)):
+    return tuple(_freeze(v) for v in value)
+  return value
+
+
+def _combined_signature(name, operands):
+  """Returns the signature of an And or Or of operands, or None."""
+  signatures = frozenset(m.signature() for m in operands)
+  if None in signatures:
+    return None
+  return (name, signatures)
+
+
+def _is_indexed_tag(m, item_list):
+  """Returns True if m is a Tag matcher that item_list can answer exactly."""
+  return isinstance(m, Tag) and set(m.fields) == set(item_list.TAG_FIELDS)
@@ -0,0 +1,68 @@
+"""Module implementing the cache of parsed list files.
+
+Parsing a large list file and building its items and indexes is most of the
+cost of a command. Once a list file is parsed, the resulting ItemList is
+pickled to a snapshot in the cache directory, together with a key made of the
+mtime, size and sha256 of the file it was parsed from. Loading the same file
+again unpickles the snapshot instead.
+
+A snapshot is only used if its key matches the file that was just read, so a
+stale snapshot is never used even if the file was replaced within the mtime
+resolution. A snapshot that does not match or cannot be read is ignored and
+replaced, without an error. Snapshots are pickles, so they are only read from
+the cache directory of the user.
+"""
+import os
+import pickle
+import sjb.common.storage
+import sjb.constants
+
+# Version of the snapshot files. The version of the package is part of the
+# key as well, as its classes are pickled.
+_FORMAT_VERSION = 3
+
+# Snapshots are only kept for list files of at least this many bytes. Smaller
+# files parse about as fast as a snapshot loads.
+MIN_SIZE = 64 * 1024
+
+
+def make_key(fname, digest):
+  """Returns the key of a snapshot of the list file fname.
+
+  Args:
+    fname (str): The list file, just read.
+    digest: hashlib sha256 object fed the bytes read from fname.
+  """
+  st = os.stat(fname)
+  return (
+    _FORMAT_VERSION, sjb.constants.__version__, st.st_mtime_ns, st.st_size,
+    digest.hexdigest())
+
+
+def load(snapshot_file, key):
+  """Returns the ItemList stored in snapshot_file if it has the given key, or
+  None if it does not or cannot be read."""
+  try:
+    with open(snapshot_file, 'rb') as f:
+      # The key is pickled on its own first, so that a stale snapshot is
+      # rejected without reading the list.
+      if pickle.load(f) != key:
+        return None
+      return pickle.load(f)
+  except Exception:
+    # Truncated or corrupt snapshots, or ones pickled from classes that
+    # since changed, may fail in many ways. They are simply rebuilt.
+    return None
+
+
+def save(snapshot_file, key, item_list):
+  """Stores item_list, just parsed from the list file of key, in
+  snapshot_file. Failures are ignored, as the snapshot is only a cache."""
+  try:
+    os.makedirs(os.path.dirname(snapshot_file), exist_ok=True)
+    data = pickle.dumps(key, pickle.HIGHEST_PROTOCOL) + pickle.dumps(
+      item_list, pickle.HIGHEST_PROTOCOL)
+    sjb.common.storage.atomic_write(
+      snapshot_file, data, durability=sjb.common.storage.DURABILITY_NONE)
+  except (OSError, pickle.PicklingError):
+    pass
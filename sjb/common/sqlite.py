@@ -0,0 +1,414 @@
+"""Module implementing the SQLite storage backend shared by the apps.
+
+A list is stored in a single SQLite database next to the JSON list files:
+
+  meta (key, value)                 version and modified_date, as JSON
+  items (oid, position, ...)        one row per item, one column per field
+  tags (tag, oid)                   one row per tag of each item
+
+Saving a list loaded from the database only writes the rows of the items
+changed since, using the same records as the journal of the JSON backend (see
+sjb.common.journal). Queries are translated to SQL where possible, so that
+showing a few items does not load the whole list.
+"""
+import abc
+import itertools
+import json
+import os
+import sqlite3
+import sjb.common.base
+import sjb.common.journal
+import sjb.common.query
+import sjb.common.storage
+
+_SQLITE_EXTENSION = '.sqlite'
+
+# Version of the database schema, stored as the user_version of the database.
+_SCHEMA_VERSION = 1
+
+# Maps each durability to the SQLite synchronous setting providing it.
+_SYNCHRONOUS = {
+  sjb.common.storage.DURABILITY_NONE: 'OFF',
+  sjb.common.storage.DURABILITY_FILE: 'NORMAL',
+  sjb.common.storage.DURABILITY_DIR: 'FULL',
+}
+
+# Maximum number of oids bound to a single statement.
+_MAX_PARAMS = 500
+
+# Column type of the fields stored as booleans. SQLite keeps them as 0 and 1.
+BOOLEAN = 'BOOLEAN'
+
+
+class SqliteStorage(sjb.common.storage.ListStorage):
+  """Base class of the objects storing the lists of an app in SQLite.
+
+  Subclasses set _ROOT_KEY, _ITEMS_KEY, _COLUMNS and _INDEXES, and implement
+  _list_from_dict and _item_from_dict.
+  """
+
+  BACKEND = sjb.common.storage.BACKEND_SQLITE
+  _EXTENSION = _SQLITE_EXTENSION
+
+  # (name, SQL type) of the item fields stored in the columns of the items
+  # table. The oid and the tags are stored separately.
+  _COLUMNS = ()
+  # Tuples of the columns of each index on the items table.
+  _INDEXES = ()
+
+  def __init__(
+      self, listname=None, durability=None, style=None, codec=None,
+      archive_days=None):
+    super().__init__(
+      listname=listname, durability=durability, style=style, codec=codec,
+      archive_days=archive_days)
+    self._conn = None
+
+  @abc.abstractmethod
+  def _item_from_dict(self, record):
+    """Builds the item represented by a record of this app."""
+    return
+
+  def _connect(self, create=False):
+    """Returns the connection to the database, opening it if needed.
+
+    Raises:
+      NoListFileError: If the database does not exist and create is False.
+      IOError: If a file-like object exists but is wrong type (i.e. a dir).
+    """
+    if self._conn is not None:
+      return self._conn
+    fname = self._get_list_file()
+    if not os.path.isfile(fname):
+      if os.path.exists(fname):
+        raise sjb.common.storage.IOError(
+          'list file exists but is of wrong filetype')
+      if not create:
+        raise sjb.common.storage.NoListFileError()
+      if not os.path.isdir(os.path.dirname(fname)):
+        os.makedirs(os.path.dirname(fname))
+    conn = sqlite3.connect(fname)
+    conn.execute('PRAGMA synchronous = %s' % _SYNCHRONOUS[self._durability])
+    if conn.execute('PRAGMA user_version').fetchone()[0] < _SCHEMA_VERSION:
+      with conn:
+        self._create_schema(conn)
+    self._conn = conn
+    return conn
+
+  def _create_schema(self, conn):
+    columns = ''.join(', "%s" %s' % c for c in self._COLUMNS)
+    conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+    conn.execute(
+      'CREATE TABLE IF NOT EXISTS items (oid INTEGER PRIMARY KEY, '
+      'position INTEGER NOT NULL%s)' % columns)
+    conn.execute(
+      'CREATE TABLE IF NOT EXISTS tags (tag TEXT NOT NULL, oid INTEGER NOT NULL, '
+      'PRIMARY KEY (tag, oid)) WITHOUT ROWID')
+    conn.execute('CREATE INDEX IF NOT EXISTS tags_oid ON tags (oid)')
+    conn.execute('CREATE INDEX IF NOT EXISTS items_position ON items (position)')
+    for index in self._INDEXES:
+      conn.execute('CREATE INDEX IF NOT EXISTS "items_%s" ON items (%s)' % (
+        '_'.join(index), ', '.join('"%s"' % c for c in index)))
+    conn.execute('PRAGMA user_version = %d' % _SCHEMA_VERSION)
+
+  def close(self):
+    """Closes the database, if it is open."""
+    if self._conn is not None:
+      self._conn.close()
+      self._conn = None
+
+  def save_list(self, item_list):
+    """Saves the list to the database pointed at by this object.
+
+    If item_list was loaded by this object, only the rows of the items
+    changed since are written. Otherwise the database is replaced by
+    item_list. Either way this happens in a single transaction.
+
+    Raises:
+      sjb.common.base.ValidationError: If some element of the list is invalid.
+    """
+    # Items changed directly are only seen by the recorder once their changes
+    # are applied.
+    item_list.apply_direct_changes()
+    item_list.validate_dirty()
+
+    recorder = self._recorder
+    conn = self._connect(create=True)
+    with conn:
+      if recorder is not None and recorder.item_list is item_list:
+        if not recorder.has_changes():
+          return
+        records = recorder.records()
+      else:
+        conn.execute('DELETE FROM tags')
+        conn.execute('DELETE FROM items')
+        records = [
+          {'op': sjb.common.journal.OP_PUT, 'item': item}
+          for item in item_list._item_dicts()]
+        records.append({
+          'op': sjb.common.journal.OP_COMMIT,
+          'modified_date': item_list.modified_date})
+      self._set_meta(conn, 'version', item_list.version)
+      for record in records:
+        self._apply_record(conn, record)
+    # The recorder of another list keeps its changes.
+    if recorder is not None and recorder.item_list is item_list:
+      recorder.clear()
+
+  def _apply_record(self, conn, record):
+    """Applies a journal record to the database."""
+    op = record['op']
+    if op == sjb.common.journal.OP_PUT:
+      item = record['item']
+      names = ['oid'] + [name for name, _ in self._COLUMNS]
+      # New items go to the end of the list; replaced ones keep their place.
+      conn.execute(
+        'INSERT INTO items (position, %s) VALUES ('
+        '(SELECT COALESCE(MAX(position), 0) + 1 FROM items), %s) '
+        'ON CONFLICT (oid) DO UPDATE SET %s' % (
+          ', '.join('"%s"' % n for n in names),
+          ', '.join('?' for n in names),
+          ', '.join('"%s" = excluded."%s"' % (n, n) for n in names[1:])),
+        [item[n] for n in names])
+      conn.execute('DELETE FROM tags WHERE oid = ?', (item['oid'],))
+      conn.executemany(
+        'INSERT INTO tags (tag, oid) VALUES (?, ?)',
+        [(tag, item['oid']) for tag in item['tags']])
+    elif op == sjb.common.journal.OP_REMOVE:
+      conn.execute('DELETE FROM tags WHERE oid = ?', (record['oid'],))
+      conn.execute('DELETE FROM items WHERE oid = ?', (record['oid'],))
+    elif op == sjb.common.journal.OP_COMMIT:
+      self._set_meta(conn, 'modified_date', record['modified_date'])
+
+  def _set_meta(self, conn, key, value):
+    conn.execute(
+      'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+      (key, json.dumps(value)))
+
+  def load_list(self, lazy=False, trusted=False, history=False):
+    """Loads the list from the database.
+
+    Args:
+      lazy (bool): If True, items are only built and validated when they are
+        first accessed.
+      trusted (bool): Accepted for compatibility with the JSON backend. The
+        database has no checksum, so a list loaded eagerly is always
+        validated.
+      history (bool): Accepted for compatibility with the JSON backend.
+        Databases are not archived, as queries only read the rows they need.
+
+    Returns:
+      ItemList: object with contents given by the database.
+
+    Raises:
+      ValidationError: If some element of the list is invalid.
+      NoListFileError: If the database does not exist.
+      IOError: If a file-like object exists but is wrong type (i.e. a dir).
+    """
+    conn = self._connect()
+    meta = {
+      key: json.loads(value)
+      for key, value in conn.execute('SELECT key, value FROM meta')}
+    records = self._select_records(conn, '1', [], 'position')
+    lst = self._list_from_dict({self._ROOT_KEY: {
+      'version': meta.get('version'),
+      'modified_date': meta.get('modified_date'),
+      self._ITEMS_KEY: records,
+    }}, lazy)
+    if not lazy:
+      lst.validate()
+
+    if self._recorder is not None:
+      self._recorder.close()
+    self._recorder = sjb.common.journal.Recorder(lst)
+    return lst
+
+  def query_items(
+      self, item_matcher=None, sort_field=None, limit=None, offset=0,
+      history=False):
+    """Returns the items of the list matching item_matcher.
+
+    The conditions of item_matcher that can be written in SQL are checked by
+    the database, using its indexes; only the others are checked on the
+    items built from the selected rows. See ListStorage.query_items for the
+    arguments; history has no effect as databases are not archived.
+    """
+    conn = self._connect()
+    where, params, residual = _translate(item_matcher, self)
+    if sort_field is None:
+      order = 'position'
+    else:
+      if sort_field not in dict(self._COLUMNS):
+        raise sjb.common.base.IllegalStateError(
+          'SqliteStorage.query_items', 'cannot sort by field: '+str(sort_field))
+      # Items without a value come last, and ties are ordered by oid.
+      order = '"%s" IS NULL, "%s", oid' % (sort_field, sort_field)
+    if residual is None and (limit is not None or offset):
+      records = self._select_records(
+        conn, where, params, order, limit=limit, offset=offset)
+      return [self._build_item(r) for r in records]
+
+    records = self._select_records(conn, where, params, order)
+    items = (self._build_item(r) for r in records)
+    if residual is not None:
+      items = (item for item in items if residual.matches(item))
+    stop = None if limit is None else offset + limit
+    return list(itertools.islice(items, offset, stop))
+
+  def _build_item(self, record):
+    item = self._item_from_dict(record)
+    item._validate()
+    return item
+
+  def _select_records(self, conn, where, params, order, limit=None, offset=0):
+    """Returns the records of the items selected by a WHERE clause."""
+    names = [name for name, _ in self._COLUMNS]
+    sql = 'SELECT oid, %s FROM items WHERE %s ORDER BY %s' % (
+      ', '.join('"%s"' % n for n in names), where, order)
+    if limit is not None or offset:
+      sql += ' LIMIT ? OFFSET ?'
+      params = list(params) + [-1 if limit is None else limit, offset]
+
+    booleans = {name for name, sql_type in self._COLUMNS if sql_type == BOOLEAN}
+    records = []
+    for row in conn.execute(sql, params):
+      record = {'oid': row[0], 'tags': []}
+      for name, value in zip(names, row[1:]):
+        if name in booleans and value is not None:
+          value = bool(value)
+        record[name] = value
+      records.append(record)
+
+    by_oid = {record['oid']: record for record in records}
+    if where == '1' and limit is None and not offset:
+      # Every item was selected, so read all of the tags at once.
+      for oid, tag in conn.execute('SELECT oid, tag FROM tags ORDER BY tag'):
+        by_oid[oid]['tags'].append(tag)
+      return records
+    oids = list(by_oid)
+    for i in range(0, len(oids), _MAX_PARAMS):
+      chunk = oids[i:i + _MAX_PARAMS]
+      rows = conn.execute(
+        'SELECT oid, tag FROM tags WHERE oid IN (%s) ORDER BY tag' %
+        ', '.join('?' for oid in chunk), chunk)
+      for oid, tag in rows:
+        by_oid[oid]['tags'].append(tag)
+    return records
+
+
+def _translate(matcher, storage):
+  """Translates a matcher to SQL, as far as possible.
+
+  Args:
+    matcher: An ItemMatcher, or None to match every item.
+    storage (SqliteStorage): The storage whose tables are queried.
+
+  Returns:
+    (str, list, ItemMatcher): A WHERE clause on the items table and its
+      parameters, and the matcher still to check on each selected item, or
+      None if the clause is exact.
+  """
+  if matcher is None:
+    return '1', [], None
+  if not isinstance(matcher, sjb.common.query.Matcher):
+    if not hasattr(matcher, 'to_query'):
+      return '1', [], matcher
+    matcher = matcher.to_query()
+
+  if isinstance(matcher, sjb.common.query.And):
+    clauses, params, residuals = [], [], []
+    for m in matcher.operands:
+      clause, m_params, residual = _translate(m, storage)
+      clauses.append(clause)
+      params.extend(m_params)
+      if residual is not None:
+        residuals.append(residual)
+    residuals.sort(key=lambda m: m.cost)
+    if not residuals:
+      residual = None
+    elif len(residuals) == 1:
+      residual = residuals[0]
+    else:
+      residual = sjb.common.query.And(*residuals)
+    return _join(clauses, 'AND', '1'), params, residual
+
+  clause = _exact_clause(matcher, storage)
+  if clause is None:
+    return '1', [], matcher
+  return clause[0], clause[1], None
+
+
+def _exact_clause(matcher, storage):
+  """Returns the WHERE clause and parameters exactly equivalent to matcher,
+  or None if there is none."""
+  columns = dict(storage._COLUMNS)
+  query = sjb.common.query
+
+  if isinstance(matcher, query.All):
+    return '1', []
+
+  if isinstance(matcher, query.Tag):
+    clauses, params = [], []
+    for field in matcher.fields:
+      if field == 'tags':
+        clauses.append('oid IN (SELECT oid FROM tags WHERE tag = ?)')
+      elif field in columns:
+        clauses.append('"%s" IS ?' % field)
+      else:
+        return None
+      params.append(matcher.tag)
+    return _join(clauses, 'OR', '0'), params
+
+  if isinstance(matcher, query.Field):
+    if isinstance(matcher.field, tuple):
+      pairs = list(zip(matcher.field, matcher.value))
+    else:
+      pairs = [(matcher.field, matcher.value)]
+    if any(field not in columns for field, _ in pairs):
+      return None
+    return (
+      _join(['"%s" IS ?' % field for field, _ in pairs], 'AND', '1'),
+      [value for _, value in pairs])
+
+  if isinstance(matcher, query.DateRange):
+    if matcher.field not in columns:
+      return None
+    clauses, params = ['"%s" IS NOT NULL' % matcher.field], []
+    if matcher.start is not None:
+      clauses.append('"%s" >= ?' % matcher.field)
+      params.append(matcher.start)
+    if matcher.end is not None:
+      clauses.append('"%s" < ?' % matcher.field)
+      params.append(matcher.end)
+    return _join(clauses, 'AND', '1'), params
+
+  if isinstance(matcher, (query.And, query.Or)):
+    clauses, params = [], []
+    for m in matcher.operands:
+      clause = _exact_clause(m, storage)
+      if clause is None:
+        return None
+      clauses.append(clause[0])
+      params.extend(clause[1])
+    if isinstance(matcher, query.And):
+      return _join(clauses, 'AND', '1'), params
+    return _join(clauses, 'OR', '0'), params
+
+  if isinstance(matcher, query.Not):
+    clause = _exact_clause(matcher.operand, storage)
+    if clause is None:
+      return None
+    return 'NOT (%s)' % clause[0], clause[1]
+
+  # Other matchers, e.g. Text whose case folding SQLite does not share, are
+  # checked on the items.
+  return None
+
+
+def _join(clauses, operator, empty):
+  """Joins SQL clauses with operator, or returns empty if there are none."""
+  if not clauses:
+    return empty
+  if len(clauses) == 1:
+    return clauses[0]
+  return '(%s)' % (' %s ' % operator).join(clauses)
@@ -0,0 +1,806 @@
+"""Module containing file handling shared by the todo and cheat sheet storage.
+
+List files are never rewritten in place. A new version is written to a
+temporary file in the same directory and renamed over the old one, so a crash
+leaves either the old or the new version, never a mix of both. Between such
+rewrites, changes are appended to a journal next to the list file (see
+sjb.common.journal).
+"""
+import abc
+import hashlib
+import os
+import tempfile
+import time
+import sjb.common.archive
+import sjb.common.base
+import sjb.common.codec
+import sjb.common.config
+import sjb.common.journal
+import sjb.common.offsets
+import sjb.common.query
+import sjb.common.snapshot
+
+_SUITE = 'sjb'
+_LIST_FILE_EXTENSION = '.json'
+_BACKUP_EXTENSION = '.backup'
+_CHECKSUM_EXTENSION = '.sha256'
+_JOURNAL_EXTENSION = '.journal'
+_SNAPSHOT_EXTENSION = '.snapshot'
+_OFFSETS_EXTENSION = '.offsets'
+
+# How hard save operations try to make a new version survive a power loss.
+# With DURABILITY_NONE the data may still sit in the OS cache. DURABILITY_FILE
+# syncs the file contents before the rename. DURABILITY_DIR also syncs the
+# directory, so that the rename itself is on disk.
+DURABILITY_NONE = 'none'
+DURABILITY_FILE = 'file'
+DURABILITY_DIR = 'dir'
+DURABILITY_CHOICES = [DURABILITY_NONE, DURABILITY_FILE, DURABILITY_DIR]
+DURABILITY_DEFAULT = DURABILITY_FILE
+
+# Environment variable overriding the default durability.
+ENV_DURABILITY = 'SJB_DURABILITY'
+
+# Items are moved to the archive of their list once their archive date is
+# this many days old. 0 turns archiving off.
+ARCHIVE_DAYS_DEFAULT = 90
+
+# Environment variable overriding the default number of archive days.
+ENV_ARCHIVE_DAYS = 'SJB_ARCHIVE_DAYS'
+
+# Backends a list can be stored in. New lists use the default backend, while
+# existing lists are opened in the backend that holds them.
+BACKEND_JSON = 'json'
+BACKEND_SQLITE = 'sqlite'
+BACKEND_BINARY = 'binary'
+BACKEND_CHOICES = [BACKEND_JSON, BACKEND_SQLITE, BACKEND_BINARY]
+BACKEND_DEFAULT = BACKEND_JSON
+
+# Environment variable overriding the default backend.
+ENV_BACKEND = 'SJB_BACKEND'
+
+
+class NoListFileError(Exception):
+  """Raised when user tries to load a non-existent list."""
+  pass
+
+class IOError(Exception):
+  """Raised on generic problem with writing things to/from OS."""
+  pass
+
+
+class ListStorage(abc.ABC):
+  """Base class of the objects reading and writing the list files of an app.
+
+  Subclasses set _APP and _DEFAULT_LIST_FILE and implement _list_from_dict.
+
+  Lists with an _ARCHIVE_FIELD keep the items whose date in that field is
+  older than the archive threshold in an archive next to the list file, so
+  that loading the list does not read them (see sjb.common.archive). Commands
+  that need the whole history load the list with history=True, and commands
+  given the oid of an archived item bring it back with restore_archived.
+  """
+
+  # Name of the backend, one of BACKEND_CHOICES.
+  BACKEND = BACKEND_JSON
+  # Extension of the list files.
+  _EXTENSION = _LIST_FILE_EXTENSION
+  # Name of the app, which is also the name of its data directory.
+  _APP = None
+  # Short name of the list file used when none is given.
+  _DEFAULT_LIST_FILE = None
+  # Keys of the list and of its items in the dict of a JSON list file.
+  _ROOT_KEY = None
+  _ITEMS_KEY = None
+  # Date field by which items are archived, or None if they never are.
+  _ARCHIVE_FIELD = None
+  # Whether an offset index is written next to the list file, so that
+  # load_items can read single items.
+  _OFFSET_INDEX = False
+  # Whether parsed list files are cached as snapshots (see
+  # sjb.common.snapshot).
+  _SNAPSHOT = True
+
+  def __init__(
+      self, listname=None, durability=None, style=None, codec=None,
+      archive_days=None):
+    """Initializes a Storage object.
+
+    Args:
+      listname (str): Short name of the list file, or None for the default.
+      durability (str): One of DURABILITY_CHOICES, or None to use the default
+        (see get_durability).
+      style (str): One of sjb.common.codec.STYLE_CHOICES, or None to use the
+        default (see sjb.common.codec.get_style).
+      codec (str): Name of the JSON codec, or None for the configured or
+        fastest one (see sjb.common.codec.get_codec).
+      archive_days (int): Age in days after which items are archived, or
+        None to use the default (see get_archive_days).
+    """
+    self._listname = listname or self._DEFAULT_LIST_FILE
+    self._durability = get_durability(durability)
+    self._style = sjb.common.codec.get_style(style)
+    self._codec = sjb.common.codec.get_codec(codec)
+    # Records the changes to the list last loaded, to append to the journal.
+    self._recorder = None
+    self._journal_records = 0
+    self._journal_size = 0
+    self._archive_days = get_archive_days(archive_days)
+    self._archive = None
+    # Oids of the items restored from the archive since the last save.
+    self._restored_oids = []
+    # The list last loaded with its history, which cannot be saved.
+    self._history_list = None
+    # The list last loaded by load_items, which is only ever journaled.
+    self._partial_list = None
+
+  @abc.abstractmethod
+  def _list_from_dict(self, json_dict, lazy):
+    """Builds the ItemList of this app from the dict of a list file."""
+    return
+
+  def _dumps(self, item_list, exclude=()):
+    """Returns the contents of the list file for item_list, without the items
+    whose oids are in exclude, as bytes or as an iterable of chunks of
+    bytes."""
+    return self._codec.encode(
+      self._list_dict(item_list, exclude), style=self._style)
+
+  def _list_dict(self, item_list, exclude=()):
+    """Returns item_list.to_dict() without the items whose oids are in
+    exclude."""
+    json_dict = item_list.to_dict()
+    if exclude:
+      lst = json_dict[self._ROOT_KEY]
+      lst[self._ITEMS_KEY] = [
+        record for record in lst[self._ITEMS_KEY]
+        if record['oid'] not in exclude]
+    return json_dict
+
+  def _read(self, fname):
+    """Returns the contents of the list file fname."""
+    with open(fname, 'rb') as f:
+      return f.read()
+
+  def _loads(self, data):
+    """Returns the dict of a list, as written to a JSON list file, from the
+    contents of a list file."""
+    return self._codec.decode(data)
+
+  def _get_list_file(self):
+    return os.path.join(
+      sjb.common.config.get_user_app_data_dir(self._APP, suite_name=_SUITE),
+      '%s%s' % (self._listname, self._EXTENSION))
+
+  def _get_journal_file(self):
+    return self._get_list_file() + _JOURNAL_EXTENSION
+
+  def _get_offsets_file(self):
+    return self._get_list_file() + _OFFSETS_EXTENSION
+
+  def _get_snapshot_file(self):
+    return os.path.join(
+      sjb.common.config.get_user_app_cache_dir(self._APP, suite_name=_SUITE),
+      '%s%s%s' % (self._listname, self._EXTENSION, _SNAPSHOT_EXTENSION))
+
+  def _get_archive(self):
+    if self._archive is None:
+      self._archive = sjb.common.archive.Archive(
+        self._get_list_file(), self._ARCHIVE_FIELD,
+        durability=self._durability)
+    return self._archive
+
+  def get_list_name(self):
+    """Returns the short name of the list for this storage object."""
+    return self._listname
+
+  def exists(self):
+    """Returns True if the list of this storage object exists."""
+    return os.path.isfile(self._get_list_file())
+
+  @classmethod
+  def get_all_list_files(cls):
+    """Returns a list of all the available list files in the data directory."""
+    d = sjb.common.config.get_user_app_data_dir(cls._APP, suite_name=_SUITE)
+    files = os.listdir(d)
+    matching = []
+    for f in files:
+      if not os.path.isfile(os.path.join(d, f)):
+        continue
+      # check that it has correct extension.
+      if not f.endswith(cls._EXTENSION):
+        continue
+      matching.append(f[0:(len(f)-len(cls._EXTENSION))])
+    return matching
+
+  def save_list(self, item_list):
+    """Saves the list to the file pointed at by this object.
+
+    If item_list was loaded or last saved by this object, only its changes
+    since are appended to the journal of the list file. The whole list is
+    written, and the journal folded into it, when the journal grows too large
+    or when item_list did not come from this object. When the whole list is
+    written, its old items are moved to the archive and left out of the list
+    file. item_list itself keeps them.
+
+    Raises:
+      sjb.common.base.ValidationError: If some element of the list is invalid.
+      sjb.common.base.IllegalStateError: If item_list was loaded with its
+        history.
+    """
+    if item_list is self._history_list:
+      raise sjb.common.base.IllegalStateError(
+        'ListStorage.save_list', 'cannot save a list loaded with its history')
+    if item_list is self._partial_list:
+      archived = self._write_partial_list(item_list)
+    else:
+      archived = self._write_list(item_list)
+
+    # The restored items are now in the list file, so drop them from the
+    # archive. Those that the write archived again must stay there.
+    archived = set(archived)
+    restored = [oid for oid in self._restored_oids if oid not in archived]
+    if restored:
+      self._get_archive().remove(restored, item_list.modified_date)
+    self._restored_oids = []
+
+  def _write_list(self, item_list):
+    """Saves item_list, journaling it if possible.
+
+    Returns:
+      list(int): The oids of the items archived by the write.
+    """
+    fname = self._get_list_file()
+
+    # create parent directory as needed
+    if not os.path.isdir(os.path.dirname(fname)):
+      os.makedirs(os.path.dirname(fname))
+
+    # Items loaded from the file were validated then, so only the items added
+    # or changed since need to be checked. Items changed directly are only
+    # seen by the recorder once their changes are applied.
+    item_list.apply_direct_changes()
+    item_list.validate_dirty()
+
+    recorder = self._recorder
+    if (recorder is not None and recorder.item_list is item_list and
+        os.path.isfile(fname)):
+      if not recorder.has_changes() or not self._append_journal():
+        return []
+    archived = self._rewrite_list(item_list)
+    if recorder is None or recorder.item_list is not item_list:
+      # The file now holds item_list, so journal its changes from now on.
+      if recorder is not None:
+        recorder.close()
+      self._recorder = sjb.common.journal.Recorder(item_list)
+      self._partial_list = None
+    return archived
+
+  def _write_partial_list(self, item_list):
+    """Saves a list loaded by load_items, which lacks most items and so can
+    only be journaled. Compaction reloads the whole list.
+
+    Returns:
+      list(int): The oids of the items archived by the write.
+    """
+    item_list.apply_direct_changes()
+    item_list.validate_dirty()
+    if not self._recorder.has_changes() or not self._append_journal():
+      return []
+    archived = self._rewrite_list(self.load_list(lazy=True))
+    # Keep journaling the changes to item_list.
+    self._recorder.close()
+    self._recorder = sjb.common.journal.Recorder(item_list)
+    self._partial_list = item_list
+    return archived
+
+  def _append_journal(self):
+    """Appends the recorded changes to the journal.
+
+    Returns:
+      bool: True if the journal is now due for compaction.
+    """
+    records = self._recorder.records()
+    # Changes to items that are archived, e.g. ones that a save of the list
+    # archived but that it still holds, bring them back to the list.
+    archived = self.archived_oids()
+    if archived:
+      self._restored_oids.extend(
+        oid for oid in (
+          record.get('oid', record.get('item', {}).get('oid'))
+          for record in records)
+        if oid in archived)
+    self._journal_size = sjb.common.journal.append(
+      self._get_journal_file(), records, durability=self._durability,
+      committed_size=self._journal_size)
+    self._journal_records += len(records)
+    self._recorder.clear()
+    return sjb.common.journal.needs_compaction(
+      self._journal_records, self._journal_size,
+      os.path.getsize(self._get_list_file()))
+
+  def _rewrite_list(self, item_list):
+    """Writes the whole list file, folding the journal into it.
+
+    Returns:
+      list(int): The oids of the items archived before writing.
+    """
+    fname = self._get_list_file()
+    recorder = self._recorder
+    archived = self.archive_items(item_list)
+    excluded = set(archived)
+
+    # The previous version is kept as the backup file by the rename. The
+    # checksum is computed from the chunks as they are written.
+    checksum = hashlib.sha256()
+    atomic_write(
+      fname, self._dumps(item_list, excluded), durability=self._durability,
+      backup_extension=_BACKUP_EXTENSION, checksum=checksum)
+    write_checksum(
+      fname, checksum, _CHECKSUM_EXTENSION, durability=self._durability)
+    if self._OFFSET_INDEX:
+      self._write_offsets(item_list, excluded)
+    # Only drop the journal once the list file holds its changes.
+    sjb.common.journal.remove(self._get_journal_file())
+    self._journal_records = self._journal_size = 0
+    if recorder is not None:
+      recorder.clear()
+    return archived
+
+  def load_list(self, lazy=False, trusted=False, history=False):
+    """Loads the list, replaying its journal.
+
+    The name of the list is specified at initialization time.
+
+    Args:
+      lazy (bool): If True, items are only built and validated when they are
+        first accessed. Use this when only a few items will be looked at.
+      trusted (bool): If True, validation is skipped if the file is unchanged
+        since this program last saved it, as shown by its stored checksum.
+      history (bool): If True, the archived items are added after the items
+        of the list. Such a list cannot be saved.
+
+    Returns:
+      ItemList: object with contents given by the loaded file.
+
+    Raises:
+      ValidationError: If some element of the list is invalid.
+      NoListFileError: If the file does not exist.
+      IOError: If a file-like object exists but is wrong type (i.e. a dir).
+    """
+    fname = self._get_list_file()
+
+    if not os.path.isfile(fname):
+      if os.path.exists(fname):
+        raise IOError('list file exists but is of wrong filetype')
+      raise NoListFileError()
+
+    data = self._read(fname)
+    # The parsed file is cached as a snapshot (see sjb.common.snapshot). The
+    # digest of data is only computed when it is needed.
+    digest = None
+    snapshot = self._SNAPSHOT and len(data) >= sjb.common.snapshot.MIN_SIZE
+    lst = None
+    if snapshot:
+      digest = hashlib.sha256(data)
+      key = sjb.common.snapshot.make_key(fname, digest)
+      lst = sjb.common.snapshot.load(self._get_snapshot_file(), key)
+    if lst is None:
+      lst = self._list_from_dict(self._loads(data), lazy)
+      if snapshot:
+        sjb.common.snapshot.save(self._get_snapshot_file(), key, lst)
+
+    # Journaled items are kept as raw records, which are validated when built.
+    records, self._journal_size = sjb.common.journal.read(
+      self._get_journal_file())
+    sjb.common.journal.replay(lst, records)
+    self._journal_records = len(records)
+
+    if self._ARCHIVE_FIELD is not None:
+      archived = self.archived_oids()
+      if archived:
+        # New items must not reuse the oids of archived ones.
+        lst._reserve_oids(max(archived))
+    if history:
+      self._add_history(lst)
+      self._history_list = lst
+
+    if trusted and checksum_matches(
+        fname, data if digest is None else digest, _CHECKSUM_EXTENSION):
+      lst.mark_valid()
+    elif not lazy:
+      lst.validate()
+
+    if self._recorder is not None:
+      self._recorder.close()
+    self._recorder = sjb.common.journal.Recorder(lst)
+    self._partial_list = None
+    return lst
+
+  def load_items(self, oid_ranges):
+    """Loads only the items whose oids lie in oid_ranges, e.g. for a command
+    changing a few items given by id.
+
+    Their records are read straight from the list file through its offset
+    index, and the journal records of the requested oids are replayed on top
+    of them, which also brings in requested items added since the list file
+    was written. Without an up to date offset index, this loads the whole
+    list lazily instead.
+
+    The returned list lacks the other items, so its counts and tag set only
+    cover the loaded items. It is saved like a list returned by load_list.
+
+    Args:
+      oid_ranges: iterable of range objects of oids.
+
+    Returns:
+      ItemList: object holding the items that exist.
+
+    Raises:
+      NoListFileError: If the file does not exist.
+      IOError: If a file-like object exists but is wrong type (i.e. a dir).
+    """
+    fname = self._get_list_file()
+    index = None
+    if self._OFFSET_INDEX:
+      index = sjb.common.offsets.OffsetIndex.open(
+        self._get_offsets_file(), fname)
+    if index is None:
+      return self.load_list(lazy=True)
+
+    oid_ranges = list(oid_ranges)
+    records = []
+    with open(fname, 'rb') as f:
+      for oid, offset, length in index.select(oid_ranges):
+        f.seek(offset)
+        try:
+          record = self._loads(f.read(length))
+        except ValueError:
+          record = None
+        if not isinstance(record, dict) or record.get('oid') != oid:
+          # The file no longer matches its index after all.
+          return self.load_list(lazy=True)
+        records.append(record)
+    lst = self._list_from_dict(
+      {self._ROOT_KEY: dict(index.meta, **{self._ITEMS_KEY: records})}, True)
+
+    # Only replay the journal records of the requested oids.
+    journal, self._journal_size = sjb.common.journal.read(
+      self._get_journal_file())
+    self._journal_records = len(journal)
+    sjb.common.journal.replay(lst, [
+      record for record in journal
+      if record['op'] == sjb.common.journal.OP_COMMIT or any(
+        record.get('oid', record.get('item', {}).get('oid')) in r
+        for r in oid_ranges)])
+    # New items must not reuse the oids of the items that were not loaded.
+    lst._reserve_oids(max(
+      [index.max_oid()] + list(self.archived_oids()) + [
+        record['item']['oid'] for record in journal
+        if record['op'] == sjb.common.journal.OP_PUT]))
+
+    if self._recorder is not None:
+      self._recorder.close()
+    self._recorder = sjb.common.journal.Recorder(lst)
+    self._partial_list = lst
+    return lst
+
+  def query_items(
+      self, item_matcher=None, sort_field=None, limit=None, offset=0,
+      history=False):
+    """Returns the items of the list matching item_matcher.
+
+    Args:
+      item_matcher: If not None, only items matching it are returned.
+      sort_field (str): If not None, the items are ordered by this field as
+        by TodoList.sorted_items. Otherwise they are in list order.
+      limit (int): If not None, at most this many items are returned.
+      offset (int): Number of matching items to skip first.
+      history (bool): If True, archived items are included. Only the
+        segments of the archive that can hold a match are read.
+
+    Returns:
+      iterable(Item): The matching items.
+    """
+    lst = self.load_list(lazy=True)
+    if history:
+      self._add_history(lst, item_matcher)
+    if sort_field is None:
+      return lst.iter_items(item_matcher, limit=limit, offset=offset)
+    end = None if limit is None else offset + limit
+    items = lst.sorted_items(sort_field, item_matcher=item_matcher, limit=end)
+    return items[offset:]
+
+  def export_dict(self):
+    """Returns the list, with its archived items, as the dict written to a
+    JSON list file."""
+    return self.load_list(history=True).to_dict()
+
+  def import_dict(self, json_dict):
+    """Replaces the list with the one in json_dict, a dict as read from a
+    JSON list file.
+
+    Returns:
+      ItemList: The imported list.
+
+    Raises:
+      sjb.common.base.ValidationError: If some element of the list is invalid.
+    """
+    lst = self._list_from_dict(json_dict, False)
+    lst.validate()
+    # The imported list replaces the archive as well.
+    if self._ARCHIVE_FIELD is not None:
+      self._get_archive().clear()
+    self.save_list(lst)
+    return lst
+
+  def archived_oids(self):
+    """Returns the set of oids of the archived items, from the index of the
+    archive. The set must not be modified."""
+    if self._ARCHIVE_FIELD is None:
+      return set()
+    return self._get_archive().oids()
+
+  def select_archived(self, oid_ranges):
+    """Returns the sorted list of the oids of the archived items that are in
+    any of oid_ranges, range objects of oids."""
+    if self._ARCHIVE_FIELD is None:
+      return []
+    return self._get_archive().select(oid_ranges)
+
+  def archive_items(self, item_list, before=None):
+    """Copies the old items of item_list to the archive.
+
+    Each item goes to the segment of the month of its _ARCHIVE_FIELD.
+    item_list is not changed: the save that called this leaves the items out
+    of the list file it writes next. As the archive is written first, an
+    interrupted save may leave an item in both the list and the archive, but
+    never in neither.
+
+    Args:
+      item_list (ItemList): A list loaded by this object.
+      before (float): Items whose _ARCHIVE_FIELD is before this timestamp are
+        archived. If None, this is the archive threshold before now.
+
+    Returns:
+      list(int): The oids of the archived items.
+    """
+    if self._ARCHIVE_FIELD is None:
+      return []
+    if before is None:
+      if not self._archive_days:
+        return []
+      before = time.time() - self._archive_days * 24 * 60 * 60
+    oids = sorted(
+      item_list.lookup_range(self._ARCHIVE_FIELD, None, before) or ())
+    if not oids:
+      return []
+
+    self._get_archive().add(
+      [item_list.get_item(oid)._to_dict() for oid in oids],
+      item_list.modified_date)
+    return oids
+
+  def restore_archived(self, item_list, oids):
+    """Moves archived items back into item_list, e.g. so that a command can
+    change them. The archive drops them once item_list is saved.
+
+    Args:
+      item_list (ItemList): A list loaded by this object.
+      oids: The oids to restore. Oids of items that are in item_list or that
+        are not archived are ignored.
+
+    Returns:
+      list(int): The oids of the restored items.
+    """
+    archived = self.archived_oids()
+    wanted = [
+      oid for oid in dict.fromkeys(oids)
+      if oid in archived and not item_list.has_item(oid)]
+    if not wanted:
+      return []
+    records = {
+      record['oid']: record
+      for record in self._get_archive().records(oids=wanted)}
+    items = [
+      item_list._item_from_record(records[oid])
+      for oid in wanted if oid in records]
+    item_list.add_items(items, initial_load=True)
+    self._restored_oids.extend(item.oid for item in items)
+    return [item.oid for item in items]
+
+  def _write_offsets(self, item_list, exclude=()):
+    """Writes the offset index of the list file just written for item_list,
+    without the items whose oids are in exclude."""
+    fname = self._get_list_file()
+    with open(fname, 'rb') as f:
+      entries = sjb.common.offsets.scan(f.read())
+    oids = item_list.all_oids().difference(exclude)
+    if entries is None or len(entries) != len(oids) or {
+        entry[0] for entry in entries} != oids:
+      # Not laid out as expected, so load_items will load the whole list.
+      sjb.common.journal.remove(self._get_offsets_file())
+      return
+    sjb.common.offsets.write(
+      self._get_offsets_file(), fname, entries,
+      {'version': item_list.version, 'modified_date': item_list.modified_date})
+
+  def _add_history(self, item_list, item_matcher=None):
+    """Adds the archived items to item_list as raw records, skipping the
+    segments of the archive in which no item can match item_matcher."""
+    query = item_matcher
+    if query is not None and not isinstance(query, sjb.common.query.Matcher):
+      query = query.to_query() if hasattr(query, 'to_query') else None
+    for record in self._get_archive().records(query=query):
+      # An item that is also in the list was restored from the archive.
+      if not item_list.has_item(record['oid']):
+        item_list._add_record(record)
+
+
+def get_storage(
+    storage_classes, listname=None, backend=None, durability=None):
+  """Returns the storage object for a list, in the backend holding it.
+
+  Args:
+    storage_classes: The ListStorage subclasses of the app, one per backend.
+    listname (str): Short name of the list, or None for the default.
+    backend (str): One of BACKEND_CHOICES, or None to use the backend of the
+      existing list, or else the default (see ENV_BACKEND).
+    durability (str): One of DURABILITY_CHOICES, or None for the default.
+
+  Raises:
+    ValueError: If the backend is not one of BACKEND_CHOICES.
+  """
+  if backend is None:
+    for cls in storage_classes:
+      storage = cls(listname=listname, durability=durability)
+      if storage.exists():
+        return storage
+    backend = os.environ.get(ENV_BACKEND, BACKEND_DEFAULT)
+  for cls in storage_classes:
+    if cls.BACKEND == backend:
+      return cls(listname=listname, durability=durability)
+  raise ValueError('unknown backend: "%s"' % backend)
+
+
+def get_all_list_names(storage_classes):
+  """Returns the short names of the lists stored in any of the backends."""
+  names = set()
+  for cls in storage_classes:
+    names.update(cls.get_all_list_files())
+  return sorted(names)
+
+
+def get_archive_days(archive_days=None):
+  """Returns archive_days, or the configured default if it is None.
+
+  Raises:
+    ValueError: If the number of days is not a non negative integer.
+  """
+  if archive_days is None:
+    archive_days = os.environ.get(ENV_ARCHIVE_DAYS, ARCHIVE_DAYS_DEFAULT)
+  try:
+    days = int(archive_days)
+  except ValueError:
+    days = -1
+  if days < 0:
+    raise ValueError('bad number of archive days: "%s"' % archive_days)
+  return days
+
+
+def get_durability(durability=None):
+  """Returns durability, or the configured default if it is None.
+
+  Raises:
+    ValueError: If the durability is not one of DURABILITY_CHOICES.
+  """
+  if durability is None:
+    durability = os.environ.get(ENV_DURABILITY, DURABILITY_DEFAULT)
+  if durability not in DURABILITY_CHOICES:
+    raise ValueError('unknown durability: "%s"' % durability)
+  return durability
+
+
+def atomic_write(
+    fname, data, durability=None, backup_extension=None, checksum=None):
+  """Replaces the contents of fname with data in a single rename.
+
+  Args:
+    fname (str): The file to write.
+    data: The new contents of the file, as str (written as UTF-8) or bytes,
+      or an iterable of such chunks, which are written one at a time.
+    durability (str): One of DURABILITY_CHOICES, or None for the default.
+    backup_extension (str): If not None, the previous version of fname is
+      kept as fname plus this extension. It is hard linked (or renamed, where
+      links are not supported) rather than copied.
+    checksum: If not None, a hashlib object updated with the written bytes.
+  """
+  durability = get_durability(durability)
+  if isinstance(data, (str, bytes)):
+    data = [data]
+  dirname = os.path.dirname(fname) or '.'
+  fd, tmp_name = tempfile.mkstemp(
+    prefix='.%s.' % os.path.basename(fname), suffix='.tmp', dir=dirname)
+  try:
+    with os.fdopen(fd, 'wb') as f:
+      for chunk in data:
+        if isinstance(chunk, str):
+          chunk = chunk.encode('utf-8')
+        f.write(chunk)
+        if checksum is not None:
+          checksum.update(chunk)
+      if durability != DURABILITY_NONE:
+        f.flush()
+        os.fsync(f.fileno())
+    _copy_mode(fname, tmp_name)
+    if backup_extension is not None and os.path.isfile(fname):
+      _keep_backup(fname, fname + backup_extension)
+    os.replace(tmp_name, fname)
+  except BaseException:
+    if os.path.exists(tmp_name):
+      os.remove(tmp_name)
+    raise
+
+  if durability == DURABILITY_DIR:
+    sync_directory(dirname)
+
+
+def sync_directory(dirname):
+  """Flushes the entries of directory dirname (e.g. renames) to disk."""
+  fd = os.open(dirname, os.O_RDONLY)
+  try:
+    os.fsync(fd)
+  finally:
+    os.close(fd)
+
+
+def _copy_mode(fname, tmp_name):
+  """Gives tmp_name the permissions of fname, or the default ones."""
+  try:
+    mode = os.stat(fname).st_mode & 0o777
+  except FileNotFoundError:
+    # mkstemp creates private files; use what open would have used.
+    umask = os.umask(0)
+    os.umask(umask)
+    mode = 0o666 & ~umask
+  os.chmod(tmp_name, mode)
+
+
+def _keep_backup(fname, backup_name):
+  """Makes backup_name refer to the current contents of fname."""
+  if os.path.lexists(backup_name):
+    os.remove(backup_name)
+  try:
+    os.link(fname, backup_name)
+  except OSError:
+    # No hard links here. fname is replaced right after, so move it instead.
+    os.replace(fname, backup_name)
+
+
+def _checksum(data):
+  if hasattr(data, 'hexdigest'):
+    return data.hexdigest()
+  if isinstance(data, str):
+    data = data.encode('utf-8')
+  return hashlib.sha256(data).hexdigest()
+
+
+def write_checksum(fname, data, extension, durability=None):
+  """Stores the checksum of data, just written to fname, next to it. data
+  may also be a hashlib sha256 object that was fed the written bytes."""
+  atomic_write(fname + extension, _checksum(data), durability=durability)
+
+
+def checksum_matches(fname, data, extension):
+  """Returns True if data, just read from fname, matches its stored checksum.
+  data may also be a hashlib sha256 object that was fed the read bytes.
+
+  This is False if no checksum was stored, e.g. because the file was edited
+  by hand or the program stopped between writing the file and the checksum.
+  """
+  try:
+    with open(fname + extension, 'r') as f:
+      stored = f.read().strip()
+  except OSError:
+    return False
+  return stored == _checksum(data)
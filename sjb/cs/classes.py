@@ -1,6 +1,8 @@
 """Module containing all core class definitions for this program."""
-import copy
+import sys
 import sjb.common.base
+import sjb.common.columns
+import sjb.common.query
 
 
 ## Global constants which determine search method.
@@ -43,17 +45,38 @@ class EntryMatcherTags(sjb.common.base.ItemMatcher):
           return True
       return False
 
+  def plan(self, item_list):
+    """Plans the tag conditions of this matcher against the tag index."""
+    return self.to_query().plan(item_list)
+
+  def signature(self):
+    return self.to_query().signature()
+
+  def to_query(self):
+    """Returns the sjb.common.query.Matcher equivalent to this matcher."""
+    if not self.tags:
+      return sjb.common.query.All()
+    parts = [
+      sjb.common.query.Tag(tag, fields=('tags', 'primary'))
+      for tag in self.tags]
+    if self._andor is SEARCH_AND:
+      return sjb.common.query.And(*parts)
+    return sjb.common.query.Or(*parts)
+
 
 class Entry(sjb.common.base.Item):
   """Class representing an entry in a cheat sheet"""
 
+  _FIELDS = ('clue', 'answer', 'primary', 'tags')
+  __slots__ = _FIELDS
+
   def __init__(self, clue, answer, primary, tags, oid=None):
     super().__init__(oid)
     # Values that should be set at construction time
     self.clue = clue
     self.answer = answer
-    self.primary = primary
-    self.tags = set(tags) if tags is not None else set()
+    self.primary = sys.intern(primary) if type(primary) is str else primary
+    self.tags = sjb.common.base.intern_tags(tags or ())
 
   def __eq__(self, other):
     """Returns true if self and other have identical fields."""
@@ -120,7 +143,7 @@ class Entry(sjb.common.base.Item):
       clue=json_dict['clue'],
       answer=json_dict['answer'],
       primary=json_dict['primary'],
-      tags=set(json_dict['tags']),
+      tags=json_dict['tags'],
       oid=json_dict['oid'])
     return e
 
@@ -132,12 +155,22 @@ class CheatSheet(sjb.common.base.ItemList):
   full entries.
   """
 
+  # Primary keys are counted in the tag index along with the tags.
+  TAG_FIELDS = ('tags', 'primary')
+
+  RECORD_COLUMNS = (
+    ('oid', sjb.common.columns.INT),
+    ('primary', sjb.common.columns.STRING),
+    ('tags', sjb.common.columns.TAGS),
+    ('clue', sjb.common.columns.STRING),
+    ('answer', sjb.common.columns.STRING))
+
   def __init__(self, version=None, modified_date=None):
     super().__init__(version=version, modified_date=modified_date)
 
-    # Maps holding cheat sheet meta data.
+    # Maps each primary key to the set of oids of the entries using it.
+    # Primary keys and tags are also counted in the tag index of ItemList.
     self._primary_map = {}
-    self._tag_set = set()
 
   @property
   def primary_set(self):
@@ -146,13 +179,15 @@ class CheatSheet(sjb.common.base.ItemList):
 
   @property
   def tag_set(self):
-    """set(str): TODO: Make immutable TODO: Set of tags in this CheatSheet."""
-    return self._tag_set
+    """set(str): Set of tags (including primary keys) in this CheatSheet."""
+    return set(self._tag_index)
 
   @property
   def primary_map(self):
-    """TODO: Dict mapping primary tags to lists of entries."""
-    return self._primary_map
+    """dict: Maps primary keys to lists of entries, in list order."""
+    return {
+      primary: self._get_items_by_oids(oids)
+      for primary, oids in self._primary_map.items()}
 
   def add_item(self, item, initial_load=False):
     """Adds an entry to this cheatsheet.
@@ -173,9 +208,27 @@ class CheatSheet(sjb.common.base.ItemList):
         does not have the 'oid' field set.
     """
     super().add_item(item, initial_load=initial_load)
-    self._update_object_maps(item)
+    self._item_added(item)
     return item
 
+  def add_items(self, items, initial_load=False):
+    """Adds several entries to this cheatsheet at once.
+
+    All entries are checked before any is added, and the cheat sheet is marked
+    modified only once.
+
+    Returns:
+      list(Entry): the newly added Entry objects.
+
+    Raises:
+      sjb.common.base.IllegalStateError: For the same reasons as add_item.
+    """
+    items = list(items)
+    super().add_items(items, initial_load=initial_load)
+    for item in items:
+      self._item_added(item)
+    return items
+
   def remove_item(self, oid):
     """Removes the entry with the specified oid and updates meta data.
 
@@ -186,7 +239,22 @@ class CheatSheet(sjb.common.base.ItemList):
       sjb.common.base.InvalidIDError: If no item has a matching oid.
     """
     removed = super().remove_item(oid)
-    self._recompute_object_maps()
+    self._item_removed(removed)
+    return removed
+
+  def remove_items(self, oids):
+    """Removes the entries with the specified oids and updates meta data.
+
+    Returns:
+      list(Entry): The removed entry objects, in the order of oids.
+
+    Raises:
+      sjb.common.base.InvalidIDError: If some oid has no matching entry. In
+        that case no entry is removed.
+    """
+    removed = super().remove_items(oids)
+    for item in removed:
+      self._item_removed(item)
     return removed
 
   def update_item(self, oid, clue=None, answer=None, primary=None, tags=None):
@@ -202,42 +270,79 @@ class CheatSheet(sjb.common.base.ItemList):
     Raises:
       sjb.common.base.InvalidIDError: If no item has a matching oid.
     """
-    item = self.get_item(oid)
-    original_item = copy.deepcopy(item)
+    return self.update_items(
+      [oid], clue=clue, answer=answer, primary=primary, tags=tags)[0]
 
-    item.primary = primary if primary is not None else item.primary
-    item.clue = clue if clue is not None else item.clue
-    item.answer = answer if answer is not None else item.answer
-    item.tags = set(tags) if tags is not None else item.tags
+  def update_items(
+      self, oids, clue=None, answer=None, primary=None, tags=None):
+    """Updates all entries given by oids with the same new values.
 
-    # Mark as modified only if the object is changed.
-    if original_item != item:
-      self._mark_modified()
-      self._recompute_object_maps()
+    Only arguments that are not None will be updated. All oids are checked
+    before any entry is changed, and the list is marked modified at most once.
 
-    return item
+    Returns:
+      list(Entry): The updated entry objects, in the order of oids.
+
+    Raises:
+      sjb.common.base.InvalidIDError: If some oid has no matching entry.
+    """
+    items = [self.get_item(oid) for oid in self._check_oids(oids)]
+    if primary is not None:
+      primary = sys.intern(primary)
+    if tags is not None:
+      tags = sjb.common.base.intern_tags(tags)
+
+    changed = False
+    for item in items:
+      if primary is not None:
+        item.primary = primary
+      if clue is not None:
+        item.clue = clue
+      if answer is not None:
+        item.answer = answer
+      if tags is not None:
+        item.tags = set(tags)
+      changed = self._apply_changes(item) or changed
+
+    # Mark as modified only if some object is changed.
+    if changed:
+      self._mark_modified()
+    return items
+
+  def _update_changed_maps(self, item, changes):
+    """Updates meta objects for the fields of item that changed."""
+    if 'primary' in changes or 'tags' in changes:
+      old_primary = changes.get('primary', item.primary)
+      old_tags = changes.get('tags', item.tags)
+      self._remove_from_object_maps(item, primary=old_primary, tags=old_tags)
+      self._update_object_maps(item)
 
   def _update_object_maps(self, item):
     """Updates meta objects to reflect the contents of item."""
-    if item.primary not in self._primary_map.keys():
-      self._primary_map[item.primary] = []
-    self._primary_map[item.primary].append(item)
+    oids = self._primary_map.get(item.primary)
+    if oids is None:
+      self._primary_map[item.primary] = oids = set()
+    oids.add(item.oid)
 
-    for tag in item.tags:
-      self._tag_set.add(tag)
-    self._tag_set.add(item.primary)
+    self._index_tags(item.oid, [*item.tags, item.primary])
 
-  def _recompute_object_maps(self):
-    """Recomputes all meta object maps like tag_set, primary_to_entries, etc.
+  def _remove_from_object_maps(self, item, primary=None, tags=None):
+    """Updates meta objects to no longer reflect the contents of item.
 
-    This should be used after making a non-trivial change to the list like
-    modifying an elements tags or removing an element.
+    Args:
+      item: The Entry object to remove from the meta objects.
+      primary: The primary key item was indexed under, if it has changed.
+      tags: The tags item was indexed under, if they have changed.
     """
-    self._primary_map = {}
-    self._tag_set = set()
+    primary = primary if primary is not None else item.primary
+    tags = tags if tags is not None else item.tags
 
-    for item in self._items:
-      self._update_object_maps(item)
+    oids = self._primary_map[primary]
+    oids.discard(item.oid)
+    if not oids:
+      del self._primary_map[primary]
+
+    self._unindex_tags(item.oid, [*tags, primary])
 
   def to_dict(self):
     """Converts data to a dict suitable for writing to a file as json.
@@ -249,16 +354,22 @@ class CheatSheet(sjb.common.base.ItemList):
       'cheatsheet': {
         'version': self.version,
         'modified_date': self.modified_date,
-        'entries': [e._to_dict() for e in self.items]
+        'entries': list(self._item_dicts())
       }
     }
 
+  def _item_from_record(self, record):
+    """Builds the Entry represented by a raw record of a lazy cheat sheet."""
+    return Entry.from_dict(record)
+
   @staticmethod
-  def from_dict(json_dict):
+  def from_dict(json_dict, lazy=False):
     """Constructs CheatSheet from dict (which was loaded from a JSON file).
 
     Args:
       json_dict: Dict containing the necessary fields for a CheatSheet.
+      lazy (bool): If True, entries are kept as raw records and only built
+        (and validated) when they are first accessed.
 
     Returns:
       CheatSheet: Object represented by the dict.
@@ -270,7 +381,9 @@ class CheatSheet(sjb.common.base.ItemList):
 
     # Add entries to cheat sheet
     for item_json in json_dict['entries']:
-      item = Entry.from_dict(item_json)
-      l.add_item(item, initial_load=True)
+      if lazy:
+        l._add_record(item_json)
+      else:
+        l.add_item(Entry.from_dict(item_json), initial_load=True)
 
     return l
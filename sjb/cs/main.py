@@ -1,6 +1,7 @@
 """Module responsible for implementing the command line front end."""
 import argparse
 import collections
+import itertools
 import operator
 import sys
 import sjb.constants
@@ -8,6 +9,7 @@ import sjb.cs.classes
 import sjb.cs.display
 import sjb.cs.storage
 import sjb.common.misc
+import sjb.common.storage
 
 PROGRAM = 'sjb-cheatsheet'
 DESCRIPTION = 'A simple CLI program to create, maintain and edit cheat sheets.'
@@ -16,6 +18,12 @@ CMDS = collections.OrderedDict([
   ('add', [
     'Add a new entry to the cheat sheet',
     'The "add" command adds a new cheat sheet entry to the cheat sheet list.']),
+  ('export', [
+    'Writes a cheat sheet to a JSON file',
+    'The "export" command writes a cheat sheet, whichever backend stores it, to a file in the JSON list format. The file can be read back with the "import" command.']),
+  ('import', [
+    'Replaces a cheat sheet with the contents of a JSON file',
+    'The "import" command replaces a cheat sheet with the contents of a file in the JSON list format, e.g. one written by the "export" command. This can be used to move a cheat sheet to another backend.']),
   ('info', [
     'Shows meta info about the cheat sheet',
     'The "info" command shows meta information about the cheat sheet list like which tags exist and how many entries have each tag.']),
@@ -95,6 +103,24 @@ class Program(object):
       'answer', type=str,
       help='the full explanation of this entry. Can be as long as required')
 
+  def export_set_args(self, cmds):
+    cmd = cmds.add_parser(
+      'export', help=CMDS['export'][0], description=CMDS['export'][1])
+    cmd.set_defaults(run=self.export)
+    _add_arg_list(cmd)
+    cmd.add_argument(
+      'file', type=str, help='the file to write, or - for standard output')
+
+  def import_set_args(self, cmds):
+    cmd = cmds.add_parser(
+      'import', help=CMDS['import'][0], description=CMDS['import'][1])
+    cmd.set_defaults(run=self.import_)
+    _add_arg_force(cmd, verb='replacing an existing cheat sheet', default=PROMPT)
+    _add_arg_backend(cmd)
+    _add_arg_list(cmd)
+    cmd.add_argument(
+      'file', type=str, help='the file to read, or - for standard input')
+
   def info_set_args(self, cmds):
     cmd = cmds.add_parser(
       'info', help=CMDS['info'][0], description=CMDS['info'][1])
@@ -110,7 +136,7 @@ class Program(object):
     cmd = cmds.add_parser(
       'remove', help=CMDS['remove'][0], description=CMDS['remove'][1])
     cmd.set_defaults(run=self.remove)
-    _add_arg_oid(cmd, help='ID of the item you wish to delete')
+    _add_arg_oids(cmd, help='IDs of the items you wish to delete')
     _add_arg_force(cmd, verb='removing the cheatsheet item', default=PROMPT)
     _add_arg_list(cmd)
     _add_arg_style(cmd)
@@ -134,6 +160,7 @@ class Program(object):
       const=sjb.cs.classes.SEARCH_AND,
       default=sjb.cs.classes.SEARCH_OR,
       help='only show entries which match ALL of the given conditions')
+    _add_arg_page(cmd, noun='entries')
     _add_arg_list(cmd)
     _add_arg_style(cmd)
 
@@ -141,7 +168,7 @@ class Program(object):
     cmd = cmds.add_parser(
       'update', help=CMDS['update'][0], description=CMDS['update'][1])
     cmd.set_defaults(run=self.update)
-    _add_arg_oid(cmd, help='ID of the item you wish to update')
+    _add_arg_oids(cmd, help='IDs of the items you wish to update')
     cmd.add_argument(
       '--tags', metavar='tags', type=_tags_arg,
       help='comma separated list of tags. The first tag is the "primary" tag')
@@ -156,13 +183,13 @@ class Program(object):
     _add_arg_style(cmd)
 
   def add(self, args):
-    s = sjb.cs.storage.Storage(listname=args.list)
+    s = sjb.cs.storage.get_storage(args.list)
 
     skip_tag_prompt = args.prompt == FORCE
 
     # if the list doesnt already exist, prompt user to create a new one
     try:
-      cs = s.load_list()
+      cs = s.load_list(trusted=True)
     except sjb.cs.storage.NoListFileError:
       cont = (args.prompt == FORCE) or sjb.common.misc.prompt_yes_no(
         'No cheatsheet list found with name "%s". Would you like to create a new list? ' % args.list, default=True)
@@ -192,9 +219,23 @@ class Program(object):
     # Print the results.
     sjb.cs.display.display_entry(entry, format_style=args.style)
 
+  def export(self, args):
+    s = sjb.cs.storage.get_storage(args.list)
+    sjb.common.misc.write_json_file(args.file, s.export_dict())
+
+  def import_(self, args):
+    s = sjb.cs.storage.get_storage(args.list, backend=args.backend)
+    if s.exists() and args.prompt is not FORCE:
+      cont = sjb.common.misc.prompt_yes_no(
+        'The cheat sheet "%s" already exists. Are you sure you want to replace it? ' % s.get_list_name(), default=False)
+      if not cont:
+        exit(0)
+    cs = s.import_dict(sjb.common.misc.read_json_file(args.file))
+    print('Imported %d entries' % cs.size())
+
   def info(self, args):
-    s = sjb.cs.storage.Storage(listname=args.list)
-    cs = s.load_list()
+    s = sjb.cs.storage.get_storage(args.list)
+    cs = s.load_list(trusted=True)
 
     primary_map = cs.primary_map
     tag_set = cs.tag_set
@@ -213,31 +254,32 @@ class Program(object):
       print('  %-25s %d' % (key, count))
 
   def lists(self, args):
-    lists = sjb.cs.storage.Storage.get_all_list_files()
+    lists = sjb.cs.storage.get_all_list_files()
     print('Cheatsheets: ' + ', '.join(lists))
 
   def remove(self, args):
-    s = sjb.cs.storage.Storage(listname=args.list)
-    cs = s.load_list()
+    s = sjb.cs.storage.get_storage(args.list)
+    cs = s.load_list(lazy=True)
 
     # If not in force mode, ask user before proceeding.
-    entry = cs.get_item(args.oid)
+    oids = _select_oids(cs, args)
     if args.prompt is not FORCE:
       question = (
-        'The entry given by oid '+str(args.oid)+' is:\n' + \
-        sjb.cs.display.entry_repr(entry, format_style=args.style) + \
-        '\nAre you sure you want to delete it? ')
+        _describe_entries(cs, oids, args.style) + \
+        '\nAre you sure you want to delete %s? ' % (
+          'it' if len(oids) == 1 else 'them'))
       cont = sjb.common.misc.prompt_yes_no(question, default=False)
       if not cont:
         exit(0)
 
-    removed = cs.remove_item(args.oid)
+    removed = cs.remove_items(oids)
     s.save_list(cs)
 
     # Print the results only on force mode (otherwise user just saw item).
     if args.prompt is not FORCE:
-      print('Removed entry:')
-      sjb.cs.display.display_entry(removed, format_style=args.style)
+      print('Removed entry:' if len(removed) == 1 else 'Removed entries:')
+      for entry in removed:
+        sjb.cs.display.display_entry(entry, format_style=args.style)
 
   def show(self, args):
     # Special handling. If no format style is given and the user gave some
@@ -246,40 +288,74 @@ class Program(object):
     if not args.style and args.tags:
       args.style = sjb.cs.display.FORMAT_STYLE_SIMPLE
 
-    s = sjb.cs.storage.Storage(listname=args.list)
-    cs = s.load_list()
+    s = sjb.cs.storage.get_storage(args.list)
     matcher = sjb.cs.classes.EntryMatcherTags(args.tags, args.andor)
-    entries = cs.query_items(matcher)
-    if entries:
-      sjb.cs.display.display_entries(entries, format_style=args.style)
+    entries = iter(s.query_items(
+      matcher, limit=args.limit, offset=args.offset))
+    first = next(entries, None)
+    if first is not None:
+      sjb.cs.display.display_entries(
+        itertools.chain([first], entries), format_style=args.style)
     else:
       print('No entries found')
 
   def update(self, args):
-    s = sjb.cs.storage.Storage(listname=args.list)
-    cs = s.load_list()
+    s = sjb.cs.storage.get_storage(args.list)
+    cs = s.load_list(lazy=True)
 
-    item = cs.get_item(args.oid)
+    oids = _select_oids(cs, args)
     if args.prompt is not FORCE:
       question = (
-        'The item given by oid '+str(args.oid)+' is:\n' + \
-        sjb.cs.display.entry_repr(item, format_style=args.style) + \
+        _describe_entries(cs, oids, args.style) + \
         '\nAre you sure you want to continue? ')
       cont = sjb.common.misc.prompt_yes_no(question, default=True)
       if not cont:
         exit(0)
 
-    updated = cs.update_item(
-      args.oid, clue=args.clue, answer=args.answer,
+    updated = cs.update_items(
+      oids, clue=args.clue, answer=args.answer,
       primary=args.tags[0] if args.tags else None,
       tags=args.tags[1] if args.tags else None)
     s.save_list(cs)
 
-    sjb.cs.display.display_entry(updated, format_style=args.style)
-
-
-def _add_arg_oid(parser, help='the ID of the target item'):
-  parser.add_argument('oid', metavar='id', type=int, help=help)
+    for entry in updated:
+      sjb.cs.display.display_entry(entry, format_style=args.style)
+
+
+def _select_oids(cs, args):
+  """Returns the oids of the entries selected by the id and filter arguments.
+
+  Exits the program if the arguments do not select any entry.
+  """
+  if not args.oids and not args.match_tags:
+    sys.stderr.write('Give at least one entry id or the --match-tags filter\n')
+    sys.exit(2)
+  matcher = None
+  if args.match_tags:
+    matcher = sjb.cs.classes.EntryMatcherTags(
+      args.match_tags, sjb.cs.classes.SEARCH_AND)
+  oids = cs.select_oids(args.oids, matcher)
+  if not oids:
+    print('No entries found')
+    exit(0)
+  return oids
+
+def _describe_entries(cs, oids, format_style):
+  """Returns a string showing the entries with the given oids to the user."""
+  if len(oids) == 1:
+    return 'The entry given by oid %d is:\n%s' % (
+      oids[0], sjb.cs.display.entry_repr(cs.get_item(oids[0]), format_style))
+  return 'The %d selected entries are:\n%s' % (len(oids), '\n'.join(
+    sjb.cs.display.entry_repr(cs.get_item(oid), format_style) for oid in oids))
+
+
+def _add_arg_oids(parser, help='the IDs of the target items'):
+  parser.add_argument(
+    'oids', metavar='id', nargs='*', type=sjb.common.misc.oid_range_arg,
+    help=help + '. A range of IDs can be given as 10-50')
+  parser.add_argument(
+    '--match-tags', dest='match_tags', metavar='tags', type=_set_arg,
+    help='also selects all entries with all of the given comma separated tags')
 
 def _add_arg_force(parser, verb, default=PROMPT):
   g = parser.add_mutually_exclusive_group()
@@ -300,6 +376,23 @@ def _add_arg_style(parser, default=None):
     choices=sjb.cs.display.FORMAT_CHOICES, default=default,
     help='Specifies which format style is used when displaying entries.')
 
+def _add_arg_page(parser, noun):
+  parser.add_argument(
+    '--limit', dest='limit', metavar='N',
+    type=sjb.common.misc.positive_int_arg, default=None,
+    help='only shows the first N ' + noun)
+  parser.add_argument(
+    '--offset', dest='offset', metavar='N',
+    type=sjb.common.misc.non_negative_int_arg, default=0,
+    help='skips the first N matching ' + noun)
+
+def _add_arg_backend(parser):
+  parser.add_argument(
+    '--backend', dest='backend', choices=sjb.common.storage.BACKEND_CHOICES,
+    default=None,
+    help='the backend storing the cheat sheet. Default is the backend of the existing cheat sheet, or else $%s or %s' % (
+      sjb.common.storage.ENV_BACKEND, sjb.common.storage.BACKEND_DEFAULT))
+
 def _add_arg_list(parser):
   parser.add_argument(
     '-l', dest='list', type=str, metavar='name',
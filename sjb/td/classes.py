@@ -1,8 +1,10 @@
 """Module containing all core class definitions for this program."""
-import copy
 import enum
+import heapq
 import time
 import sjb.common.base
+import sjb.common.columns
+import sjb.common.query
 
 
 class PriorityEnum(enum.Enum):
@@ -15,17 +17,21 @@ class PriorityEnum(enum.Enum):
 class TodoMatcher(sjb.common.base.ItemMatcher):
   """Class that matches todo items using some set of conditions."""
 
-  def __init__(self, tags=None, priority=None, finished=None):
+  def __init__(
+      self, tags=None, priority=None, finished=None, exclude_tags=None):
     """Initializes an object that matches Todo Items.
 
     Args:
       tags: If not None, then this checks if Todo objects have ALL tags.
       priority: If not None, this checks if Todo objects have same priority.
       finished: If not None, this checks if Todo objects have same finished.
+      exclude_tags: If not None, this checks if Todo objects have NONE of
+        these tags.
     """
     self.tags = tags
     self.priority = priority
     self.finished = finished
+    self.exclude_tags = exclude_tags
 
   def matches(self, item):
     """Returns true only if todo matches ALL conditions."""
@@ -34,14 +40,44 @@ class TodoMatcher(sjb.common.base.ItemMatcher):
     for tag in (self.tags or []):
       if not tag in item.tags:
         return False
+    for tag in (self.exclude_tags or []):
+      if tag in item.tags:
+        return False
     if self.finished is not None and item.finished is not self.finished:
       return False
     return True
 
+  def plan(self, item_list):
+    """Plans the conditions of this matcher as a conjunction of queries."""
+    return self.to_query().plan(item_list)
+
+  def signature(self):
+    return self.to_query().signature()
+
+  def to_query(self):
+    """Returns the sjb.common.query.Matcher equivalent to this matcher."""
+    parts = [sjb.common.query.Tag(tag) for tag in (self.tags or [])]
+    parts.extend(
+      sjb.common.query.Not(sjb.common.query.Tag(tag))
+      for tag in (self.exclude_tags or []))
+    if self.priority is not None and self.finished is not None:
+      # A TodoList answers this from a single (finished, priority) bucket.
+      parts.append(sjb.common.query.Field(
+        ('finished', 'priority'), (self.finished, self.priority)))
+    elif self.priority is not None:
+      parts.append(sjb.common.query.Priority(self.priority))
+    elif self.finished is not None:
+      parts.append(sjb.common.query.Finished(self.finished))
+    return sjb.common.query.And(*parts)
+
 
 class Todo(sjb.common.base.Item):
   """Simple class representing a todo item."""
 
+  _FIELDS = (
+    'text', 'priority', 'tags', 'finished', 'created_date', 'finished_date')
+  __slots__ = _FIELDS
+
   def __init__(self, text, priority=None, tags=None, finished=None, created_date=None, finished_date=None, oid=None):
     super().__init__(oid)
     # Values that should be set at construction time
@@ -50,7 +86,7 @@ class Todo(sjb.common.base.Item):
       self.priority = priority
     else:
       self.priority = PriorityEnum.DEFAULT.value
-    self.tags = set(tags) if tags is not None else set()
+    self.tags = sjb.common.base.intern_tags(tags or ())
 
     # Values that should only be set when reading from file
     self.finished = finished if finished is not None else False
@@ -140,7 +176,7 @@ class Todo(sjb.common.base.Item):
    """
     t = Todo(
       text=json_dict['text'],
-      tags=set(json_dict['tags']),
+      tags=json_dict['tags'],
       priority=json_dict['priority'],
       finished=json_dict['finished'],
       created_date=json_dict['created_date'],
@@ -148,6 +184,34 @@ class Todo(sjb.common.base.Item):
       oid=json_dict['oid'])
     return t
 
+# Fields of the todos grouped into TodoList buckets.
+_BUCKET_FIELDS = ('finished', 'priority')
+
+# Fields of the todos kept in a TodoList SortedIndex.
+_DATE_FIELDS = ('created_date', 'finished_date')
+
+# Fields TodoList.sorted_items can order todos by.
+SORT_FIELDS = ('priority',) + _DATE_FIELDS
+
+
+def _bucket_key(finished, priority):
+  """Returns the key of the TodoList bucket for a finished and priority."""
+  if priority is None:
+    priority = PriorityEnum.DEFAULT.value
+  return bool(finished), priority
+
+
+def _sort_key(field, reverse):
+  """Returns the key function ordering todos as TodoList.sorted_items."""
+  sign = -1 if reverse else 1
+  def key(item):
+    value = getattr(item, field)
+    if value is None:
+      return (True, 0, sign * item.oid)
+    return (False, sign * value, sign * item.oid)
+  return key
+
+
 class TodoList(sjb.common.base.ItemList):
   """Class that represents a list of todo entries.
 
@@ -156,16 +220,31 @@ class TodoList(sjb.common.base.ItemList):
   querying subsets of the full list.
   """
 
+  RECORD_COLUMNS = (
+    ('oid', sjb.common.columns.INT),
+    ('tags', sjb.common.columns.TAGS),
+    ('priority', sjb.common.columns.INT),
+    ('text', sjb.common.columns.STRING),
+    ('finished', sjb.common.columns.BOOL),
+    ('created_date', sjb.common.columns.FLOAT),
+    ('finished_date', sjb.common.columns.FLOAT))
+
   def __init__(self, version=None, modified_date=None):
     super().__init__(version=version, modified_date=modified_date)
 
-    # Maps holding cheat sheet meta data.
-    self._tag_set = set()
+    # Maps each (finished, priority) pair to the set of oids of the todos in
+    # that state. Most todos of a long lived list are finished, so queries on
+    # open todos only need to look at the small open buckets.
+    self._buckets = {}
+
+    # Maps each date field to a SortedIndex of the todos by that date.
+    self._date_indexes = {
+      field: sjb.common.base.SortedIndex() for field in _DATE_FIELDS}
 
   @property
   def tag_set(self):
     """set(str): Set of tags in this list"""
-    return self._tag_set
+    return set(self._tag_index)
 
   def add_item(self, item, initial_load=False):
     """Adds a todo to this todo list.
@@ -190,19 +269,59 @@ class TodoList(sjb.common.base.ItemList):
 
     # set creation date and finished state for new items.
     if not initial_load:
-      if item.created_date != None:
-        raise sjb.common.base.IllegalStateError(
-          'TodoList.add_item', 'new item cant have created date')
-      if item.finished:
-        raise sjb.common.base.IllegalStateError(
-          'TodoList.add_item', 'new item cannot be finished already')
-
+      self._check_new_todo(item)
       item.created_date = time.time()
       item.finished = False
+      # These complete the new todo, they are not changes to apply.
+      item._pop_changes()
 
-    self._update_object_maps(item)
+    self._item_added(item)
     return item
 
+  def add_items(self, items, initial_load=False):
+    """Adds several todos to this todo list at once.
+
+    All todos are checked before any is added. New todos all get the same
+    created_date, which is also the single time the list is marked modified.
+
+    Args:
+      items: list of Todo objects to add. The same restrictions as for
+        add_item apply to each of them.
+      initial_load: Indicates that these todos are loaded from a todo list.
+
+    Returns:
+      list(Todo): the newly added Todo objects.
+
+    Raises:
+      sjb.common.base.IllegalStateError: For the same reasons as add_item.
+    """
+    items = list(items)
+    timestamp = None
+    if not initial_load:
+      for item in items:
+        self._check_new_todo(item)
+      timestamp = time.time()
+
+    super().add_items(items, initial_load=initial_load, timestamp=timestamp)
+
+    for item in items:
+      if not initial_load:
+        item.created_date = timestamp
+        item.finished = False
+        item._pop_changes()
+      self._item_added(item)
+    return items
+
+  @staticmethod
+  def _check_new_todo(item):
+    """Raises IllegalStateError if item cannot be added as a new todo."""
+    if item.created_date != None:
+      raise sjb.common.base.IllegalStateError(
+        'TodoList.add_item', 'new item cant have created date')
+    if item.finished:
+      raise sjb.common.base.IllegalStateError(
+        'TodoList.add_item', 'new item cannot be finished already')
+
   def complete_item(self, oid, set_complete=True):
     """Marks the todo with the specified oid as completed.
 
@@ -220,25 +339,64 @@ class TodoList(sjb.common.base.ItemList):
         if set_complete is False and the item is not complted.
     """
     item = self.get_item(oid)
+    self._check_completable(item, set_complete)
+    self._set_complete(item, set_complete, time.time())
+
+    if self._apply_changes(item):
+      self._mark_modified()
+    return item
 
+  def complete_items(self, oids, set_complete=True):
+    """Marks the todos with the specified oids as completed.
+
+    All todos are checked before any is changed. They all get the same
+    finished_date, which is also the single time the list is marked modified.
+
+    Args:
+      oids: The ids of the items to mark as completed.
+      set_complete: Same as for complete_item.
+
+    Returns:
+      list(Todo): The completed todo objects, in the order of oids.
+
+    Raises:
+      sjb.common.base.InvalidIDError: If some oid has no matching todo.
+      sjb.common.base.IllegalStateError: If some todo is already in the
+        requested completion state.
+    """
+    items = [self.get_item(oid) for oid in self._check_oids(oids)]
+    for item in items:
+      self._check_completable(item, set_complete)
+
+    timestamp = time.time()
+    changed = False
+    for item in items:
+      self._set_complete(item, set_complete, timestamp)
+      changed = self._apply_changes(item) or changed
+    if changed:
+      self._mark_modified(timestamp)
+    return items
+
+  @staticmethod
+  def _check_completable(item, set_complete):
+    """Raises IllegalStateError if item already has the completion state."""
     if set_complete and item.finished:
       raise sjb.common.base.IllegalStateError(
         'TodoList.complete_todo', 'specified todo was already completed')
     elif not set_complete and not item.finished:
       raise sjb.common.base.IllegalStateError(
         'TodoList.complete_todo', 'specified todo was not already completed')
+
+  @staticmethod
+  def _set_complete(item, set_complete, timestamp):
+    """Sets the completion fields of item."""
     if set_complete:
       item.finished = True
-      item.finished_date = time.time()
-      self._mark_modified()
+      item.finished_date = timestamp
     else:
       item.finished = False
       item.finished_date = None
 
-    ## TODO: Not needed yet, but may be needed if maps are completion aware.
-    # self._recompute_object_maps()
-    return item
-
   def remove_item(self, oid):
     """Removes the todo item with the specified oid and updates meta data.
 
@@ -249,7 +407,22 @@ class TodoList(sjb.common.base.ItemList):
       sjb.common.base.InvalidIDError: If no item has a matching oid.
     """
     removed = super().remove_item(oid)
-    self._recompute_object_maps()
+    self._item_removed(removed)
+    return removed
+
+  def remove_items(self, oids):
+    """Removes the todos with the specified oids and updates meta data.
+
+    Returns:
+      list(Todo): The removed Todo objects, in the order of oids.
+
+    Raises:
+      sjb.common.base.InvalidIDError: If some oid has no matching todo. In
+        that case no todo is removed.
+    """
+    removed = super().remove_items(oids)
+    for item in removed:
+      self._item_removed(item)
     return removed
 
   def update_item(self, oid, text=None, priority=None, tags=None):
@@ -265,33 +438,214 @@ class TodoList(sjb.common.base.ItemList):
     Raises:
       sjb.common.base.InvalidIDError: If no item has a matching oid.
     """
-    item = self.get_item(oid)
-    original_item = copy.deepcopy(item)
+    return self.update_items([oid], text=text, priority=priority, tags=tags)[0]
 
-    item.text = text if text is not None else item.text
-    item.priority = priority if priority is not None else item.priority
-    item.tags = tags if tags is not None else item.tags
+  def update_items(self, oids, text=None, priority=None, tags=None):
+    """Updates all todo items given by oids with the same new values.
 
-    if original_item != item:
-      self._mark_modified()
-      self._recompute_object_maps()
+    Only arguments that are not None will be updated. All oids are checked
+    before any todo is changed, and the list is marked modified at most once.
 
-    return item
+    Returns:
+      list(Todo): The updated todo objects, in the order of oids.
+
+    Raises:
+      sjb.common.base.InvalidIDError: If some oid has no matching todo.
+    """
+    items = [self.get_item(oid) for oid in self._check_oids(oids)]
+    if tags is not None:
+      tags = sjb.common.base.intern_tags(tags)
+
+    changed = False
+    for item in items:
+      if text is not None:
+        item.text = text
+      if priority is not None:
+        item.priority = priority
+      if tags is not None:
+        item.tags = set(tags)
+      changed = self._apply_changes(item) or changed
+    if changed:
+      self._mark_modified()
+    return items
+
+  def _update_changed_maps(self, item, changes):
+    """Updates meta objects for the fields of item that changed."""
+    if 'tags' in changes:
+      self._unindex_tags(item.oid, changes['tags'])
+      self._index_tags(item.oid, item.tags)
+    if 'finished' in changes or 'priority' in changes:
+      self._unbucket(item.oid, _bucket_key(
+        changes.get('finished', item.finished),
+        changes.get('priority', item.priority)))
+      self._bucket(item.oid, _bucket_key(item.finished, item.priority))
+    for field in _DATE_FIELDS:
+      if field in changes:
+        index = self._date_indexes[field]
+        index.remove(changes[field], item.oid)
+        index.add(getattr(item, field), item.oid)
 
   def _update_object_maps(self, item):
     """Updates meta objects to reflect the contents of item."""
-    for tag in item.tags:
-      self._tag_set.add(tag)
+    self._index_tags(item.oid, item.tags)
+    self._bucket(item.oid, _bucket_key(item.finished, item.priority))
+    for field, index in self._date_indexes.items():
+      index.add(getattr(item, field), item.oid)
+
+  def _remove_from_object_maps(self, item):
+    """Updates meta objects to no longer reflect the contents of item."""
+    self._unindex_tags(item.oid, item.tags)
+    self._unbucket(item.oid, _bucket_key(item.finished, item.priority))
+    for field, index in self._date_indexes.items():
+      index.remove(getattr(item, field), item.oid)
+
+  def _bucket(self, oid, key):
+    """Adds oid to the (finished, priority) bucket key."""
+    oids = self._buckets.get(key)
+    if oids is None:
+      self._buckets[key] = oids = set()
+    oids.add(oid)
+
+  def _unbucket(self, oid, key):
+    """Removes oid from the (finished, priority) bucket key."""
+    oids = self._buckets.get(key)
+    if oids is None:
+      return
+    oids.discard(oid)
+    if not oids:
+      del self._buckets[key]
+
+  def _buckets_with(self, field, value):
+    """Returns the buckets holding the todos whose field has value.
+
+    Returns:
+      list(set(int)): The matching buckets, or None if field is not one of
+        'finished', 'priority' or the pair _BUCKET_FIELDS.
+    """
+    if field == _BUCKET_FIELDS:
+      oids = self._buckets.get(_bucket_key(*value))
+      return [oids] if oids is not None else []
+    if field not in _BUCKET_FIELDS:
+      return None
+    pos = _BUCKET_FIELDS.index(field)
+    return [oids for key, oids in self._buckets.items() if key[pos] == value]
+
+  def lookup(self, field, value):
+    """Looks up todos by tag, finished state, priority or both of the latter.
 
-  def _recompute_object_maps(self):
-    """Recomputes all meta object maps like tag_set, etc.
+    The last is looked up with field ('finished', 'priority') and a value pair,
+    which is answered by a single bucket.
 
-    This should be used after making a non-trivial change to the list like
-    modifying an elements tags or removing an element.
+    Returns:
+      set(int): The oids of the matching todos, or None if there is no index
+        on the field. The set must not be modified.
     """
-    self._tag_set = set()
-    for item in self.items:
-      self._update_object_maps(item)
+    buckets = self._buckets_with(field, value)
+    if buckets is None:
+      return super().lookup(field, value)
+    if len(buckets) == 1:
+      return buckets[0]
+    return set().union(*buckets)
+
+  def count(self, field, value):
+    """Returns the number of oids lookup would return, or None."""
+    buckets = self._buckets_with(field, value)
+    if buckets is None:
+      return super().count(field, value)
+    return sum(len(oids) for oids in buckets)
+
+  def lookup_range(self, field, start, end):
+    """Looks up the todos whose created_date or finished_date is in
+    [start, end).
+
+    Returns:
+      set(int): The oids of the matching todos, or None for other fields.
+    """
+    if field not in self._date_indexes:
+      return None
+    return set(self._date_indexes[field].oids(start, end))
+
+  def count_range(self, field, start, end):
+    """Returns the number of oids lookup_range would return, or None."""
+    if field not in self._date_indexes:
+      return None
+    return self._date_indexes[field].count(start, end)
+
+  def sorted_items(self, field, item_matcher=None, reverse=False, limit=None):
+    """Returns the todos ordered by one of their fields.
+
+    Todos with equal values are ordered by oid, and todos without a value for
+    a date field come last. If only a few todos can match item_matcher they
+    are selected with a heap; otherwise the sorted indexes of this list are
+    walked until limit matching todos are found.
+
+    Args:
+      field (str): One of SORT_FIELDS.
+      item_matcher: If not None, only todos matching it are returned.
+      reverse (bool): If True, orders by decreasing value instead.
+      limit (int): If not None, at most this many todos are returned.
+
+    Returns:
+      list(Todo): The first limit matching todos in the requested order.
+
+    Raises:
+      sjb.common.base.IllegalStateError: If field is not a sort field.
+    """
+    if field not in SORT_FIELDS:
+      raise sjb.common.base.IllegalStateError(
+        'TodoList.sorted_items', 'cannot sort by field: '+str(field))
+    if limit is not None and limit <= 0:
+      return []
+
+    oids, residual = None, None
+    if item_matcher is not None:
+      oids, residual = item_matcher.plan(self)
+
+    # Selecting from the candidates costs about len(oids) * log(limit), while
+    # walking the index costs about limit * size / len(oids).
+    if oids is not None and (
+        limit is None or len(oids) ** 2 < limit * self.size()):
+      items = self._get_items_by_oids(oids)
+      if residual is not None:
+        items = [item for item in items if residual.matches(item)]
+      key = _sort_key(field, reverse)
+      if limit is None:
+        return sorted(items, key=key)
+      return heapq.nsmallest(limit, items, key=key)
+
+    result = []
+    for oid in self._sorted_oids(field, reverse):
+      if oids is not None and oid not in oids:
+        continue
+      item = self.get_item(oid)
+      if residual is None or residual.matches(item):
+        result.append(item)
+        if len(result) == limit:
+          break
+    return result
+
+  def top_items(self, k, field='priority', item_matcher=None, reverse=False):
+    """Returns the k first todos ordered by field, e.g. the most urgent.
+
+    This is sorted_items with a limit; see there for the arguments.
+    """
+    return self.sorted_items(
+      field, item_matcher=item_matcher, reverse=reverse, limit=k)
+
+  def _sorted_oids(self, field, reverse=False):
+    """Yields the oids of all todos in the order of sorted_items."""
+    if field == 'priority':
+      priorities = sorted({key[1] for key in self._buckets}, reverse=reverse)
+      for priority in priorities:
+        yield from sorted(self.lookup('priority', priority), reverse=reverse)
+      return
+
+    index = self._date_indexes[field]
+    yield from index.oids(reverse=reverse)
+    if len(index) < self.size():
+      # Todos without a date come last.
+      undated = self.all_oids().difference(index.oids())
+      yield from sorted(undated, reverse=reverse)
 
   def to_dict(self):
     """Converts data to a dict suitable for writing to a file as json.
@@ -303,16 +657,22 @@ class TodoList(sjb.common.base.ItemList):
       'todo_list': {
         'version': self.version,
         'modified_date': self.modified_date,
-        'todos': [e._to_dict() for e in self.items]
+        'todos': list(self._item_dicts())
       }
     }
 
+  def _item_from_record(self, record):
+    """Builds the Todo represented by a raw record of a lazy todo list."""
+    return Todo.from_dict(record)
+
   @staticmethod
-  def from_dict(json_dict):
+  def from_dict(json_dict, lazy=False):
     """Constructs TodoList from dict (which was loaded from a JSON file).
 
     Args:
       json_dict: Dict containing the necessary fields for a TodoList.
+      lazy (bool): If True, todos are kept as raw records and only built (and
+        validated) when they are first accessed.
 
     Returns:
       TodoList: Object represented by the dict.
@@ -324,7 +684,9 @@ class TodoList(sjb.common.base.ItemList):
 
     # Add todos to todo list
     for item_json in json_dict['todos']:
-      item = Todo.from_dict(item_json)
-      l.add_item(item, initial_load=True)
+      if lazy:
+        l._add_record(item_json)
+      else:
+        l.add_item(Todo.from_dict(item_json), initial_load=True)
 
     return l
@@ -5,6 +5,7 @@ import sys
 import os
 import sjb.constants
 import sjb.common.misc
+import sjb.common.storage
 import sjb.td.classes
 import sjb.td.storage
 import sjb.td.display
@@ -16,6 +17,8 @@ CMD_METAVAR = 'command'
 CMD_HELP = collections.OrderedDict([
   ('add', 'Add a new todo item to the todo list'),
   ('complete', 'Marks a todo item as completed'),
+  ('export', 'Writes a todo list to a JSON file'),
+  ('import', 'Replaces a todo list with the contents of a JSON file'),
   ('info', 'Shows meta info about the todo list'),
   ('lists', 'Lists all of the todo lists stored in the data directory'),
   ('remove', 'Removes a todo item entirely from the todo list'),
@@ -26,6 +29,13 @@ CMD_HELP = collections.OrderedDict([
 PROMPT = 1
 FORCE = 0
 
+# Maps the values of show --sort to the todo fields they sort by.
+_SORT_FIELDS = {
+  'priority': 'priority',
+  'created': 'created_date',
+  'finished': 'finished_date',
+}
+
 
 def _set_arg(string):
   return set(string.split(','))
@@ -83,10 +93,30 @@ class Program(object):
       '--undo', dest='set_complete', action='store_const', const=False,
       default=True,
       help='when set, will mark completed items as not completed')
-    _add_arg_oid(cmd, help='ID of the todo you wish to mark as completed')
+    _add_arg_oids(cmd, help='IDs of the todos you wish to mark as completed')
     _add_arg_force(cmd, verb='making changes', default=FORCE)
     _add_arg_list(cmd)
 
+  def export_set_args(self, cmds):
+    cmd = cmds.add_parser(
+      'export', help=CMD_HELP['export'],
+      description='The export command writes a todo list, whichever backend stores it, to a file in the JSON list format. The file can be read back with the import command.')
+    cmd.set_defaults(run=self.export)
+    _add_arg_list(cmd)
+    cmd.add_argument(
+      'file', type=str, help='the file to write, or - for standard output')
+
+  def import_set_args(self, cmds):
+    cmd = cmds.add_parser(
+      'import', help=CMD_HELP['import'],
+      description='The import command replaces a todo list with the contents of a file in the JSON list format, e.g. one written by the export command. This can be used to move a list to another backend.')
+    cmd.set_defaults(run=self.import_)
+    _add_arg_force(cmd, verb='replacing an existing list', default=PROMPT)
+    _add_arg_backend(cmd)
+    _add_arg_list(cmd)
+    cmd.add_argument(
+      'file', type=str, help='the file to read, or - for standard input')
+
   def info_set_args(self, cmds):
     cmd_info = cmds.add_parser(
       'info', help=CMD_HELP['info'],
@@ -105,7 +135,7 @@ class Program(object):
       'remove', help=CMD_HELP['remove'],
       description='The remove command removes a todo item from the todo list')
     cmd.set_defaults(run=self.remove)
-    _add_arg_oid(cmd, help='ID of the item you wish to delete')
+    _add_arg_oids(cmd, help='IDs of the items you wish to delete')
     _add_arg_force(cmd, verb='removing the todo', default=PROMPT)
     _add_arg_list(cmd)
 
@@ -120,6 +150,10 @@ class Program(object):
       '--completed', dest='completed', action='store_const', const=True,
       default=False, help='will only show completed items. Default is to only show uncompleted items')
     _add_arg_tags(cmd, help='only show todos with all of the given tags')
+    cmd.add_argument(
+      '--sort', dest='sort', choices=sorted(_SORT_FIELDS), default=None,
+      help='orders the todos by priority (most urgent first), creation date or completion date (oldest first). Default is the order of the list')
+    _add_arg_page(cmd, noun='todos')
     _add_arg_list(cmd)
 
   def update_set_args(self, cmds):
@@ -127,7 +161,7 @@ class Program(object):
       'update', help=CMD_HELP['update'],
       description='The update command can overwrite existing todo entries with new values. Any attribute not explicitly specified will not be changed.')
     cmd.set_defaults(run=self.update)
-    _add_arg_oid(cmd, help='ID of the item you wish to update')
+    _add_arg_oids(cmd, help='IDs of the items you wish to update')
     cmd.add_argument('--text', type=str, metavar='text', help='updated text for this todo item')
     _add_arg_tags(
       cmd, 'updated comma separated list of tags for this todo item')
@@ -136,13 +170,13 @@ class Program(object):
     _add_arg_list(cmd)
 
   def add(self, args):
-    s = sjb.td.storage.Storage(listname=args.list)
+    s = sjb.td.storage.get_storage(args.list)
 
     skip_tag_prompt = args.prompt == FORCE
 
     # if the list doesnt already exist, prompt user to create a new one
     try:
-      tl = s.load_list()
+      tl = s.load_list(trusted=True)
     except sjb.td.storage.NoListFileError:
       cont = (args.prompt == FORCE) or sjb.common.misc.prompt_yes_no(
         'No list file found with name "%s". Would you like to create a new list? ' % args.list, default=True)
@@ -173,26 +207,40 @@ class Program(object):
     sjb.td.display.display_todo(todo)
 
   def complete(self, args):
-    s = sjb.td.storage.Storage(listname=args.list)
-    tl = s.load_list()
+    s = sjb.td.storage.get_storage(args.list)
+    tl = _load_selected(s, args)
+    oids = _select_oids(s, tl, args, finished=not args.set_complete)
     # If not in force mode, ask user before proceeding.
-    todo = tl.get_item(args.oid)
     if args.prompt is not FORCE:
-      question = 'The todo item given by id '+str(args.oid)+' is:\n' + \
-        sjb.td.display.repr_todo(todo) + \
-        '\nAre you sure you want to mark it as %s? ' % (
+      question = _describe_todos(tl, oids) + \
+        '\nAre you sure you want to mark %s as %s? ' % (
+          'it' if len(oids) == 1 else 'them',
           'finished' if args.set_complete else 'unfinished')
       cont = sjb.common.misc.prompt_yes_no(question, default=False)
       if not cont:
         exit(0)
 
-    updated = tl.complete_item(args.oid, set_complete=args.set_complete)
+    updated = tl.complete_items(oids, set_complete=args.set_complete)
     s.save_list(tl)
-    sjb.td.display.display_todo(updated)
+    sjb.td.display.display_todos(updated)
+
+  def export(self, args):
+    s = sjb.td.storage.get_storage(args.list)
+    sjb.common.misc.write_json_file(args.file, s.export_dict())
+
+  def import_(self, args):
+    s = sjb.td.storage.get_storage(args.list, backend=args.backend)
+    if s.exists() and args.prompt is not FORCE:
+      cont = sjb.common.misc.prompt_yes_no(
+        'The todo list "%s" already exists. Are you sure you want to replace it? ' % s.get_list_name(), default=False)
+      if not cont:
+        exit(0)
+    tl = s.import_dict(sjb.common.misc.read_json_file(args.file))
+    print('Imported %d todos' % tl.size())
 
   def info(self, args):
-    s = sjb.td.storage.Storage(listname=args.list)
-    tl = s.load_list()
+    s = sjb.td.storage.get_storage(args.list)
+    tl = s.load_list(trusted=True, history=True)
 
     tag_set = tl.tag_set
     todos = tl.items
@@ -214,52 +262,88 @@ class Program(object):
     print('  %-25s %s' % ('Tag list', ', '.join(tag_set)))
 
   def lists(self, args):
-    lists = sjb.td.storage.Storage.get_all_list_files()
+    lists = sjb.td.storage.get_all_list_files()
     print('Todo Lists: ' + ', '.join(lists))
 
   def remove(self, args):
-    s = sjb.td.storage.Storage(listname=args.list)
-    tl = s.load_list()
+    s = sjb.td.storage.get_storage(args.list)
+    tl = _load_selected(s, args)
+    oids = _select_oids(s, tl, args)
     # If not in force mode, ask user before proceeding.
-    todo = tl.get_item(args.oid)
     if args.prompt is not FORCE:
-      question = \
-        'The todo item given by oid '+str(args.oid)+' is:\n' + \
-        sjb.td.display.repr_todo(todo) + \
-        '\nAre you sure you want to delete it? '
+      question = _describe_todos(tl, oids) + \
+        '\nAre you sure you want to delete %s? ' % (
+          'it' if len(oids) == 1 else 'them')
       cont = sjb.common.misc.prompt_yes_no(question, default=False)
       if not cont:
         exit(0)
 
-    tl.remove_item(args.oid)
+    tl.remove_items(oids)
     s.save_list(tl)
 
   def show(self, args):
-    s = sjb.td.storage.Storage(listname=args.list)
-    tl = s.load_list()
+    s = sjb.td.storage.get_storage(args.list)
     matcher = sjb.td.classes.TodoMatcher(
       tags=args.tags, priority=args.priority, finished=args.completed)
-    items = tl.query_items(matcher)
+    items = s.query_items(
+      matcher, sort_field=_SORT_FIELDS.get(args.sort), limit=args.limit,
+      offset=args.offset, history=args.completed)
     sjb.td.display.display_todos(items)
 
   def update(self, args):
-    s = sjb.td.storage.Storage(listname=args.list)
-    tl = s.load_list()
-    item = tl.get_item(args.oid)
+    s = sjb.td.storage.get_storage(args.list)
+    tl = _load_selected(s, args)
+    oids = _select_oids(s, tl, args)
 
     if args.prompt is not FORCE:
       question = (
-        'The item given by oid '+str(args.oid)+' is:\n' + \
-        sjb.td.display.repr_todo(item) + \
+        _describe_todos(tl, oids) + \
         '\nAre you sure you want to continue? ')
       cont = sjb.common.misc.prompt_yes_no(question, default=True)
       if not cont:
         exit(0)
 
-    updated = tl.update_item(
-      args.oid, text=args.text, priority=args.priority, tags=args.tags)
+    updated = tl.update_items(
+      oids, text=args.text, priority=args.priority, tags=args.tags)
     s.save_list(tl)
-    sjb.td.display.display_todo(updated)
+    sjb.td.display.display_todos(updated)
+
+
+def _load_selected(s, args):
+  """Loads the todo list of storage s, or only the todos given by id if the
+  arguments select todos by id alone."""
+  if args.match_tags:
+    return s.load_list(lazy=True)
+  return s.load_items(args.oids)
+
+def _select_oids(s, tl, args, finished=None):
+  """Returns the oids of the todos selected by the id and filter arguments.
+
+  Archived todos given by id are first restored into tl from the archive of
+  storage s. Exits the program if the arguments do not select any todo.
+  """
+  if not args.oids and not args.match_tags:
+    sys.stderr.write('Give at least one todo id or the --match-tags filter\n')
+    sys.exit(2)
+  s.restore_archived(tl, s.select_archived(args.oids))
+  matcher = None
+  if args.match_tags:
+    matcher = sjb.td.classes.TodoMatcher(
+      tags=args.match_tags, finished=finished)
+  oids = tl.select_oids(args.oids, matcher)
+  if not oids:
+    print('No todos selected')
+    exit(0)
+  return oids
+
+def _describe_todos(tl, oids):
+  """Returns a string showing the todos with the given oids to the user."""
+  if len(oids) == 1:
+    return 'The todo item given by id %d is:\n%s' % (
+      oids[0], sjb.td.display.repr_todo(tl.get_item(oids[0])))
+  return 'The %d selected todo items are:\n%s' % (
+    len(oids),
+    '\n'.join(sjb.td.display.repr_todo(tl.get_item(oid)) for oid in oids))
 
 
 # Parser arguments shared by several commands
@@ -285,8 +369,30 @@ def _add_arg_priority(
     '--priority', type=int, default=default, help=helpmsg,
     choices=[e.value for e in sjb.td.classes.PriorityEnum])
 
-def _add_arg_oid(parser, help='the ID of the target todo'):
-  parser.add_argument('oid', metavar='id', type=int, help=help)
+def _add_arg_oids(parser, help='the IDs of the target todos'):
+  parser.add_argument(
+    'oids', metavar='id', nargs='*', type=sjb.common.misc.oid_range_arg,
+    help=help + '. A range of IDs can be given as 10-50')
+  parser.add_argument(
+    '--match-tags', dest='match_tags', metavar='tags', type=_set_arg,
+    help='also selects all todos with all of the given comma separated tags')
+
+def _add_arg_page(parser, noun):
+  parser.add_argument(
+    '--limit', dest='limit', metavar='N',
+    type=sjb.common.misc.positive_int_arg, default=None,
+    help='only shows the first N ' + noun)
+  parser.add_argument(
+    '--offset', dest='offset', metavar='N',
+    type=sjb.common.misc.non_negative_int_arg, default=0,
+    help='skips the first N matching ' + noun)
+
+def _add_arg_backend(parser):
+  parser.add_argument(
+    '--backend', dest='backend', choices=sjb.common.storage.BACKEND_CHOICES,
+    default=None,
+    help='the backend storing the list. Default is the backend of the existing list, or else $%s or %s' % (
+      sjb.common.storage.ENV_BACKEND, sjb.common.storage.BACKEND_DEFAULT))
 
 def _add_arg_list(parser):
   parser.add_argument(
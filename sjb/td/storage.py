@@ -1,98 +1,90 @@
-"""Module responsible for reading/writing todo list json to file."""
-import os
-import json
-import warnings
-import sjb.common.config
+"""Module responsible for reading/writing todo lists to files."""
+import sjb.common.binary
+import sjb.common.sqlite
+import sjb.common.storage
 import sjb.td.classes
 
-_SUITE = 'sjb'
-_APP = 'todo'
-_DEFAULT_LIST_FILE = 'todo'
-_LIST_FILE_EXTENSION = '.json'
-_BACKUP_EXTENSION = '.backup'
 
+NoListFileError = sjb.common.storage.NoListFileError
+IOError = sjb.common.storage.IOError
 
-class NoListFileError(Exception):
-  """Raised when user tries to load a non-existent list."""
-  pass
 
-class IOError(Exception):
-  """Raised on generic problem with writing things to/from OS."""
-  pass
-
-class Storage(object):
+class Storage(sjb.common.storage.ListStorage):
   """Class encapsulating environment information like where to write stuff."""
 
-  def __init__(self, listname=None):
-    self._listname = listname or _DEFAULT_LIST_FILE
-
-  def _get_list_file(self):
-    return os.path.join(
-      sjb.common.config.get_user_app_data_dir(_APP, suite_name=_SUITE),
-      '%s%s' % (self._listname, _LIST_FILE_EXTENSION))
-
-  def get_list_name(self):
-    """Returns the short name of the list for this storage object."""
-    return self._listname
-
-  @staticmethod
-  def get_all_list_files():
-    """Returns a list of all the available list files in the data directory."""
-    d = sjb.common.config.get_user_app_data_dir(_APP, suite_name=_SUITE)
-    files = os.listdir(d)
-    matching = []
-    for f in files:
-      if not os.path.isfile(os.path.join(d, f)):
-        continue
-      # check that it has correct extension.
-      if not f.endswith(_LIST_FILE_EXTENSION):
-        continue
-      matching.append(f[0:(len(f)-len(_LIST_FILE_EXTENSION))])
-    return matching
-
-  def save_list(self, todo_list):
-    """Saves the list to the file pointed at by this object.
-
-    Raises:
-      sjb.td.classes.ValidationError: If some element of the list is invalid.
-    """
-    fname = self._get_list_file()
-
-    # create parent directory as needed
-    if not os.path.isdir(os.path.dirname(fname)):
-      os.makedirs(os.path.dirname(fname))
-
-    sjb.common.misc.backup_file(fname, _BACKUP_EXTENSION)
-
-    todo_list.validate()
-
-    json_file = open(fname, 'w')
-    json_file.write(json.dumps(todo_list.to_dict(), indent=2))
-    json_file.close()
-
-  def load_list(self):
-    """Loads the todo list.
-
-    The name of the todo list is specified at initialization time.
-
-    Returns:
-      TodoList: object with contents given by the loaded file.
-
-    Raises:
-      ValidationError: If some element of the list is invalid.
-      NoListFileError: If the file does not exist.
-      IOError: If a file-like object exists but is wrong type (i.e. a dir).
-    """
-    fname = self._get_list_file()
-
-    if not os.path.isfile(fname):
-      if os.path.exists(fname):
-        raise IOError('list file exists but is of wrong filetype')
-      raise NoListFileError()
-
-    json_file = open(fname, 'r')
-    json_dict = json.load(json_file)
-    json_file.close()
-    lst = sjb.td.classes.TodoList.from_dict(json_dict)
-    lst.validate()
-    return lst
+  _APP = 'todo'
+  _DEFAULT_LIST_FILE = 'todo'
+  _ROOT_KEY = 'todo_list'
+  _ITEMS_KEY = 'todos'
+  _ARCHIVE_FIELD = 'finished_date'
+  _OFFSET_INDEX = True
+
+  def _list_from_dict(self, json_dict, lazy):
+    return sjb.td.classes.TodoList.from_dict(json_dict, lazy=lazy)
+
+
+class SqliteStorage(sjb.common.sqlite.SqliteStorage):
+  """Class storing todo lists in SQLite databases."""
+
+  _APP = 'todo'
+  _DEFAULT_LIST_FILE = 'todo'
+  _ROOT_KEY = 'todo_list'
+  _ITEMS_KEY = 'todos'
+  _COLUMNS = (
+    ('text', 'TEXT'),
+    ('priority', 'INTEGER'),
+    ('finished', sjb.common.sqlite.BOOLEAN),
+    ('created_date', 'REAL'),
+    ('finished_date', 'REAL'),
+  )
+  _INDEXES = (
+    ('finished', 'priority'),
+    ('priority',),
+    ('created_date',),
+    ('finished_date',),
+  )
+
+  def _list_from_dict(self, json_dict, lazy):
+    return sjb.td.classes.TodoList.from_dict(json_dict, lazy=lazy)
+
+  def _item_from_dict(self, record):
+    return sjb.td.classes.Todo.from_dict(record)
+
+
+class BinaryStorage(sjb.common.binary.BinaryStorage):
+  """Class storing todo lists in compact binary files."""
+
+  _APP = 'todo'
+  _DEFAULT_LIST_FILE = 'todo'
+  _ROOT_KEY = 'todo_list'
+  _ITEMS_KEY = 'todos'
+  _COLUMNS = (
+    ('text', sjb.common.binary.STRING),
+    ('priority', sjb.common.binary.INT),
+    ('finished', sjb.common.binary.BOOL),
+    ('created_date', sjb.common.binary.FLOAT),
+    ('finished_date', sjb.common.binary.FLOAT),
+  )
+  _ARCHIVE_FIELD = 'finished_date'
+
+  def _list_from_dict(self, json_dict, lazy):
+    return sjb.td.classes.TodoList.from_dict(json_dict, lazy=lazy)
+
+  def _item_from_dict(self, record):
+    return sjb.td.classes.Todo.from_dict(record)
+
+
+# Storage classes of each backend, in the order existing lists are looked for.
+_STORAGE_CLASSES = (SqliteStorage, BinaryStorage, Storage)
+
+
+def get_storage(listname=None, backend=None):
+  """Returns the storage object of a todo list. See
+  sjb.common.storage.get_storage."""
+  return sjb.common.storage.get_storage(
+    _STORAGE_CLASSES, listname=listname, backend=backend)
+
+
+def get_all_list_files():
+  """Returns the short names of all the todo lists in the data directory."""
+  return sjb.common.storage.get_all_list_names(_STORAGE_CLASSES)
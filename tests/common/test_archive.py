@@ -0,0 +1,252 @@
+import os
+import time
+import unittest.mock as mock
+import pytest
+import sjb.common.archive as archive
+import sjb.common.base
+import sjb.common.journal as journal
+import sjb.common.query as query
+import sjb.common.storage as storage
+import sjb.td.classes
+import sjb.td.storage
+from sjb.td.classes import Todo, TodoList
+
+
+_OLD = time.time() - 365 * 24 * 60 * 60
+
+
+def _make_list():
+  l = TodoList(version='0.1', modified_date=5.0)
+  l.add_items([
+    Todo('open', oid=1, tags=['a'], created_date=_OLD),
+    Todo('old', oid=2, tags=['b'], finished=True, created_date=_OLD,
+         finished_date=_OLD),
+    Todo('recent', oid=3, finished=True, created_date=_OLD,
+         finished_date=time.time()),
+    Todo('older', oid=4, tags=['b'], finished=True, created_date=_OLD,
+         finished_date=_OLD - 1),
+  ], initial_load=True)
+  return l
+
+
+def _oids(items):
+  return [item.oid for item in items]
+
+
+class TestArchive(object):
+
+  def setup_method(self, method):
+    self.patcher = None
+
+  def teardown_method(self, method):
+    if self.patcher is not None:
+      self.patcher.stop()
+
+  def make_storage(self, tmp_path, backend=storage.BACKEND_JSON):
+    if self.patcher is None:
+      self.patcher = mock.patch.dict(os.environ, {
+        'XDG_DATA_HOME': str(tmp_path), storage.ENV_ARCHIVE_DAYS: '90'})
+      self.patcher.start()
+    return sjb.td.storage.get_storage(backend=backend)
+
+  def test_full_write_archives_old_todos(self, tmp_path):
+    for backend in [storage.BACKEND_JSON, storage.BACKEND_BINARY]:
+      s = self.make_storage(tmp_path / backend, backend=backend)
+      l = _make_list()
+      s.save_list(l)
+      # The saved list keeps its items, only the file leaves them out.
+      assert _oids(l.items) == [1, 2, 3, 4]
+      assert l.modified_date == 5.0
+      assert list(s._get_archive().headers()) == [archive.segment_key(_OLD)]
+
+      s = sjb.td.storage.get_storage(backend=backend)
+      assert _oids(s.load_list().items) == [1, 3]
+      assert s.archived_oids() == {2, 4}
+      assert _oids(s.query_items()) == [1, 3]
+      assert _oids(s.query_items(history=True)) == [1, 3, 2, 4]
+      self.patcher.stop()
+      self.patcher = None
+
+  def test_select_archived(self, tmp_path):
+    s = self.make_storage(tmp_path)
+    s.save_list(_make_list())
+    s = sjb.td.storage.Storage()
+    assert s.select_archived([range(1, 2)]) == []
+    assert s.select_archived([range(4, 10), range(1, 3)]) == [2, 4]
+    assert s.select_archived([range(1, 10, 2), range(3, 3)]) == []
+    assert s.select_archived([range(0, 1000000000)]) == [2, 4]
+
+  def test_saving_again_after_archiving(self, tmp_path):
+    s = self.make_storage(tmp_path)
+    l = _make_list()
+    s.save_list(l)
+    l.update_item(3, text='changed')
+    s.save_list(l)
+    assert os.path.exists(s._get_journal_file())
+    assert s.archived_oids() == {2, 4}
+
+    # Changing or removing the archived todos the list still holds takes
+    # them out of the archive.
+    l.complete_item(2, set_complete=False)
+    l.remove_item(4)
+    s.save_list(l)
+    s = sjb.td.storage.Storage()
+    assert s.archived_oids() == set()
+    l = s.load_list(history=True)
+    assert _oids(l.items) == [1, 3, 2]
+    assert not l.get_item(2).finished
+    assert l.get_item(3).text == 'changed'
+
+  def test_history(self, tmp_path):
+    s = self.make_storage(tmp_path)
+    s.save_list(_make_list())
+    l = s.load_list(history=True)
+    assert _oids(l.items) == [1, 3, 2, 4]
+    assert l.get_item(2).text == 'old'
+    assert l.tag_set == {'a', 'b'}
+    with pytest.raises(sjb.common.base.IllegalStateError):
+      s.save_list(l)
+    assert s.export_dict() == TodoList.from_dict(
+      s.export_dict()).to_dict()
+    assert len(s.export_dict()['todo_list']['todos']) == 4
+
+  def test_archived_oids_are_not_reused(self, tmp_path):
+    s = self.make_storage(tmp_path)
+    l = _make_list()
+    l.remove_item(3)
+    s.save_list(l)
+    l = sjb.td.storage.Storage().load_list()
+    assert _oids(l.items) == [1]
+    l.add_item(Todo('new'))
+    assert _oids(l.items) == [1, 5]
+
+  def test_restore(self, tmp_path):
+    s = self.make_storage(tmp_path)
+    s.save_list(_make_list())
+    s = sjb.td.storage.Storage()
+    l = s.load_list(lazy=True)
+    assert s.restore_archived(l, [1, 2, 5]) == [2]
+    l.complete_item(2, set_complete=False)
+    s.save_list(l)
+
+    s = sjb.td.storage.Storage()
+    assert s.archived_oids() == {4}
+    l = s.load_list()
+    assert _oids(l.items) == [1, 3, 2]
+    assert not l.get_item(2).finished
+    assert _oids(s.load_list(history=True).items) == [1, 3, 2, 4]
+
+  def test_restore_update_with_compaction(self, tmp_path):
+    s = self.make_storage(tmp_path)
+    s.save_list(_make_list())
+    for load in ['load_list', 'load_items']:
+      s = sjb.td.storage.Storage()
+      if load == 'load_items':
+        l = s.load_items([range(4, 5)])
+      else:
+        l = s.load_list(lazy=True)
+      assert s.restore_archived(l, [4]) == [4]
+      l.update_item(4, text='renamed ' + load)
+      with mock.patch.object(journal, 'MAX_RECORDS', 1):
+        s.save_list(l)
+
+      # Still old and finished, so the compaction archived it again.
+      s = sjb.td.storage.Storage()
+      assert s.archived_oids() == {2, 4}
+      assert not s.load_list().has_item(4)
+      assert s.load_list(history=True).get_item(4).text == 'renamed ' + load
+
+  def test_add_moves_archived_items(self, tmp_path):
+    s = self.make_storage(tmp_path)
+    s.save_list(_make_list())
+    a = s._get_archive()
+    record = dict(
+      s.load_list(history=True).get_item(4)._to_dict(), finished_date=0.5)
+    a.add([record], 6.0)
+    assert sorted(a.headers()) == sorted(
+      [archive.segment_key(0.5), archive.segment_key(_OLD)])
+    assert a.headers()[archive.segment_key(_OLD)]['oids'] == [2]
+    assert [
+      r['finished_date'] for r in a.records(oids=[4]) if r['oid'] == 4] == [0.5]
+
+  def test_import_replaces_archive(self, tmp_path):
+    s = self.make_storage(tmp_path)
+    s.save_list(_make_list())
+    s.import_dict(TodoList().to_dict())
+    assert s.archived_oids() == set()
+    assert sjb.td.storage.Storage().load_list(history=True).size() == 0
+
+  def test_torn_archive_is_truncated(self, tmp_path):
+    s = self.make_storage(tmp_path)
+    s.save_list(_make_list())
+    segment = s._get_archive()._get_segment_file(archive.segment_key(_OLD))
+    with open(segment, 'a') as f:
+      f.write('{"op": "put", "item"')
+    l = TodoList()
+    l.add_item(
+      Todo('done', oid=7, finished=True, created_date=_OLD,
+           finished_date=_OLD),
+      initial_load=True)
+    sjb.td.storage.Storage().archive_items(l)
+    s = sjb.td.storage.Storage()
+    assert s.archived_oids() == {2, 4, 7}
+    assert _oids(s.load_list(history=True).items) == [1, 3, 2, 4, 7]
+
+  def test_segments(self, tmp_path):
+    s = self.make_storage(tmp_path)
+    l = TodoList()
+    dates = [
+      time.mktime((2018, 1, 10, 12, 0, 0, 0, 0, -1)),
+      time.mktime((2018, 1, 20, 12, 0, 0, 0, 0, -1)),
+      time.mktime((2018, 3, 5, 12, 0, 0, 0, 0, -1)),
+    ]
+    l.add_items([
+      Todo('jan', oid=1, tags=['a'], finished=True, created_date=0.5,
+           finished_date=dates[0]),
+      Todo('jan', oid=2, tags=['b'], finished=True, created_date=0.5,
+           finished_date=dates[1]),
+      Todo('mar', oid=3, tags=['b', 'c'], finished=True, created_date=0.5,
+           finished_date=dates[2]),
+    ], initial_load=True)
+    s.save_list(l)
+
+    headers = s._get_archive().headers()
+    assert sorted(headers) == ['2018-01', '2018-03']
+    assert headers['2018-01']['oids'] == [1, 2]
+    assert headers['2018-01']['low'] == dates[0]
+    assert headers['2018-01']['high'] == dates[1]
+    assert headers['2018-01']['tags'] == ['a', 'b']
+
+    def query_segments(m):
+      s = sjb.td.storage.Storage()
+      with mock.patch.object(
+          archive.Archive, '_read_segment',
+          side_effect=archive.Archive._read_segment,
+          autospec=True) as read:
+        oids = _oids(s.query_items(m, history=True))
+      return oids, sorted(call[0][1] for call in read.call_args_list)
+
+    assert query_segments(None) == ([1, 2, 3], ['2018-01', '2018-03'])
+    assert query_segments(query.Tag('c')) == ([3], ['2018-03'])
+    assert query_segments(
+      query.DateRange('finished_date', dates[0], dates[1])) == ([1], ['2018-01'])
+    assert query_segments(
+      sjb.td.classes.TodoMatcher(tags={'a'}, finished=True)) == (
+        [1], ['2018-01'])
+    assert query_segments(query.Tag('d')) == ([], [])
+
+    s = sjb.td.storage.Storage()
+    l = s.load_list()
+    s.restore_archived(l, [3])
+    s.save_list(l)
+    assert sorted(s._get_archive().headers()) == ['2018-01']
+    assert not os.path.exists(s._get_archive()._get_segment_file('2018-03'))
+
+  def test_archive_days(self):
+    assert storage.get_archive_days(5) == 5
+    with mock.patch.dict(os.environ, {storage.ENV_ARCHIVE_DAYS: '0'}):
+      assert storage.get_archive_days() == 0
+    with pytest.raises(ValueError):
+      storage.get_archive_days('-1')
+    with pytest.raises(ValueError):
+      storage.get_archive_days('soon')
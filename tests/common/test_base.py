@@ -0,0 +1,34 @@
+import sjb.common.base as base
+
+
+class TestSortedIndex(object):
+
+  def make_index(self):
+    index = base.SortedIndex()
+    for value, oid in [(3.0, 1), (1.0, 4), (2.0, 2), (1.0, 3), (None, 5)]:
+      index.add(value, oid)
+    return index
+
+  def test_add(self):
+    index = self.make_index()
+    assert len(index) == 4
+    assert list(index.oids()) == [3, 4, 2, 1]
+    assert list(index.oids(reverse=True)) == [1, 2, 4, 3]
+    index.add(2.0, 2)
+    assert list(index.oids()) == [3, 4, 2, 1]
+
+  def test_remove(self):
+    index = self.make_index()
+    index.remove(1.0, 3)
+    index.remove(1.0, 2)
+    index.remove(None, 5)
+    assert list(index.oids()) == [4, 2, 1]
+
+  def test_range(self):
+    index = self.make_index()
+    assert list(index.oids(1.5, 3.0)) == [2]
+    assert list(index.oids(start=2.0)) == [2, 1]
+    assert list(index.oids(end=2.0, reverse=True)) == [4, 3]
+    assert list(index.oids(3.0, 1.0)) == []
+    assert index.count(end=3.0) == 3
+    assert index.count(5.0) == 0
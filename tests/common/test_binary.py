@@ -0,0 +1,185 @@
+import os
+import pickle
+import unittest.mock as mock
+import pytest
+import sjb.common.binary as binary
+import sjb.common.journal as journal
+import sjb.common.query as query
+import sjb.common.storage
+import sjb.cs.classes
+import sjb.cs.storage
+import sjb.td.storage
+from sjb.td.classes import Todo, TodoList, TodoMatcher
+
+
+def _make_list():
+  l = TodoList(version='0.1', modified_date=5.0)
+  l.add_items([
+    Todo('one', oid=1, priority=1, tags=['a', 'b'], created_date=3.0),
+    Todo('twö', oid=2, priority=2, tags=['a'], finished=True,
+         created_date=1.0, finished_date=4.0),
+    Todo('three', oid=3, priority=1, tags=['c'], created_date=2.0),
+    Todo('four', oid=4, priority=3, tags=['a', 'c'], created_date=0.5),
+    Todo('Five', oid=5, priority=2, created_date=2.0),
+  ], initial_load=True)
+  return l
+
+
+def _oids(items):
+  return [item.oid for item in items]
+
+
+class TestFormat(object):
+
+  def encode(self, l):
+    return binary.encode(
+      l.to_dict(), 'todo_list', 'todos', sjb.td.storage.BinaryStorage._COLUMNS)
+
+  def test_round_trip(self):
+    l = _make_list()
+    reader = binary.Reader(
+      self.encode(l), sjb.td.storage.BinaryStorage._COLUMNS)
+    assert len(reader) == 5
+    assert reader.meta == {'version': '0.1', 'modified_date': 5.0}
+    assert reader.records() == l.to_dict()['todo_list']['todos']
+    assert [reader.record(i) for i in range(5)] == reader.records()
+
+  def test_values_are_decoded_on_access(self):
+    reader = binary.Reader(
+      self.encode(_make_list()), sjb.td.storage.BinaryStorage._COLUMNS)
+    assert reader.value('text', 1) == 'twö'
+    assert reader.value('finished', 1) is True
+    assert reader.value('finished_date', 0) is None
+    assert reader.value('tags', 3) == {'a', 'c'}
+    assert 'created_date' not in reader._decoded
+
+  def test_empty_list(self):
+    reader = binary.Reader(
+      self.encode(TodoList()), sjb.td.storage.BinaryStorage._COLUMNS)
+    assert len(reader) == 0
+    assert reader.records() == []
+
+  def test_bad_files(self):
+    columns = sjb.td.storage.BinaryStorage._COLUMNS
+    data = self.encode(_make_list())
+    with pytest.raises(binary.FormatError):
+      binary.Reader(b'{"todo_list": {}}', columns)
+    with pytest.raises(binary.FormatError):
+      binary.Reader(data[:-8], columns)
+    with pytest.raises(binary.FormatError):
+      binary.Reader(data, sjb.cs.storage.BinaryStorage._COLUMNS)
+    newer = bytearray(data)
+    newer[4:6] = (binary._FORMAT_VERSION + 1).to_bytes(2, 'little')
+    with pytest.raises(binary.FormatError, match='version %d ' % (
+        binary._FORMAT_VERSION + 1)):
+      binary.Reader(bytes(newer), columns)
+
+
+class TestBinaryStorage(object):
+
+  def setup_method(self, method):
+    self.patcher = None
+
+  def teardown_method(self, method):
+    if self.patcher is not None:
+      self.patcher.stop()
+
+  def make_storage(self, tmp_path):
+    if self.patcher is None:
+      # The todos of _make_list are old enough to be archived.
+      self.patcher = mock.patch.dict(os.environ, {
+        'XDG_DATA_HOME': str(tmp_path),
+        sjb.common.storage.ENV_ARCHIVE_DAYS: '0'})
+      self.patcher.start()
+    return sjb.td.storage.get_storage(
+      backend=sjb.common.storage.BACKEND_BINARY)
+
+  def test_save_and_load(self, tmp_path):
+    s = self.make_storage(tmp_path)
+    l = _make_list()
+    s.save_list(l)
+    assert self.make_storage(tmp_path).load_list().to_dict() == l.to_dict()
+    loaded = self.make_storage(tmp_path).load_list(lazy=True, trusted=True)
+    assert loaded.to_dict() == l.to_dict()
+    assert isinstance(sjb.td.storage.get_storage(), sjb.td.storage.BinaryStorage)
+
+  def test_cheatsheet_import_export_is_lossless(self, tmp_path):
+    self.make_storage(tmp_path)
+    cs = sjb.cs.classes.CheatSheet(modified_date=1.0)
+    cs.add_item(sjb.cs.classes.Entry('clue', 'answer', 'p', {'t', 'u'}))
+    cs.add_item(sjb.cs.classes.Entry('other', 'answer', 'q', set()))
+    s = sjb.cs.storage.get_storage(backend=sjb.common.storage.BACKEND_BINARY)
+    s.import_dict(cs.to_dict())
+    assert sjb.cs.storage.BinaryStorage().export_dict() == cs.to_dict()
+
+  def test_query_matches_list(self, tmp_path):
+    s = self.make_storage(tmp_path)
+    l = _make_list()
+    s.save_list(l)
+    matchers = [
+      None,
+      query.Tag('a') & ~query.Tag('c'),
+      query.DateRange('created_date', 2.0, 3.0),
+      query.Text('O'),
+      TodoMatcher(tags={'a'}, finished=False),
+    ]
+    for m in matchers:
+      expected = _oids(l.iter_items(m))
+      assert _oids(s.query_items(m)) == expected
+      assert _oids(s.query_items(m, limit=2, offset=1)) == expected[1:3]
+    for field in ['priority', 'created_date', 'finished_date']:
+      expected = _oids(l.sorted_items(field))
+      assert _oids(s.query_items(sort_field=field)) == expected
+      assert _oids(s.query_items(sort_field=field, limit=2)) == expected[:2]
+
+  def test_query_sees_journal(self, tmp_path):
+    s = self.make_storage(tmp_path)
+    s.save_list(_make_list())
+    l = s.load_list()
+    l.remove_item(1)
+    s.save_list(l)
+    assert os.path.exists(s._get_journal_file())
+    assert _oids(self.make_storage(tmp_path).query_items()) == [2, 3, 4, 5]
+
+  def test_lazy_load_keeps_views_of_the_file(self, tmp_path):
+    s = self.make_storage(tmp_path)
+    l = _make_list()
+    s.save_list(l)
+    with mock.patch.object(binary.Reader, 'records') as records:
+      loaded = self.make_storage(tmp_path).load_list(lazy=True)
+    assert not records.called
+    assert all(type(item) is binary._RowView for item in loaded._items)
+    assert loaded.lookup('tags', 'a') == {1, 2, 4}
+    assert loaded.get_item(2).text == 'twö'
+    assert type(loaded._items[1]) is Todo
+    assert loaded.to_dict() == l.to_dict()
+    # Snapshots pickle the views as plain records.
+    assert pickle.loads(pickle.dumps(loaded)).to_dict() == l.to_dict()
+
+  def test_query_replays_journal_on_mapped_rows(self, tmp_path):
+    s = self.make_storage(tmp_path)
+    s.save_list(_make_list())
+    l = _make_list()
+    changed = dict(l.get_item(3)._to_dict(), text='changed', tags=['a'])
+    added = Todo('six', oid=6, tags=['a'], created_date=2.5)._to_dict()
+    journal.append(s._get_journal_file(), [
+      {'op': journal.OP_PUT, 'item': changed},
+      {'op': journal.OP_REMOVE, 'oid': 1},
+      {'op': journal.OP_REMOVE, 'oid': 4},
+      {'op': journal.OP_PUT, 'item': added},
+      {'op': journal.OP_PUT, 'item': l.get_item(4)._to_dict()},
+      {'op': journal.OP_COMMIT, 'modified_date': 6.0},
+    ])
+    l = self.make_storage(tmp_path).load_list()
+    assert _oids(l.items) == [2, 3, 5, 6, 4]
+
+    s = self.make_storage(tmp_path)
+    with mock.patch.object(s, 'load_list', side_effect=AssertionError):
+      for m in [None, query.Tag('a'), TodoMatcher(tags={'a'}, finished=False)]:
+        expected = _oids(l.iter_items(m))
+        assert _oids(s.query_items(m)) == expected
+        assert _oids(s.query_items(m, limit=2, offset=1)) == expected[1:3]
+      for field in ['priority', 'created_date']:
+        expected = _oids(l.sorted_items(field))
+        assert _oids(s.query_items(sort_field=field)) == expected
+      assert s.query_items(query.Tag('a'))[1].text == 'changed'
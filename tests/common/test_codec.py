@@ -0,0 +1,104 @@
+import json
+import os
+import unittest.mock as mock
+import pytest
+import sjb.common.codec as codec
+import sjb.td.storage
+from sjb.td.classes import Todo, TodoList
+
+needs_orjson = pytest.mark.skipif(
+  codec.orjson is None, reason='orjson is not installed')
+
+
+def _make_dict():
+  l = TodoList(modified_date=1527001163.5)
+  l.add_items([
+    Todo('one', oid=1, tags=['a', 'b'], created_date=1e-07),
+    Todo('twö "quoted"', oid=2, finished=True, created_date=1e16,
+         finished_date=12.25),
+  ], initial_load=True)
+  return l.to_dict()
+
+
+def _encode(c, value, style):
+  return b''.join(bytes(chunk) for chunk in c.encode(value, style=style))
+
+
+class TestCodec(object):
+
+  def check_round_trip(self, c):
+    value = _make_dict()
+    for style in codec.STYLE_CHOICES:
+      data = _encode(c, value, style)
+      assert c.decode(data) == value
+      assert _encode(c, c.decode(data), style) == data
+
+  def test_stdlib_round_trip(self):
+    self.check_round_trip(codec.StdlibCodec())
+
+  @needs_orjson
+  def test_orjson_round_trip(self):
+    self.check_round_trip(codec.OrjsonCodec())
+
+  @needs_orjson
+  def test_codecs_read_each_other(self):
+    value = _make_dict()
+    stdlib, fast = codec.StdlibCodec(), codec.OrjsonCodec()
+    for style in codec.STYLE_CHOICES:
+      assert fast.decode(_encode(stdlib, value, style)) == value
+      assert stdlib.decode(_encode(fast, value, style)) == value
+
+  def test_stdlib_matches_json_module(self):
+    value = _make_dict()
+    c = codec.StdlibCodec()
+    assert _encode(c, value, codec.STYLE_INDENTED) == json.dumps(
+      value, indent=2).encode('utf-8')
+    assert _encode(c, value, codec.STYLE_COMPACT) == json.dumps(
+      value, separators=(',', ':')).encode('utf-8')
+
+  def test_output_is_chunked(self):
+    value = {'items': ['x' * 100] * 100}
+    with mock.patch.object(codec, 'CHUNK_SIZE', 1000):
+      for name in codec.available_codecs():
+        for style in codec.STYLE_CHOICES:
+          chunks = list(codec.get_codec(name).encode(value, style=style))
+          assert len(chunks) > 5
+          assert all(len(chunk) < 2000 for chunk in chunks)
+
+  def test_output_is_streamed(self):
+    # The first chunk is written before a later item fails to encode.
+    value = {'list': {'items': ['x' * 100] * 20 + [object()]}}
+    with mock.patch.object(codec, 'CHUNK_SIZE', 1000):
+      for name in codec.available_codecs():
+        for style in codec.STYLE_CHOICES:
+          chunks = codec.get_codec(name).encode(value, style=style)
+          assert next(chunks).startswith(b'{')
+          with pytest.raises(TypeError):
+            list(chunks)
+
+  def test_config(self):
+    assert codec.get_codec().name == codec.available_codecs()[0]
+    with mock.patch.dict(os.environ, {codec.ENV_CODEC: 'stdlib'}):
+      assert codec.get_codec().name == codec.CODEC_STDLIB
+    with mock.patch.dict(os.environ, {codec.ENV_STYLE: 'compact'}):
+      assert codec.get_style() == codec.STYLE_COMPACT
+    with mock.patch.object(codec, 'orjson', None):
+      assert codec.available_codecs() == [codec.CODEC_STDLIB]
+      with pytest.raises(ValueError):
+        codec.get_codec(codec.CODEC_ORJSON)
+    with pytest.raises(ValueError):
+      codec.get_style('pretty')
+
+  def test_storage_round_trip_is_byte_identical(self, tmp_path):
+    with mock.patch.dict(os.environ, {'XDG_DATA_HOME': str(tmp_path)}):
+      for name in codec.available_codecs():
+        for style in codec.STYLE_CHOICES:
+          def make_storage():
+            return sjb.td.storage.Storage(codec=name, style=style)
+          make_storage().import_dict(_make_dict())
+          fname = make_storage()._get_list_file()
+          with open(fname, 'rb') as f:
+            data = f.read()
+          make_storage().save_list(make_storage().load_list(trusted=True))
+          with open(fname, 'rb') as f:
+            assert f.read() == data
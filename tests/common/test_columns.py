@@ -0,0 +1,86 @@
+import pickle
+import pytest
+import sjb.common.columns as columns
+
+_COLUMNS = (
+  ('oid', columns.INT),
+  ('tags', columns.TAGS),
+  ('text', columns.STRING),
+  ('finished', columns.BOOL),
+  ('date', columns.FLOAT))
+
+
+def _record(oid, tags=('a',), finished=False, date=1.5):
+  return {
+    'oid': oid, 'tags': list(tags), 'text': 'item %d' % oid,
+    'finished': finished, 'date': date}
+
+
+class TestColumnStore(object):
+
+  def test_round_trip(self):
+    store = columns.ColumnStore(_COLUMNS)
+    records = [
+      _record(1),
+      _record(2, tags=(), finished=None, date=None),
+      _record(3, tags=('b', 'a'), finished=True, date=-2.0),
+    ]
+    rows = [store.append(r) for r in records]
+    assert len(store) == 3
+    for row, record in zip(rows, records):
+      assert dict(row) == record
+      assert store.record(row.index) == record
+      assert list(row) == [name for name, _ in _COLUMNS]
+    assert rows[2].tags == ['b', 'a']
+    assert rows[1].finished is None
+    assert rows[1].date is None
+    with pytest.raises(AttributeError):
+      rows[0].missing
+
+  def test_values_not_fitting_columns(self):
+    store = columns.ColumnStore(_COLUMNS)
+    records = [
+      _record(2 ** 70, tags='a', finished=0, date=3),
+      _record(5, tags=['a', 7], finished='yes', date=float('nan')),
+      dict(_record(6), text=None),
+    ]
+    for record in records:
+      assert store.append(record) == record
+    assert store.record(1)['tags'] == ['a', 7]
+    assert store.record(1)['date'] != store.record(1)['date']
+    assert store.record(0)['finished'] == 0
+    assert type(store.record(0)['date']) is int
+
+  def test_records_with_other_fields(self):
+    store = columns.ColumnStore(_COLUMNS)
+    record = _record(1)
+    del record['date']
+    assert store.append(record) is None
+    assert store.append(dict(_record(1), extra=1)) is None
+    assert len(store) == 0
+
+    # The order of the keys does not matter.
+    record = dict(reversed(list(_record(1).items())))
+    assert store.append(record) == record
+
+  def test_tags_are_shared(self):
+    store = columns.ColumnStore(_COLUMNS)
+    rows = [store.append(_record(i, tags=('x', 'y'))) for i in range(1, 4)]
+    assert len(set(id(store._values['tags'][r.index]) for r in rows)) == 1
+    assert store._tag_names == ['x', 'y']
+
+  def test_pickle(self):
+    store = columns.ColumnStore(_COLUMNS)
+    rows = [store.append(_record(i)) for i in range(1, 3)]
+    copied = pickle.loads(pickle.dumps(rows))
+    assert copied[0].store is copied[1].store
+    assert [dict(r) for r in copied] == [dict(r) for r in rows]
+
+  def test_clear(self):
+    store = columns.ColumnStore(_COLUMNS)
+    store.append(_record(1))
+    store.num_dead = 1
+    store.clear()
+    assert len(store) == 0
+    assert store.num_dead == 0
+    assert dict(store.append(_record(2))) == _record(2)
@@ -0,0 +1,147 @@
+import os
+import unittest.mock as mock
+import sjb.common.journal as journal
+import sjb.td.storage
+from sjb.td.classes import Todo, TodoList
+
+
+def _make_list():
+  l = TodoList()
+  l.add_items([
+    Todo('one', oid=1, tags=['a'], created_date=1.0),
+    Todo('two', oid=2, created_date=2.0),
+  ], initial_load=True)
+  return l
+
+
+class TestJournal(object):
+
+  def test_recorder(self):
+    l = _make_list()
+    recorder = journal.Recorder(l)
+    l.update_item(1, text='one again')
+    new = l.add_item(Todo('three'))
+    l.remove_item(2)
+    records = recorder.records()
+    assert [r['op'] for r in records] == ['put', 'put', 'remove', 'commit']
+    assert records[0]['item']['text'] == 'one again'
+    assert records[1]['item']['oid'] == new.oid
+    assert records[2] == {'op': 'remove', 'oid': 2}
+    assert records[3]['modified_date'] == l.modified_date
+    recorder.clear()
+    assert not recorder.has_changes()
+    recorder.close()
+    l.remove_item(1)
+    assert not recorder.has_changes()
+
+  def test_replay(self):
+    l = _make_list()
+    recorder = journal.Recorder(l)
+    l.update_item(1, tags=['b'])
+    l.add_item(Todo('three', tags=['b']))
+    l.remove_item(2)
+    records = recorder.records()
+
+    replayed = _make_list()
+    journal.replay(replayed, records)
+    # Replaying twice gives the same list.
+    journal.replay(replayed, records)
+    assert replayed.to_dict() == l.to_dict()
+    assert replayed.tag_set == {'b'}
+    assert [t.oid for t in replayed.items] == [1, 3]
+
+  def test_read_ignores_uncommitted(self, tmp_path):
+    fname = str(tmp_path / 'list.json.journal')
+    first = [{'op': 'remove', 'oid': 1}, {'op': 'commit', 'modified_date': 1}]
+    size = journal.append(fname, first)
+    with open(fname, 'a') as f:
+      f.write('{"op": "remove", "oid": 2}\n{"op": "rem')
+    assert journal.read(fname) == (first, size)
+
+    second = [{'op': 'remove', 'oid': 3}, {'op': 'commit', 'modified_date': 2}]
+    journal.append(fname, second, committed_size=size)
+    assert journal.read(fname)[0] == first + second
+
+  def test_read_missing(self, tmp_path):
+    assert journal.read(str(tmp_path / 'missing')) == ([], 0)
+
+  def test_needs_compaction(self):
+    assert not journal.needs_compaction(10, 100, 1000)
+    assert journal.needs_compaction(journal.MAX_RECORDS, 100, 1000)
+    assert not journal.needs_compaction(10, journal.MIN_SIZE - 1, 10)
+    assert journal.needs_compaction(10, 10 ** 7, 10 ** 7)
+
+
+class TestJournaledStorage(object):
+
+  def setup_storage(self, tmp_path):
+    patcher = mock.patch.dict(os.environ, {'XDG_DATA_HOME': str(tmp_path)})
+    patcher.start()
+    self.patcher = patcher
+    s = sjb.td.storage.Storage(durability='none')
+    s.save_list(_make_list())
+    return s
+
+  def teardown_method(self, method):
+    if getattr(self, 'patcher', None):
+      self.patcher.stop()
+
+  def test_save_appends_changes(self, tmp_path):
+    s = self.setup_storage(tmp_path)
+    fname = s._get_list_file()
+    with open(fname) as f:
+      snapshot = f.read()
+
+    l = s.load_list()
+    l.complete_item(2)
+    s.save_list(l)
+    l.add_item(Todo('three'))
+    s.save_list(l)
+
+    with open(fname) as f:
+      assert f.read() == snapshot
+    loaded = sjb.td.storage.Storage().load_list(trusted=True)
+    assert loaded.to_dict() == l.to_dict()
+    assert not loaded.modified
+
+  def test_compaction(self, tmp_path):
+    s = self.setup_storage(tmp_path)
+    fname = s._get_list_file()
+    l = s.load_list()
+    with mock.patch.object(journal, 'MAX_RECORDS', 4):
+      l.update_item(1, text='first')
+      s.save_list(l)
+      assert os.path.exists(fname + '.journal')
+      l.update_item(1, text='second')
+      s.save_list(l)
+    assert not os.path.exists(fname + '.journal')
+    assert os.path.exists(fname + '.backup')
+    loaded = sjb.td.storage.Storage().load_list()
+    assert loaded.get_item(1).text == 'second'
+
+  def test_save_other_list_rewrites_file(self, tmp_path):
+    s = self.setup_storage(tmp_path)
+    l = s.load_list()
+    l.remove_item(1)
+    s.save_list(l)
+    other = TodoList()
+    other.add_item(Todo('only'))
+    s.save_list(other)
+    loaded = sjb.td.storage.Storage().load_list()
+    assert [t.text for t in loaded.items] == ['only']
+
+  def test_save_journals_fields_assigned_directly(self, tmp_path):
+    s = self.setup_storage(tmp_path)
+    for lazy in [False, True]:
+      l = s.load_list(lazy=lazy)
+      l.get_item(2).text = 'changed %s' % lazy
+      l.get_item(2).tags = {'b'}
+      s.save_list(l)
+      assert os.path.exists(s._get_journal_file())
+      loaded = sjb.td.storage.Storage().load_list()
+      assert loaded.get_item(2).text == 'changed %s' % lazy
+      assert loaded.lookup('tags', 'b') == {2}
+    l = s.load_items([range(1, 2)])
+    l.get_item(1).text = 'partial'
+    s.save_list(l)
+    assert sjb.td.storage.Storage().load_list().get_item(1).text == 'partial'
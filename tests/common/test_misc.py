@@ -0,0 +1,33 @@
+import argparse
+import pytest
+import sjb.common.misc as misc
+
+
+class TestOidRangeArg(object):
+
+  def test_single(self):
+    assert list(misc.oid_range_arg('12')) == [12]
+
+  def test_range(self):
+    assert list(misc.oid_range_arg('10-13')) == [10, 11, 12, 13]
+    assert list(misc.oid_range_arg('4-4')) == [4]
+
+  def test_invalid(self):
+    for arg in ['', 'a', '5-', '-', '7-3', '1-2-3', '1,2']:
+      with pytest.raises(argparse.ArgumentTypeError):
+        misc.oid_range_arg(arg)
+
+
+class TestIntArgs(object):
+
+  def test_positive(self):
+    assert misc.positive_int_arg('3') == 3
+    for arg in ['0', '-1', 'x', '']:
+      with pytest.raises(argparse.ArgumentTypeError):
+        misc.positive_int_arg(arg)
+
+  def test_non_negative(self):
+    assert misc.non_negative_int_arg('0') == 0
+    for arg in ['-1', '1.5']:
+      with pytest.raises(argparse.ArgumentTypeError):
+        misc.non_negative_int_arg(arg)
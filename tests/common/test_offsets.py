@@ -0,0 +1,134 @@
+import json
+import os
+import unittest.mock as mock
+import sjb.common.codec as codec
+import sjb.common.journal as journal
+import sjb.common.offsets as offsets
+import sjb.common.storage
+import sjb.td.storage
+from sjb.td.classes import Todo, TodoList
+
+
+def _make_list():
+  l = TodoList(version='0.1', modified_date=5.0)
+  l.add_items([
+    Todo('one', oid=1, priority=1, tags=['a', 'b'], created_date=3.0),
+    Todo('{"oid": 9} }]}', oid=2, priority=2, tags=['a'], finished=True,
+         created_date=1.0, finished_date=4.0),
+    Todo('thrée', oid=3, priority=1, tags=['c'], created_date=2.0),
+    Todo('four', oid=5, priority=3, tags=['a', 'c'], created_date=0.5),
+  ], initial_load=True)
+  return l
+
+
+class TestScan(object):
+
+  def test_scan(self):
+    l = _make_list()
+    records = l.to_dict()['todo_list']['todos']
+    for name in codec.available_codecs():
+      for style in codec.STYLE_CHOICES:
+        data = b''.join(
+          codec.get_codec(name).encode(l.to_dict(), style=style))
+        entries = offsets.scan(data)
+        assert [entry[0] for entry in entries] == [1, 2, 3, 5]
+        for (_, offset, length), record in zip(entries, records):
+          assert json.loads(data[offset:offset + length]) == record
+
+  def test_scan_empty_and_bad(self):
+    assert offsets.scan(json.dumps(TodoList().to_dict()).encode()) == []
+    assert offsets.scan(b'{"todo_list": {"todos": [{"oid": 1}]}, "x": 1}') is None
+
+
+class TestLoadItems(object):
+
+  def setup_storage(self, tmp_path):
+    patcher = mock.patch.dict(os.environ, {
+      'XDG_DATA_HOME': str(tmp_path), sjb.common.storage.ENV_ARCHIVE_DAYS: '0'})
+    patcher.start()
+    self.patcher = patcher
+    s = sjb.td.storage.Storage()
+    s.save_list(_make_list())
+    return s
+
+  def teardown_method(self, method):
+    if getattr(self, 'patcher', None):
+      self.patcher.stop()
+
+  def load_items(self, oid_ranges):
+    s = sjb.td.storage.Storage()
+    with mock.patch.object(s, 'load_list', wraps=s.load_list) as load_list:
+      lst = s.load_items(oid_ranges)
+    return s, lst, load_list.called
+
+  def test_reads_only_selected_items(self, tmp_path):
+    self.setup_storage(tmp_path)
+    _, lst, full = self.load_items([range(2, 3), range(4, 10)])
+    assert not full
+    assert [t.oid for t in lst.items] == [2, 5]
+    assert lst.get_item(2).text == '{"oid": 9} }]}'
+    assert lst.modified_date == 5.0
+    assert lst.version == '0.1'
+
+  def test_changes_are_journaled(self, tmp_path):
+    s = self.setup_storage(tmp_path)
+    with open(s._get_list_file(), 'rb') as f:
+      snapshot = f.read()
+    s, lst, _ = self.load_items([range(3, 4)])
+    lst.update_item(3, text='three')
+    added = lst.add_item(Todo('six'))
+    assert added.oid == 6
+    s.save_list(lst)
+    lst.remove_item(3)
+    s.save_list(lst)
+    with open(s._get_list_file(), 'rb') as f:
+      assert f.read() == snapshot
+
+    full = sjb.td.storage.Storage().load_list()
+    assert [t.oid for t in full.items] == [1, 2, 5, 6]
+    s, lst, full = self.load_items([range(1, 10)])
+    assert not full
+    assert [t.oid for t in lst.items] == [1, 2, 5, 6]
+
+  def test_compaction_keeps_other_items(self, tmp_path):
+    self.setup_storage(tmp_path)
+    s, lst, _ = self.load_items([range(1, 2)])
+    with mock.patch.object(journal, 'MAX_RECORDS', 4):
+      lst.update_item(1, text='first')
+      s.save_list(lst)
+      lst.update_item(1, text='second')
+      s.save_list(lst)
+      assert not os.path.exists(s._get_journal_file())
+      lst.update_item(1, text='third')
+      s.save_list(lst)
+    full = sjb.td.storage.Storage().load_list()
+    assert [t.oid for t in full.items] == [1, 2, 3, 5]
+    assert full.get_item(1).text == 'third'
+    _, lst, full = self.load_items([range(1, 2)])
+    assert not full
+    assert lst.get_item(1).text == 'third'
+
+  def test_stale_or_bad_index_loads_whole_list(self, tmp_path):
+    s = self.setup_storage(tmp_path)
+    fname = s._get_list_file()
+    with open(fname, 'ab') as f:
+      f.write(b'\n')
+    _, lst, full = self.load_items([range(1, 2)])
+    assert full
+    assert lst.size() == 4
+
+    s.save_list(_make_list())
+    with open(s._get_offsets_file(), 'r+b') as f:
+      f.seek(-16, os.SEEK_END)
+      f.write(b'\0' * 8)
+    _, lst, full = self.load_items([range(5, 6)])
+    assert full
+    assert lst.size() == 4
+
+  def test_other_backends_load_whole_list(self, tmp_path):
+    self.setup_storage(tmp_path)
+    s = sjb.td.storage.get_storage(
+      backend=sjb.common.storage.BACKEND_BINARY, listname='binary')
+    s.save_list(_make_list())
+    assert not os.path.exists(s._get_offsets_file())
+    assert s.load_items([range(1, 2)]).size() == 4
@@ -0,0 +1,216 @@
+import unittest.mock as mock
+import sjb.common.query as query
+import sjb.cs.classes
+import sjb.td.classes
+from sjb.td.classes import Todo, TodoList
+
+
+def _make_list():
+  l = TodoList()
+  l.add_items([
+    Todo('one', oid=1, priority=1, tags=['a', 'b']),
+    Todo('two', oid=2, priority=2, tags=['a'], finished=True),
+    Todo('three', oid=3, priority=1, tags=['c']),
+    Todo('four', oid=4, priority=3, tags=['a', 'c']),
+    Todo('Five', oid=5, priority=2),
+  ], initial_load=True)
+  return l
+
+
+def _oids(items):
+  return [item.oid for item in items]
+
+
+class TestMatchers(object):
+
+  def test_tag(self):
+    l = _make_list()
+    assert _oids(l.query_items(query.Tag('a'))) == [1, 2, 4]
+    assert _oids(l.query_items(query.Tag('missing'))) == []
+
+  def test_field(self):
+    l = _make_list()
+    assert _oids(l.query_items(query.Priority(2))) == [2, 5]
+    assert _oids(l.query_items(query.Finished())) == [2]
+
+  def test_text(self):
+    l = _make_list()
+    assert _oids(l.query_items(query.Text('f'))) == [4, 5]
+
+  def test_date_range(self):
+    l = TodoList()
+    l.add_items([
+      Todo('one', oid=1, created_date=10.0),
+      Todo('two', oid=2, created_date=20.0),
+      Todo('three', oid=3, created_date=30.0),
+      Todo('four', oid=4),
+    ], initial_load=True)
+    m = query.DateRange('created_date', 15.0, 30.0)
+    assert _oids(l.query_items(m)) == [2]
+    m = query.DateRange('created_date', start=20.0)
+    assert _oids(l.query_items(m)) == [2, 3]
+    assert m.plan(l) == ({2, 3}, None)
+
+  def test_combinators(self):
+    l = _make_list()
+    assert _oids(l.query_items(query.Tag('a') & query.Tag('c'))) == [4]
+    assert _oids(l.query_items(query.Tag('b') | query.Tag('c'))) == [1, 3, 4]
+    assert _oids(l.query_items(~query.Tag('a'))) == [3, 5]
+    m = query.Tag('a') & ~query.Tag('c') & query.Priority(1)
+    assert _oids(l.query_items(m)) == [1]
+    m = (query.Tag('c') | query.Text('five')) & ~query.Finished()
+    assert _oids(l.query_items(m)) == [3, 4, 5]
+
+  def test_empty_combinators(self):
+    l = _make_list()
+    assert _oids(l.query_items(query.And())) == [1, 2, 3, 4, 5]
+    assert _oids(l.query_items(query.Or())) == []
+    assert _oids(l.query_items(query.All())) == [1, 2, 3, 4, 5]
+
+  def test_could_match(self):
+    summary = query.Summary('finished_date', 10.0, 20.0, {'a', 'b'})
+    assert query.Tag('a').could_match(summary)
+    assert not query.Tag('c').could_match(summary)
+    assert query.Tag('c', fields=('tags', 'clue')).could_match(summary)
+    assert query.DateRange('finished_date', 20.0).could_match(summary)
+    assert not query.DateRange('finished_date', 20.5).could_match(summary)
+    assert not query.DateRange('finished_date', None, 10.0).could_match(summary)
+    assert query.DateRange('created_date', 30.0).could_match(summary)
+    assert not (query.Tag('a') & query.Tag('c')).could_match(summary)
+    assert (query.Tag('a') | query.Tag('c')).could_match(summary)
+    assert (~query.Tag('a')).could_match(summary)
+    assert query.Text('x').could_match(summary)
+
+
+class TestPlan(object):
+
+  def test_tag_plan_is_exact(self):
+    l = _make_list()
+    assert query.Tag('c').plan(l) == ({3, 4}, None)
+
+  def test_unindexed_field_is_residual(self):
+    l = _make_list()
+    m = query.Field('text', 'one')
+    assert m.plan(l) == (None, m)
+
+  def test_and_intersects_and_keeps_residual(self):
+    l = _make_list()
+    text = query.Text('o')
+    oids, residual = query.And(text, query.Tag('a'), query.Tag('b')).plan(l)
+    assert oids == {1}
+    assert residual is text
+
+  def test_and_not_tag_uses_tag_index(self):
+    l = _make_list()
+    m = query.And(query.Tag('a'), query.Not(query.Tag('c')))
+    with mock.patch.object(
+        l, 'oids_with_tags', wraps=l.oids_with_tags) as oids_with_tags:
+      assert m.plan(l) == ({1, 2}, None)
+    oids_with_tags.assert_called_once_with(all_of=['a'], none_of=['c'])
+
+  def test_and_skips_large_lookup(self):
+    l = TodoList()
+    l.add_items(
+      [Todo('x', oid=i, tags=['common']) for i in range(1, 101)] +
+      [Todo('y', oid=101, tags=['common', 'rare'])], initial_load=True)
+    cheap = query.Tag('rare')
+    common = mock.Mock(wraps=query.Field('text', 'y'))
+    common.cost = 1
+    common.estimate.return_value = 101
+    oids, residual = query.And(common, cheap).plan(l)
+    assert oids == {101}
+    assert residual is common
+    common.plan.assert_not_called()
+
+  def test_or_with_unindexed_operand_scans(self):
+    l = _make_list()
+    m = query.Or(query.Tag('a'), query.Text('three'))
+    assert m.plan(l) == (None, m)
+
+  def test_not_of_residual_scans(self):
+    l = _make_list()
+    m = query.Not(query.Text('o'))
+    assert m.plan(l) == (None, m)
+
+  def test_matches_only_called_on_candidates(self):
+    l = _make_list()
+    m = query.Tag('c') & query.Text('three')
+    with mock.patch.object(
+        query.Text, 'matches', autospec=True,
+        side_effect=query.Text.matches) as matches:
+      assert _oids(l.query_items(m)) == [3]
+    assert matches.call_count == 2
+
+  def test_cheatsheet_tags_cover_primary(self):
+    cs = sjb.cs.classes.CheatSheet()
+    cs.add_item(sjb.cs.classes.Entry('c', 'a', 'p', {'t'}))
+    fields = ('tags', 'primary')
+    assert query.Tag('p', fields=fields).plan(cs) == ({1}, None)
+    m = query.Tag('p')
+    assert m.plan(cs) == (None, m)
+    assert cs.query_items(m) == []
+
+  def test_todo_matcher_plan(self):
+    l = _make_list()
+    matcher = sjb.td.classes.TodoMatcher(
+      tags=['a'], exclude_tags=['b'], finished=False)
+    oids, residual = matcher.plan(l)
+    assert oids == {4}
+    assert residual is None
+    assert _oids(l.query_items(matcher)) == [4]
+
+
+class TestQueryCache(object):
+
+  def test_signature(self):
+    assert query.Tag('a').signature() == query.Tag('a').signature()
+    assert query.Tag('a').signature() != query.Tag('b').signature()
+    assert (query.Tag('a') & query.Priority(1)).signature() == (
+      query.Priority(1) & query.Tag('a')).signature()
+    assert (query.Tag('a') & query.Tag('b')).signature() != (
+      query.Tag('a') | query.Tag('b')).signature()
+    assert sjb.td.classes.TodoMatcher(tags={'a', 'b'}).signature() == (
+      sjb.td.classes.TodoMatcher(tags={'b', 'a'}).signature())
+
+  def test_unsigned_operand_is_not_cached(self):
+    class Unsigned(query.Matcher):
+      def matches(self, item):
+        return True
+      def signature(self):
+        return None
+    assert query.And(query.Tag('a'), Unsigned()).signature() is None
+    assert query.Not(Unsigned()).signature() is None
+
+  def test_repeated_query_is_cached(self):
+    l = _make_list()
+    m = query.Tag('a') & query.Text('o')
+    first = l.query_items(m)
+    with mock.patch.object(query.And, 'plan') as plan:
+      again = l.query_items(query.Text('o') & query.Tag('a'))
+    assert plan.call_count == 0
+    assert again == first
+    again.append(None)
+    assert l.query_items(m) == first
+
+  def test_changes_invalidate_cache(self):
+    l = _make_list()
+    m = query.Tag('a')
+    generation = l.generation
+    assert _oids(l.query_items(m)) == [1, 2, 4]
+    l.update_item(3, tags=['a'])
+    assert l.generation > generation
+    assert _oids(l.query_items(m)) == [1, 2, 3, 4]
+    l.remove_item(1)
+    assert _oids(l.query_items(m)) == [2, 3, 4]
+    l.add_item(Todo('new', tags=['a']))
+    assert _oids(l.query_items(m)) == [2, 3, 4, 6]
+    generation = l.generation
+    l.update_item(3, tags=['a'])
+    assert l.generation == generation
+
+  def test_cache_size_is_bounded(self):
+    l = _make_list()
+    l.QUERY_CACHE_SIZE = 2
+    for tag in ['a', 'b', 'c', 'a']:
+      l.query_items(query.Tag(tag))
+    assert len(l._query_cache) == 2
@@ -0,0 +1,141 @@
+import os
+import pickle
+import unittest.mock as mock
+import sjb.common.snapshot as snapshot
+import sjb.common.storage
+import sjb.cs.classes
+import sjb.cs.storage
+import sjb.td.storage
+from sjb.td.classes import Todo, TodoList
+
+
+def _make_list():
+  l = TodoList(version='0.1', modified_date=5.0)
+  l.add_items([
+    Todo('one', oid=1, priority=1, tags=['a', 'b'], created_date=3.0),
+    Todo('two', oid=2, priority=2, tags=['a'], finished=True,
+         created_date=1.0, finished_date=4.0),
+    Todo('three', oid=3, priority=1, tags=['c'], created_date=2.0),
+  ], initial_load=True)
+  return l
+
+
+class TestSnapshot(object):
+
+  def setup_storage(self, tmp_path):
+    patchers = [
+      mock.patch.dict(os.environ, {
+        'XDG_DATA_HOME': str(tmp_path / 'data'),
+        'XDG_CACHE_HOME': str(tmp_path / 'cache'),
+        sjb.common.storage.ENV_ARCHIVE_DAYS: '0'}),
+      mock.patch.object(snapshot, 'MIN_SIZE', 0),
+    ]
+    for patcher in patchers:
+      patcher.start()
+    self.patchers = patchers
+    s = sjb.td.storage.Storage()
+    s.save_list(_make_list())
+    return s
+
+  def teardown_method(self, method):
+    for patcher in getattr(self, 'patchers', []):
+      patcher.stop()
+
+  def load(self, lazy=False):
+    s = sjb.td.storage.Storage()
+    with mock.patch.object(
+        s, '_list_from_dict', wraps=s._list_from_dict) as parse:
+      lst = s.load_list(lazy=lazy, trusted=True)
+    return lst, parse.called
+
+  def test_item_pickle(self):
+    t = Todo('one', oid=1, priority=1, tags=['a'], created_date=3.0)
+    loaded = pickle.loads(pickle.dumps(t))
+    assert loaded == t
+    assert loaded.changed_fields == {}
+    loaded.text = 'other'
+    assert loaded.changed_fields == {'text': 'one'}
+
+  def test_snapshot_is_used(self, tmp_path):
+    s = self.setup_storage(tmp_path)
+    lst, parsed = self.load()
+    assert parsed
+    assert os.path.exists(s._get_snapshot_file())
+    assert s._get_snapshot_file().startswith(str(tmp_path / 'cache'))
+    for lazy in [False, True]:
+      lst, parsed = self.load(lazy=lazy)
+      assert not parsed
+      assert lst.to_dict() == _make_list().to_dict()
+      assert lst.lookup('tags', 'a') == {1, 2}
+      assert lst.add_item(Todo('four')).oid == 4
+
+  def test_changed_file_is_parsed(self, tmp_path):
+    s = self.setup_storage(tmp_path)
+    self.load()
+    l = _make_list()
+    l.remove_item(3)
+    s.save_list(l)
+    lst, parsed = self.load()
+    assert parsed
+    assert lst.to_dict() == l.to_dict()
+    lst, parsed = self.load()
+    assert not parsed
+
+    # Same size and mtime, but other contents.
+    fname = s._get_list_file()
+    st = os.stat(fname)
+    with open(fname, 'r') as f:
+      data = f.read()
+    with open(fname, 'w') as f:
+      f.write(data.replace('"one"', '"eno"'))
+    os.utime(fname, ns=(st.st_atime_ns, st.st_mtime_ns))
+    lst, parsed = self.load()
+    assert parsed
+    assert lst.get_item(1).text == 'eno'
+
+  def test_corrupt_snapshot_is_rebuilt(self, tmp_path):
+    s = self.setup_storage(tmp_path)
+    self.load()
+    with open(s._get_snapshot_file(), 'r+b') as f:
+      f.truncate(os.path.getsize(s._get_snapshot_file()) // 2)
+    lst, parsed = self.load()
+    assert parsed
+    assert lst.to_dict() == _make_list().to_dict()
+    assert not self.load()[1]
+
+    with open(s._get_snapshot_file(), 'wb') as f:
+      f.write(b'garbage')
+    assert self.load()[0].to_dict() == _make_list().to_dict()
+
+  def test_small_files_are_not_cached(self, tmp_path):
+    s = self.setup_storage(tmp_path)
+    with mock.patch.object(snapshot, 'MIN_SIZE', 10 ** 6):
+      self.load()
+    assert not os.path.exists(s._get_snapshot_file())
+
+  def test_no_digest_without_snapshot(self, tmp_path):
+    self.setup_storage(tmp_path)
+    s = sjb.td.storage.Storage()
+    with mock.patch.object(snapshot, 'MIN_SIZE', 10 ** 6), mock.patch.object(
+        sjb.common.storage.hashlib, 'sha256') as sha256:
+      s.load_list()
+    assert not sha256.called
+
+  def test_mapped_lists_are_not_cached(self, tmp_path):
+    self.setup_storage(tmp_path)
+    s = sjb.td.storage.get_storage(
+      backend=sjb.common.storage.BACKEND_BINARY, listname='binary')
+    s.save_list(_make_list())
+    assert s.load_list(lazy=True).to_dict() == _make_list().to_dict()
+    assert not os.path.exists(s._get_snapshot_file())
+
+  def test_cheatsheet(self, tmp_path):
+    self.setup_storage(tmp_path)
+    cs = sjb.cs.classes.CheatSheet(modified_date=1.0)
+    cs.add_item(sjb.cs.classes.Entry('clue', 'answer', 'p', {'t', 'u'}))
+    sjb.cs.storage.Storage().save_list(cs)
+    sjb.cs.storage.Storage().load_list()
+    s = sjb.cs.storage.Storage()
+    with mock.patch.object(s, '_list_from_dict') as parse:
+      assert s.load_list().to_dict() == cs.to_dict()
+    assert not parse.called
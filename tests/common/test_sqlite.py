@@ -0,0 +1,157 @@
+import os
+import unittest.mock as mock
+import pytest
+import sjb.common.query as query
+import sjb.common.sqlite
+import sjb.common.storage
+import sjb.cs.classes
+import sjb.cs.storage
+import sjb.td.storage
+from sjb.td.classes import Todo, TodoList, TodoMatcher
+
+
+def _make_list():
+  l = TodoList(version='0.1', modified_date=5.0)
+  l.add_items([
+    Todo('one', oid=1, priority=1, tags=['a', 'b'], created_date=3.0),
+    Todo('two', oid=2, priority=2, tags=['a'], finished=True,
+         created_date=1.0, finished_date=4.0),
+    Todo('three', oid=3, priority=1, tags=['c'], created_date=2.0),
+    Todo('four', oid=4, priority=3, tags=['a', 'c'], created_date=0.5),
+    Todo('Five', oid=5, priority=2, created_date=2.0),
+  ], initial_load=True)
+  return l
+
+
+def _oids(items):
+  return [item.oid for item in items]
+
+
+class TestSqliteStorage(object):
+
+  def setup_method(self, method):
+    self.patcher = None
+
+  def teardown_method(self, method):
+    if self.patcher is not None:
+      self.patcher.stop()
+
+  def make_storage(self, tmp_path, backend=sjb.common.storage.BACKEND_SQLITE):
+    if self.patcher is None:
+      self.patcher = mock.patch.dict(
+        os.environ, {'XDG_DATA_HOME': str(tmp_path)})
+      self.patcher.start()
+    return sjb.td.storage.get_storage(backend=backend)
+
+  def test_import_export_is_lossless(self, tmp_path):
+    s = self.make_storage(tmp_path)
+    json_dict = _make_list().to_dict()
+    s.import_dict(json_dict)
+    assert self.make_storage(tmp_path).export_dict() == json_dict
+
+  def test_cheatsheet_import_export_is_lossless(self, tmp_path):
+    self.make_storage(tmp_path)
+    cs = sjb.cs.classes.CheatSheet(modified_date=1.0)
+    cs.add_item(sjb.cs.classes.Entry('clue', 'answer', 'p', {'t', 'u'}))
+    cs.add_item(sjb.cs.classes.Entry('other', 'answer', 'q', set()))
+    s = sjb.cs.storage.get_storage(backend=sjb.common.storage.BACKEND_SQLITE)
+    s.import_dict(cs.to_dict())
+    assert sjb.cs.storage.SqliteStorage().export_dict() == cs.to_dict()
+
+  def test_missing_list(self, tmp_path):
+    s = self.make_storage(tmp_path)
+    with pytest.raises(sjb.common.storage.NoListFileError):
+      s.load_list()
+    assert not s.exists()
+
+  def test_save_writes_changed_rows(self, tmp_path):
+    s = self.make_storage(tmp_path)
+    s.save_list(_make_list())
+    s = self.make_storage(tmp_path)
+    l = s.load_list()
+    l.update_item(3, text='three again')
+    l.remove_item(2)
+    new = l.add_item(Todo('six', tags=['a']))
+    with mock.patch.object(
+        s, '_apply_record', wraps=s._apply_record) as apply_record:
+      s.save_list(l)
+    assert apply_record.call_count == 4
+    assert self.make_storage(tmp_path).export_dict() == l.to_dict()
+    assert _oids(s.query_items()) == [1, 3, 4, 5, new.oid]
+
+  def test_save_writes_fields_assigned_directly(self, tmp_path):
+    s = self.make_storage(tmp_path)
+    s.save_list(_make_list())
+    s = self.make_storage(tmp_path)
+    l = s.load_list()
+    l.get_item(2).text = 'changed'
+    s.save_list(l)
+    loaded = self.make_storage(tmp_path).load_list()
+    assert loaded.get_item(2).text == 'changed'
+
+  def test_saving_other_list_keeps_recorded_changes(self, tmp_path):
+    s = self.make_storage(tmp_path)
+    s.save_list(_make_list())
+    s = self.make_storage(tmp_path)
+    l = s.load_list()
+    l.update_item(3, text='changed')
+    s.save_list(_make_list())
+    s.save_list(l)
+    loaded = self.make_storage(tmp_path).load_list()
+    assert loaded.get_item(3).text == 'changed'
+
+  def test_query_matches_list(self, tmp_path):
+    s = self.make_storage(tmp_path)
+    l = _make_list()
+    s.save_list(l)
+    cs_tags = ('tags', 'primary')
+    matchers = [
+      None,
+      query.Tag('a'),
+      query.Tag('a') & ~query.Tag('c'),
+      query.Tag('b') | query.Priority(3),
+      query.Finished(False) & query.Priority(1),
+      query.DateRange('created_date', 2.0, 3.0),
+      ~query.DateRange('created_date', start=2.0),
+      query.Tag('a') & query.Text('o'),
+      TodoMatcher(tags={'a'}, finished=False),
+    ]
+    for m in matchers:
+      expected = _oids(l.iter_items(m))
+      assert _oids(s.query_items(m)) == expected
+      assert _oids(s.query_items(m, limit=2, offset=1)) == expected[1:3]
+
+  def test_query_is_pushed_down(self, tmp_path):
+    s = self.make_storage(tmp_path)
+    where, params, residual = sjb.common.sqlite._translate(
+      TodoMatcher(tags={'a'}, priority=1, finished=False), s)
+    assert residual is None
+    assert sorted(params, key=str) == [1, False, 'a']
+    text = query.Text('o')
+    where, params, residual = sjb.common.sqlite._translate(
+      query.Tag('a') & text, s)
+    assert residual is text
+
+  def test_sorted_query_matches_list(self, tmp_path):
+    s = self.make_storage(tmp_path)
+    l = _make_list()
+    s.save_list(l)
+    for field in ['priority', 'created_date', 'finished_date']:
+      expected = _oids(l.sorted_items(field))
+      assert _oids(s.query_items(sort_field=field)) == expected
+      assert _oids(s.query_items(sort_field=field, limit=2)) == expected[:2]
+
+  def test_get_storage_finds_backend(self, tmp_path):
+    json_storage = self.make_storage(
+      tmp_path, backend=sjb.common.storage.BACKEND_JSON)
+    assert isinstance(self.make_storage(tmp_path, backend=None),
+                      sjb.td.storage.Storage)
+    json_storage.save_list(_make_list())
+    assert isinstance(self.make_storage(tmp_path, backend=None),
+                      sjb.td.storage.Storage)
+    self.make_storage(tmp_path).save_list(_make_list())
+    assert isinstance(self.make_storage(tmp_path, backend=None),
+                      sjb.td.storage.SqliteStorage)
+    assert sjb.td.storage.get_all_list_files() == ['todo']
+    with pytest.raises(ValueError):
+      self.make_storage(tmp_path, backend='csv')
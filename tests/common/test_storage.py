@@ -0,0 +1,83 @@
+import hashlib
+import os
+import unittest.mock as mock
+import pytest
+import sjb.common.storage as storage
+
+
+class TestAtomicWrite(object):
+
+  def test_write_new(self, tmp_path):
+    fname = str(tmp_path / 'list.json')
+    storage.atomic_write(fname, 'data', durability=storage.DURABILITY_NONE)
+    with open(fname) as f:
+      assert f.read() == 'data'
+    assert os.listdir(str(tmp_path)) == ['list.json']
+
+  def test_backup_is_linked_not_copied(self, tmp_path):
+    fname = str(tmp_path / 'list.json')
+    storage.atomic_write(fname, 'old')
+    os.chmod(fname, 0o640)
+    inode = os.stat(fname).st_ino
+    storage.atomic_write(fname, 'new', backup_extension='.backup')
+    assert os.stat(fname + '.backup').st_ino == inode
+    with open(fname + '.backup') as f:
+      assert f.read() == 'old'
+    with open(fname) as f:
+      assert f.read() == 'new'
+    assert os.stat(fname).st_mode & 0o777 == 0o640
+
+  def test_backup_renamed_without_links(self, tmp_path):
+    fname = str(tmp_path / 'list.json')
+    storage.atomic_write(fname, 'old')
+    with mock.patch.object(os, 'link', side_effect=OSError()):
+      storage.atomic_write(fname, 'new', backup_extension='.backup')
+    with open(fname + '.backup') as f:
+      assert f.read() == 'old'
+
+  def test_failed_write_keeps_old_version(self, tmp_path):
+    fname = str(tmp_path / 'list.json')
+    storage.atomic_write(fname, 'old')
+    with mock.patch.object(os, 'replace', side_effect=OSError()):
+      with pytest.raises(OSError):
+        storage.atomic_write(fname, 'new')
+    with open(fname) as f:
+      assert f.read() == 'old'
+    assert os.listdir(str(tmp_path)) == ['list.json']
+
+  def test_write_chunks(self, tmp_path):
+    fname = str(tmp_path / 'list.json')
+    checksum = hashlib.sha256()
+    storage.atomic_write(
+      fname, iter(['da', b'ta', memoryview(b'!')]), checksum=checksum)
+    with open(fname, 'rb') as f:
+      data = f.read()
+    assert data == b'data!'
+    assert checksum.hexdigest() == hashlib.sha256(data).hexdigest()
+
+  def test_durability_syncs(self, tmp_path):
+    fname = str(tmp_path / 'list.json')
+    for durability, calls in [('none', 0), ('file', 1), ('dir', 2)]:
+      with mock.patch.object(os, 'fsync') as fsync:
+        storage.atomic_write(fname, b'data', durability=durability)
+      assert fsync.call_count == calls
+
+  def test_durability_config(self):
+    with mock.patch.dict(os.environ, {storage.ENV_DURABILITY: 'dir'}):
+      assert storage.get_durability() == storage.DURABILITY_DIR
+    assert storage.get_durability('none') == storage.DURABILITY_NONE
+    with pytest.raises(ValueError):
+      storage.get_durability('always')
+
+
+class TestChecksum(object):
+
+  def test_matches(self, tmp_path):
+    fname = str(tmp_path / 'list.json')
+    storage.write_checksum(fname, '{"a": 1}', '.sha256')
+    assert storage.checksum_matches(fname, '{"a": 1}', '.sha256')
+    assert not storage.checksum_matches(fname, '{"a": 2}', '.sha256')
+
+  def test_missing(self, tmp_path):
+    fname = str(tmp_path / 'list.json')
+    assert not storage.checksum_matches(fname, '{}', '.sha256')
@@ -328,6 +328,16 @@ class TestCheatSheet(object):
     assert l.modified
     assert l.modified_date == MOCK_TIME
 
+  def test_change_events(self):
+    l = CheatSheet()
+    l.add_item(Entry('clue', 'answer', 'p', {'t'}))
+    events = []
+    l.subscribe(events.append)
+    l.update_item(1, primary='q', tags={'t'})
+    l.remove_item(1)
+    assert [(e.kind, e.changes) for e in events] == [
+      (base.ITEM_CHANGED, {'primary': ('p', 'q')}), (base.ITEM_REMOVED, {})]
+
   @mock.patch('time.time', mock_time)
   def test_update_item_tags(self):
     init = [
@@ -468,6 +478,38 @@ class TestCheatSheet(object):
     for ind in exp:
       assert init[ind] in ret
 
+  def test_query_tag_result_order(self):
+    init = [
+      Entry('c1', 'a1', 'p1', tags={'a', 'b'}, oid=5),
+      Entry('c1', 'a1', 'b', tags={'a'}, oid=1),
+      Entry('c1', 'a1', 'a', tags=set(), oid=11),
+      Entry('c1', 'a1', 'p1', tags={'dog'}, oid=10),
+    ]
+    l = CheatSheet()
+    for i in init: l.add_item(i, initial_load=True)
+    ret = l.query_items(EntryMatcherTags({'a', 'b'}, sjb.cs.classes.SEARCH_OR))
+    assert ret == init[0:3]
+    ret = l.query_items(EntryMatcherTags({'a', 'zebra'}, sjb.cs.classes.SEARCH_AND))
+    assert ret == []
+
+  def test_bulk_operations(self):
+    l = CheatSheet()
+    added = l.add_items([
+      Entry('c1', 'a1', 'p1', tags={'a'}),
+      Entry('c2', 'a2', 'p1', tags={'b'}),
+      Entry('c3', 'a3', 'p2', tags={'a'})])
+    assert [e.oid for e in added] == [1, 2, 3]
+    assert l.primary_set == {'p1', 'p2'}
+
+    l.update_items([1, 2], primary='p3')
+    assert l.primary_set == {'p2', 'p3'}
+    removed = l.remove_items([3, 1])
+    assert [e.clue for e in removed] == ['c3', 'c1']
+    assert l.tag_set == {'b', 'p3'}
+    with pytest.raises(base.InvalidIDError):
+      l.remove_items([2, 3])
+    assert l.size() == 1
+
   def test_validate_new_item(self):
     l = CheatSheet()
     l.add_item(Entry(clue='clue', answer='answer', primary='prim', tags=set()))
@@ -581,6 +623,21 @@ class TestCheatSheet(object):
     l.remove_item(3)
     assert 'p3' not in l.primary_map
 
+  def test_primary_map_update(self):
+    l = CheatSheet()
+    i1 = l.add_item(Entry(clue='c', answer='a', primary='p1', tags={'a'}))
+    i2 = l.add_item(Entry(clue='c', answer='a', primary='p1', tags={'b'}))
+
+    l.update_item(1, primary='p2', tags={'p1'})
+    assert l.primary_map == {'p1': [i2], 'p2': [i1]}
+    assert l.primary_set == {'p1', 'p2'}
+    assert l.tag_set == {'p1', 'p2', 'b'}
+    l.update_item(2, primary='p2')
+    assert l.primary_set == {'p2'}
+    assert l.tag_set == {'p1', 'p2', 'b'}
+    l.remove_item(1)
+    assert l.tag_set == {'p2', 'b'}
+
   @mock.patch('time.time', mock_time)
   def test_to_dict(self):
     l = CheatSheet(version='version str', modified_date=1234.1234)
@@ -663,6 +720,30 @@ class TestCheatSheet(object):
       assert t in exp_items
     assert l.tag_set == {'p1','p2','p4','p5','a','b','c','d'}
 
+  def test_from_dict_lazy(self):
+    d = {'cheatsheet': {
+      'version': 'version str',
+      'modified_date': 1234.1234,
+      'entries': [{
+        'oid': 2,
+        'clue': 'c1', 'answer': 'a1', 'primary': 'p1', 'tags': ['a', 'b'],
+      },{
+        'oid': 1,
+        'clue': 'c2', 'answer': 'a2', 'primary': 'p2', 'tags': ['a']
+      },{
+        'oid': 11,
+        'clue': 'c3', 'answer': 'a3', 'primary': 'p2', 'tags': []
+      }]}}
+    l = CheatSheet.from_dict(d, lazy=True)
+    assert l.tag_set == {'p1', 'p2', 'a', 'b'}
+    assert l.primary_set == {'p1', 'p2'}
+    ret = l.query_items(EntryMatcherTags({'b'}))
+    assert ret == [Entry('c1', 'a1', 'p1', tags={'a', 'b'}, oid=2)]
+    assert [e.oid for e in l.primary_map['p2']] == [1, 11]
+    l.update_item(11, primary='p3')
+    assert l.primary_set == {'p1', 'p2', 'p3'}
+    assert l.to_dict() == CheatSheet.from_dict(l.to_dict()).to_dict()
+
   def test_entry_matcher_bad_andor(self):
     with pytest.raises(base.IllegalStateError):
       EntryMatcherTags({'a'}, andor=14)
@@ -1,3 +1,5 @@
+import heapq
+import pickle
 import pytest
 import unittest.mock as mock
 from sjb.td.classes import PriorityEnum
@@ -5,6 +7,7 @@ from sjb.td.classes import Todo
 from sjb.td.classes import TodoMatcher
 from sjb.td.classes import TodoList
 import sjb.common.base as base
+import sjb.common.columns as columns
 
 
 class TestTodo(object):
@@ -132,6 +135,19 @@ class TestTodo(object):
     assert t.finished_date == '1527004113.5411422'
     assert t.oid == 3
 
+  def test_changed_fields(self):
+    t = self.make_todo()
+    assert t.changed_fields == {}
+    t.text = 'new text'
+    t.text = 'newer text'
+    t.tags = set(['tag1', 'tag2'])
+    t.priority = PriorityEnum.DEFAULT
+    assert t.changed_fields == {
+      'text': 'some text', 'priority': PriorityEnum.URGENT}
+    assert t._pop_changes() == {
+      'text': 'some text', 'priority': PriorityEnum.URGENT}
+    assert t.changed_fields == {}
+
 
 class TestTodoList(object):
 
@@ -286,6 +302,14 @@ class TestTodoList(object):
     assert not l.get_item(3).finished
     assert not l.get_item(3).finished_date
 
+  def test_complete_item_reverse_modified(self):
+    l = self.setup_initial_list([Todo(
+      'finished item', oid=3, finished=True, created_date=1.0,
+      finished_date=2.0)])
+    assert not l.modified
+    l.complete_item(3, set_complete=False)
+    assert l.modified
+
   @mock.patch('time.time', mock_time)
   def test_complete_item_already_completed(self):
     l = TodoList()
@@ -391,6 +415,88 @@ class TestTodoList(object):
     assert l.size() == 5
     assert l.tag_set == set(['a','b','c','d'])
 
+  def test_remove_item_many_keeps_order(self):
+    l = self.setup_initial_list(
+      [Todo('item %d' % i, oid=i) for i in range(1, 21)])
+    for oid in [3, 1, 20, 7, 8, 9, 10, 11, 12, 13, 14]:
+      l.remove_item(oid)
+    assert l.size() == 9
+    assert [t.oid for t in l.items] == [2, 4, 5, 6, 15, 16, 17, 18, 19]
+    for t in l.items:
+      assert l.get_item(t.oid) is t
+    with pytest.raises(base.InvalidIDError):
+      l.get_item(9)
+
+  def test_add_items(self):
+    l = self.setup_initial_list([Todo('old', oid=4, tags=set(['a']))])
+    with mock.patch('time.time', mock.Mock(return_value=55.5)) as m:
+      added = l.add_items([Todo('n1', tags=['b']), Todo('n2')])
+      assert m.call_count == 1
+    assert [t.oid for t in added] == [5, 6]
+    assert [t.created_date for t in added] == [55.5, 55.5]
+    assert l.modified_date == 55.5
+    assert l.tag_set == set(['a', 'b'])
+
+  def test_add_items_checks_all_first(self):
+    l = TodoList()
+    with pytest.raises(base.IllegalStateError):
+      l.add_items([Todo('n1'), Todo('n2', created_date=1.0)])
+    assert l.size() == 0
+    with pytest.raises(base.IllegalStateError):
+      l.add_items([Todo('n1', oid=1), Todo('n2', oid=1)], initial_load=True)
+    assert l.size() == 0
+    assert not l.modified
+
+  def test_remove_items(self):
+    l = self.setup_initial_list(
+      [Todo('item %d' % i, oid=i, tags=set(['t%d' % i])) for i in range(1, 8)])
+    removed = l.remove_items([6, 2, 3, 2])
+    assert [t.oid for t in removed] == [6, 2, 3]
+    assert [t.oid for t in l.items] == [1, 4, 5, 7]
+    assert l.tag_set == set(['t1', 't4', 't5', 't7'])
+    assert l.modified
+    with pytest.raises(base.InvalidIDError):
+      l.remove_items([1, 2])
+    assert l.size() == 4
+
+  def test_complete_items(self):
+    l = self.setup_initial_list([
+      Todo('item %d' % i, oid=i, created_date=1.0) for i in range(1, 5)])
+    with mock.patch('time.time', mock.Mock(return_value=77.7)) as m:
+      done = l.complete_items([1, 3])
+      assert m.call_count == 1
+    assert [t.finished_date for t in done] == [77.7, 77.7]
+    assert l.modified_date == 77.7
+    with pytest.raises(base.IllegalStateError):
+      l.complete_items([2, 3])
+    assert not l.get_item(2).finished
+    l.complete_items([1, 3], set_complete=False)
+    assert not l.get_item(1).finished and not l.get_item(3).finished
+
+  def test_update_items(self):
+    l = self.setup_initial_list([
+      Todo('first', oid=1, tags=set(['a'])),
+      Todo('second', oid=2, tags=set(['b'])),
+      Todo('third', oid=3, tags=set(['c']))
+    ])
+    updated = l.update_items([3, 1], tags=['d'])
+    assert [t.oid for t in updated] == [3, 1]
+    assert l.tag_set == set(['b', 'd'])
+    assert l.get_item(1).tags is not l.get_item(3).tags
+    assert l.modified
+
+  def test_select_oids(self):
+    l = self.setup_initial_list([
+      Todo('item %d' % i, oid=i, tags=set(['t%d' % (i % 2)]))
+      for i in [1, 2, 3, 5, 8]])
+    assert l.select_oids([range(2, 7)]) == [2, 3, 5]
+    assert l.select_oids([range(8, 9), range(1, 3)]) == [8, 1, 2]
+    assert l.select_oids(
+      [range(3, 4)], TodoMatcher(tags=['t1'])) == [3, 1, 5]
+    assert l.select_oids([range(40, 50)]) == []
+    with pytest.raises(base.InvalidIDError):
+      l.select_oids([range(4, 5)])
+
   def test_update_item_text(self):
     l = self.setup_initial_list([
       Todo('original text', oid=1, tags=set(['a', 'b'])),
@@ -436,6 +542,17 @@ class TestTodoList(object):
     l.update_item(1, text='first todo item', priority=PriorityEnum.DEFAULT.value, tags=set(['a', 'b']))
     assert not l.modified
 
+  @mock.patch('copy.deepcopy')
+  def test_update_item_no_copy(self, mock_deepcopy):
+    l = self.setup_initial_list([
+      Todo('first todo item', oid=1, tags=set(['a', 'b']))])
+    l.update_item(1, tags=['a', 'b'], text='first todo item')
+    assert not l.modified
+    l.update_item(1, tags=['a'])
+    assert l.modified
+    assert l.tag_set == set(['a'])
+    assert not mock_deepcopy.called
+
   def test_update_item_bad_id(self):
     l = self.setup_initial_list([
       Todo('first todo item', oid=1, tags=set(['a', 'b'])),
@@ -503,6 +620,227 @@ class TestTodoList(object):
     assert lib[0] in ret
     assert lib[4] in ret
 
+  def test_query_tags_answered_by_index(self):
+    lib = [
+      Todo('first todo item', oid=1, tags=set(['d', 'a', 'b'])),
+      Todo('2nd todo item', oid=2, priority=PriorityEnum.URGENT.value),
+      Todo('3rd', oid=10, tags=set(['c'])),
+      Todo('4th', oid=3, finished=True, tags=set(['c'])),
+      Todo('3rd', oid=11, tags=set(['a', 'b', 'e']))
+    ]
+    l = self.setup_initial_list(lib)
+
+    matcher = TodoMatcher(tags=['b', 'e'])
+    with mock.patch.object(
+        TodoMatcher, 'matches', autospec=True,
+        side_effect=TodoMatcher.matches) as m:
+      ret = l.query_items(matcher)
+    assert ret == [lib[4]]
+    assert m.call_count == 0
+    assert l.query_items(TodoMatcher(tags=['a', 'missing'])) == []
+
+  def test_query_tags_after_update(self):
+    l = self.setup_initial_list([
+      Todo('first todo item', oid=1, tags=set(['a', 'b'])),
+      Todo('2nd todo item', oid=2, tags=set(['a']))
+    ])
+    l.update_item(1, tags=set(['c']))
+    assert l.query_items(TodoMatcher(tags=['a'])) == [l.get_item(2)]
+    assert l.query_items(TodoMatcher(tags=['c'])) == [l.get_item(1)]
+
+  def test_query_buckets(self):
+    l = self.setup_initial_list([
+      Todo('a', oid=1, priority=PriorityEnum.URGENT.value),
+      Todo('b', oid=2, priority=PriorityEnum.URGENT.value, finished=True),
+      Todo('c', oid=3),
+    ])
+    with mock.patch.object(
+        Todo, 'priority', create=True, new_callable=mock.PropertyMock) as p:
+      p.side_effect = AssertionError('priority should not be read')
+      matcher = TodoMatcher(priority=PriorityEnum.URGENT.value, finished=False)
+      assert matcher.plan(l) == ({1}, None)
+    assert l.query_items(matcher) == [l.get_item(1)]
+    assert l.lookup('finished', True) == {2}
+    assert l.lookup('priority', PriorityEnum.URGENT.value) == {1, 2}
+    assert l.count('priority', PriorityEnum.DEFAULT.value) == 1
+
+  def test_buckets_follow_changes(self):
+    l = self.setup_initial_list([
+      Todo('a', oid=1, priority=PriorityEnum.URGENT.value),
+      Todo('b', oid=2),
+    ])
+    urgent_open = TodoMatcher(priority=PriorityEnum.URGENT.value, finished=False)
+    l.update_item(2, priority=PriorityEnum.URGENT.value)
+    assert [t.oid for t in l.query_items(urgent_open)] == [1, 2]
+    l.complete_item(1)
+    assert [t.oid for t in l.query_items(urgent_open)] == [2]
+    assert [t.oid for t in l.query_items(TodoMatcher(finished=True))] == [1]
+    l.complete_items([1], set_complete=False)
+    l.remove_item(2)
+    assert [t.oid for t in l.query_items(urgent_open)] == [1]
+    l.add_item(Todo('c', priority=PriorityEnum.URGENT.value))
+    assert [t.oid for t in l.query_items(urgent_open)] == [1, 3]
+    assert l.lookup('finished', True) == set()
+
+  def setup_sort_list(self):
+    return self.setup_initial_list([
+      Todo('a', oid=1, priority=3, created_date=50.0),
+      Todo('b', oid=2, priority=1, created_date=40.0, finished=True,
+           finished_date=90.0),
+      Todo('c', oid=3, priority=2, created_date=30.0),
+      Todo('d', oid=4, priority=1, created_date=20.0, finished=True,
+           finished_date=80.0),
+      Todo('e', oid=5, priority=1, created_date=40.0),
+    ])
+
+  def test_sorted_items(self):
+    l = self.setup_sort_list()
+    oids = lambda items: [t.oid for t in items]
+    assert oids(l.sorted_items('priority')) == [2, 4, 5, 3, 1]
+    assert oids(l.sorted_items('priority', reverse=True)) == [1, 3, 5, 4, 2]
+    assert oids(l.sorted_items('created_date')) == [4, 3, 2, 5, 1]
+    assert oids(l.sorted_items('finished_date')) == [4, 2, 1, 3, 5]
+    assert oids(l.sorted_items('finished_date', reverse=True)) == [
+      2, 4, 5, 3, 1]
+    assert oids(l.sorted_items('created_date', limit=2)) == [4, 3]
+    assert l.sorted_items('priority', limit=0) == []
+    with pytest.raises(base.IllegalStateError):
+      l.sorted_items('text')
+
+  def test_sorted_items_follow_changes(self):
+    l = self.setup_sort_list()
+    l.update_item(1, priority=1)
+    l.complete_item(3)
+    l.remove_item(2)
+    oids = lambda items: [t.oid for t in items]
+    assert oids(l.sorted_items('priority')) == [1, 4, 5, 3]
+    assert oids(l.sorted_items('finished_date')) == [4, 3, 1, 5]
+    assert oids(l.sorted_items('created_date')) == [4, 3, 5, 1]
+
+  def test_top_items(self):
+    l = self.setup_sort_list()
+    open_todos = TodoMatcher(finished=False)
+    assert [t.oid for t in l.top_items(2, item_matcher=open_todos)] == [5, 3]
+    assert [t.oid for t in l.top_items(
+      1, field='created_date', item_matcher=open_todos)] == [3]
+    assert [t.oid for t in l.top_items(
+      5, item_matcher=TodoMatcher(tags=['x']))] == []
+
+  def test_top_items_heap_and_walk_agree(self):
+    l = TodoList()
+    l.add_items([
+      Todo('t%d' % i, oid=i, priority=1 + i % 3, created_date=float(i % 17),
+           tags=['few'] if i % 10 == 0 else ['many'])
+      for i in range(1, 201)], initial_load=True)
+    for tag in ['few', 'many']:
+      matcher = TodoMatcher(tags=[tag])
+      expected = sorted(
+        l.query_items(matcher), key=lambda t: (t.created_date, t.oid))
+      for k in [1, 5, 50, 300]:
+        with mock.patch.object(heapq, 'nsmallest', wraps=heapq.nsmallest) as h:
+          ret = l.top_items(k, field='created_date', item_matcher=matcher)
+        assert ret == expected[:k]
+        # Few candidates are selected with the heap, many by the index.
+        assert h.called == (len(expected) ** 2 < k * l.size())
+
+  def test_iter_items(self):
+    l = self.setup_sort_list()
+    l.remove_item(3)
+    oids = lambda items: [t.oid for t in items]
+    assert oids(l.iter_items()) == [1, 2, 4, 5]
+    assert oids(l.iter_items(TodoMatcher(finished=True))) == [2, 4]
+    assert oids(l.iter_items(limit=2, offset=1)) == [2, 4]
+    assert oids(l.iter_items(offset=10)) == []
+    assert oids(l.iter_items(limit=0)) == []
+
+  def test_iter_items_stops_early(self):
+    l = TodoList.from_dict(self.make_lazy_dict(), lazy=True)
+    with mock.patch.object(Todo, 'from_dict', wraps=Todo.from_dict) as m:
+      items = l.iter_items(TodoMatcher(finished=False), limit=2, offset=1)
+      assert m.call_count == 0
+      assert next(items).oid == 2
+      assert m.call_count == 2
+      assert [t.oid for t in items] == [3]
+      assert m.call_count == 3
+
+  def test_change_events(self):
+    l = self.setup_initial_list([Todo('a', oid=1, tags=['x'])])
+    events = []
+    l.subscribe(events.append)
+    new = l.add_item(Todo('b'))
+    l.update_item(1, text='a2', tags=['x'])
+    l.update_item(1, priority=PriorityEnum.URGENT.value)
+    l.complete_item(new.oid)
+    l.remove_items([1])
+    l.unsubscribe(events.append)
+    l.remove_item(new.oid)
+
+    assert [(e.kind, e.item.oid) for e in events] == [
+      (base.ITEM_ADDED, 2), (base.ITEM_CHANGED, 1), (base.ITEM_CHANGED, 1),
+      (base.ITEM_CHANGED, 2), (base.ITEM_REMOVED, 1)]
+    assert events[0].changes == {}
+    assert events[1].changes == {'text': ('a', 'a2')}
+    assert events[2].changes == {
+      'priority': (PriorityEnum.DEFAULT.value, PriorityEnum.URGENT.value)}
+    assert events[3].changes['finished'] == (False, True)
+    with pytest.raises(ValueError):
+      l.unsubscribe(events.append)
+
+  def test_change_event_sees_updated_indexes(self):
+    l = self.setup_initial_list([Todo('a', oid=1, tags=['x'])])
+    seen = []
+    l.subscribe(lambda e: seen.append(l.tag_set))
+    l.update_item(1, tags=['y'])
+    assert seen == [{'y'}]
+
+  def test_query_exclude_tags(self):
+    lib = [
+      Todo('first todo item', oid=1, tags=set(['d', 'a', 'b'])),
+      Todo('2nd todo item', oid=2, priority=PriorityEnum.URGENT.value),
+      Todo('3rd', oid=10, tags=set(['c'])),
+      Todo('4th', oid=3, finished=True, tags=set(['c'])),
+      Todo('3rd', oid=11, tags=set(['a', 'b', 'e']))
+    ]
+    l = self.setup_initial_list(lib)
+
+    ret = l.query_items(TodoMatcher(exclude_tags=['c', 'e']))
+    assert ret == [lib[0], lib[1]]
+    ret = l.query_items(TodoMatcher(tags=['a'], exclude_tags=['d']))
+    assert ret == [lib[4]]
+    ret = l.query_items(TodoMatcher(exclude_tags=['unknown']))
+    assert ret == lib
+
+  def test_oids_with_tags_after_changes(self):
+    l = self.setup_initial_list([
+      Todo('first todo item', oid=1, tags=set(['a', 'b'])),
+      Todo('2nd todo item', oid=2, tags=set(['a'])),
+      Todo('3rd', oid=3, tags=set(['c']))
+    ])
+    l.update_item(1, tags=['b'])
+    l.remove_item(3)
+    assert l.oids_with_tags(all_of=['a']) == {2}
+    assert l.oids_with_tags(any_of=['b', 'c']) == {1}
+    assert l.oids_with_tags(none_of=['a']) == {1}
+    assert l.oids_with_tags(any_of=['c']) == set()
+
+  def test_unused_tag_bits_are_freed(self):
+    l = self.setup_initial_list([
+      Todo('first', oid=1, tags=set(['a', 'b'])),
+      Todo('second', oid=2, tags=set(['b', 'c'])),
+    ])
+    for i in range(100):
+      l.update_item(1, tags=['a', 'b', 't%d' % i])
+    l.update_item(1, tags=['c'])
+    assert sorted(l._tag_ids.values()) == [0, 1]
+    assert max(l._tag_masks) < 4
+    assert l.oids_with_tags(all_of=['c']) == {1, 2}
+    assert l.oids_with_tags(any_of=['b']) == {2}
+    assert l.oids_with_tags(none_of=['b']) == {1}
+    assert l.oids_with_tags(any_of=['a']) == set()
+    l.remove_item(2)
+    assert list(l._tag_ids) == ['c']
+    assert l.oids_with_tags(all_of=['c']) == {1}
+
   def test_query_tags_finished(self):
     lib = [
       Todo('first todo item', oid=1, tags=set(['d', 'a', 'b'])),
@@ -533,6 +871,70 @@ class TestTodoList(object):
     assert lib[2] in ret
     assert lib[4] in ret
 
+  def make_lazy_dict(self):
+    return {'todo_list': {
+      'version': 'version str',
+      'modified_date': 1234.1234,
+      'todos': [{
+        'oid': i, 'text': 'todo %d' % i, 'tags': ['t%d' % (i % 3)],
+        'priority': 2, 'finished': False, 'created_date': 1.0 + i,
+        'finished_date': None} for i in range(1, 10)]}}
+
+  def test_from_dict_lazy(self):
+    with mock.patch.object(Todo, 'from_dict', wraps=Todo.from_dict) as m:
+      l = TodoList.from_dict(self.make_lazy_dict(), lazy=True)
+      assert m.call_count == 0
+      assert l.size() == 9
+      assert l.tag_set == set(['t0', 't1', 't2'])
+
+      ret = l.query_items(TodoMatcher(tags=['t1']))
+      assert [t.oid for t in ret] == [1, 4, 7]
+      assert m.call_count == 3
+      assert l.get_item(4) is ret[1]
+      assert m.call_count == 3
+
+  def test_from_dict_lazy_same_as_eager(self):
+    lazy = TodoList.from_dict(self.make_lazy_dict(), lazy=True)
+    eager = TodoList.from_dict(self.make_lazy_dict())
+    assert lazy.to_dict() == eager.to_dict()
+
+    lazy.get_item(2)
+    lazy.remove_item(3)
+    eager.remove_item(3)
+    assert lazy.tag_set == eager.tag_set
+    assert (lazy.to_dict()['todo_list']['todos'] ==
+            eager.to_dict()['todo_list']['todos'])
+    assert lazy.items == eager.items
+
+  def test_from_dict_lazy_validates_on_access(self):
+    d = self.make_lazy_dict()
+    d['todo_list']['todos'][4]['priority'] = 'cactus'
+    l = TodoList.from_dict(d, lazy=True)
+    l.get_item(4)
+    with pytest.raises(base.ValidationError):
+      l.get_item(5)
+
+  def test_from_dict_lazy_keeps_columns(self):
+    d = self.make_lazy_dict()
+    l = TodoList.from_dict(d, lazy=True)
+    assert all(type(i) is columns.Row for i in l._items)
+    assert len(l._columns) == 9
+    l.validate()
+    assert all(type(i) is columns.Row for i in l._items)
+
+    l._put_record(dict(d['todo_list']['todos'][0], text='replaced'))
+    l._drop_item(2)
+    assert l.get_item(1).text == 'replaced'
+    assert 2 not in l.lookup('tags', 't2')
+
+    # Rows that are no longer used are dropped from the store.
+    for oid in range(3, 7):
+      l.get_item(oid)
+    assert len(l._columns) < 9
+    assert l.to_dict() == TodoList.from_dict(l.to_dict()).to_dict()
+    assert [t.oid for t in l.items] == [1] + list(range(3, 10))
+    assert len(l._columns) == 0
+
   def run_validate(self, todos):
     l = TodoList()
     for t in todos:
@@ -544,6 +946,54 @@ class TestTodoList(object):
     l.add_item(Todo('some text'))
     l.validate()
 
+  def test_validate_dirty_only_checks_changed(self):
+    l = TodoList.from_dict(self.make_lazy_dict())
+    l.validate()
+    l.add_item(Todo('new'))
+    l.update_item(2, text='changed')
+    l.get_item(3).text = 'changed directly'
+    l.remove_item(4)
+    with mock.patch.object(
+        Todo, '_validate', autospec=True, side_effect=Todo._validate) as m:
+      l.validate_dirty()
+      assert sorted(c[0][0].oid for c in m.call_args_list) == [2, 3, 10]
+      m.reset_mock()
+      # Direct changes stay pending until the list applies them.
+      l.validate_dirty()
+      assert [c[0][0].oid for c in m.call_args_list] == [3]
+
+  def test_items_note_direct_changes(self):
+    l = TodoList.from_dict(self.make_lazy_dict(), lazy=True)
+    l.mark_valid()
+    l.get_item(3).text = 'changed directly'
+    l.get_item(3).priority = 3
+    removed = l.remove_item(4)
+    removed.text = 'changed after removal'
+    l._put_record(dict(l.get_item(5)._to_dict(), text='replayed'))
+    assert l._dirty_oids == {3, 5}
+    l.validate_dirty()
+    assert l._dirty_oids == {3}
+    copy = pickle.loads(pickle.dumps(l))
+    copy.mark_valid()
+    copy.get_item(6).priority = 'cactus'
+    with pytest.raises(base.ValidationError):
+      copy.validate_dirty()
+
+  def test_validate_dirty_catches_invalid_change(self):
+    l = TodoList.from_dict(self.make_lazy_dict())
+    l.mark_valid()
+    l.get_item(5).priority = 'cactus'
+    with pytest.raises(base.ValidationError):
+      l.validate_dirty()
+
+  def test_validate_dirty_skips_unbuilt_records(self):
+    d = self.make_lazy_dict()
+    d['todo_list']['todos'][4]['priority'] = 'cactus'
+    l = TodoList.from_dict(d, lazy=True)
+    l.update_item(2, text='changed')
+    l.validate_dirty()
+    assert l.to_dict()['todo_list']['todos'][4]['priority'] == 'cactus'
+
   def test_validate_okay_not_finished(self):
     self.run_validate([Todo(
       'some text',